@@ -1,6 +1,8 @@
 from django.urls import path
 from django.conf.urls import include
+from v8webconsole.webconsole.views import BatchView
 
 urlpatterns = [
     path('webconsole/', include('v8webconsole.webconsole.urls')),
+    path('batch', BatchView.as_view(), name='batch'),
 ]
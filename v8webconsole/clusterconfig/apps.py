@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class ClusterconfigConfig(AppConfig):
-    name = 'clusterconfig'
+    name = 'v8webconsole.clusterconfig'
+    label = 'clusterconfig'
+
+    def ready(self):
+        # Подключает сброс кэша учетных данных к сигналам моделей
+        from . import credentials  # noqa: F401
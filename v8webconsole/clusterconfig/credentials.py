@@ -0,0 +1,223 @@
+"""
+Учетные данные серверов, кластеров и информационных баз, прочитанные из базы одним запросом.
+
+Вся цепочка учетных данных кластера - адрес сервера, администраторы агента и кластера, администраторы
+информационных баз и администраторы по умолчанию - читается одним запросом UNION ALL из четырех выборок.
+В каждой выборке к кластеру и серверу присоединяется одна таблица учетных данных, поэтому результат
+не разрастается до декартова произведения таблиц, как при их общем соединении.
+
+Прочитанные цепочки хранятся в памяти процесса и сбрасываются сигналами сохранения и удаления моделей
+учетных данных. Изменения, сделанные в других процессах или через QuerySet.update(), сигналов в этом
+процессе не вызывают, поэтому записи кэша живут не дольше V8_CREDENTIALS_CACHE_TTL секунд.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, F, Value
+from django.db.models.signals import post_delete, post_save
+from .models import (
+    Cluster,
+    ClusterCredentials,
+    Host,
+    HostCredentials,
+    InfobaseCredentials,
+    InfobaseDefaultCredentials,
+)
+
+
+Credentials = Tuple[str, str]
+
+NO_CREDENTIALS: Credentials = ('', '')
+
+
+class ResolvedHost(NamedTuple):
+    id: int
+    address: str
+    port: int
+    time_zone: str
+    agent_admin: Credentials
+
+
+class ResolvedCluster(NamedTuple):
+    host: ResolvedHost
+    id: int
+    name: str
+    cluster_admin: Credentials
+    # Первые учетные данные каждой информационной базы по имени базы в нижнем регистре
+    infobase_admins: Dict[str, Credentials]
+    infobase_default_admins: List[Credentials]
+
+    def get_infobase_credentials(self, infobase_name: str) -> List[Credentials]:
+        """
+        Учетные данные администратора информационной базы, либо, если они не заданы,
+        все учетные данные по умолчанию кластера
+        """
+        specific = self.infobase_admins.get(infobase_name.lower())
+        return [specific] if specific is not None else list(self.infobase_default_admins)
+
+
+class CredentialsCache:
+    """
+    Кэш прочитанных цепочек учетных данных с ограниченным временем жизни записей.
+    При ttl=0 кэширование не выполняется.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        if self.ttl <= 0:
+            return loader()
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generation
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        value = loader()
+        with self._lock:
+            # Данные, прочитанные до сброса кэша, могли устареть и не сохраняются
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic(), value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+credentials_cache = CredentialsCache(ttl=settings.V8_CREDENTIALS_CACHE_TTL)
+
+
+def first_credentials(rows: List[Tuple[Optional[int], str, str]]) -> Credentials:
+    """
+    Учетные данные с наименьшим идентификатором из строк (идентификатор, логин, пароль)
+    """
+    rows = [row for row in rows if row[0] is not None]
+    if not rows:
+        return NO_CREDENTIALS
+    _, login, pwd = min(rows)
+    return login, pwd
+
+
+def is_valid_id(value) -> bool:
+    """
+    Может ли идентификатор из URL быть первичным ключом. Запрос с нечисловым ключом завершился бы ValueError
+    """
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def load_host(host_id) -> 'ResolvedHost':
+    if not is_valid_id(host_id):
+        raise Host.DoesNotExist('Host matching query does not exist.')
+    rows = list(Host.objects.filter(id=host_id).values_list(
+        'id', 'address', 'port', 'time_zone',
+        'host_credentials__id', 'host_credentials__login', 'host_credentials__pwd'))
+    if not rows:
+        raise Host.DoesNotExist('Host matching query does not exist.')
+    return ResolvedHost(*rows[0][:4], first_credentials([row[4:] for row in rows]))
+
+
+HOST_ADMIN = 'host'
+CLUSTER_ADMIN = 'cluster'
+INFOBASE_ADMIN = 'infobase'
+INFOBASE_DEFAULT_ADMIN = 'infobase_default'
+
+# Вид учетных данных, связь кластера с их таблицей и есть ли у них имя информационной базы
+CHAIN_RELATIONS = (
+    (HOST_ADMIN, 'host__host_credentials', False),
+    (CLUSTER_ADMIN, 'cluster_credentials', False),
+    (INFOBASE_ADMIN, 'infobase_credentials', True),
+    (INFOBASE_DEFAULT_ADMIN, 'infobase_default_credentials', False),
+)
+
+CHAIN_COLUMNS = ('chain_cluster_id', 'chain_cluster_name', 'chain_host_id', 'chain_address', 'chain_port',
+                 'chain_time_zone', 'chain_kind', 'chain_id', 'chain_name', 'chain_login', 'chain_pwd')
+
+
+def chain_query(clusters, kind: str, relation: str, named: bool):
+    """
+    Выборка кластеров с сервером и одной таблицей учетных данных. Колонки всех выборок совпадают,
+    кластер без учетных данных этого вида дает одну строку с пустыми колонками учетных данных
+    """
+    return clusters.annotate(
+        chain_cluster_id=F('id'),
+        chain_cluster_name=F('name'),
+        chain_host_id=F('host__id'),
+        chain_address=F('host__address'),
+        chain_port=F('host__port'),
+        chain_time_zone=F('host__time_zone'),
+        chain_kind=Value(kind, output_field=CharField()),
+        chain_id=F(f'{relation}__id'),
+        chain_name=F(f'{relation}__name') if named else Value('', output_field=CharField()),
+        chain_login=F(f'{relation}__login'),
+        chain_pwd=F(f'{relation}__pwd'),
+    ).values_list(*CHAIN_COLUMNS)
+
+
+def load_cluster(host_id, cluster_name: str) -> 'ResolvedCluster':
+    if not is_valid_id(host_id):
+        raise Cluster.DoesNotExist('Cluster matching query does not exist.')
+    clusters = Cluster.objects.filter(host_id=host_id, name__iexact=cluster_name)
+    queries = [chain_query(clusters, *relation) for relation in CHAIN_RELATIONS]
+    rows = list(queries[0].union(*queries[1:], all=True))
+    if not rows:
+        raise Cluster.DoesNotExist('Cluster matching query does not exist.')
+    # Из кластеров, имена которых различаются только регистром, выбирается первый
+    cluster_id = min(row[0] for row in rows)
+    rows = [row for row in rows if row[0] == cluster_id]
+    _, name, host_id, address, port, time_zone = rows[0][:6]
+    by_kind: Dict[str, List[tuple]] = {kind: [] for kind, _, _ in CHAIN_RELATIONS}
+    for row in sorted(row for row in rows if row[7] is not None):
+        by_kind[row[6]].append(row[7:])
+    infobase_admins: Dict[str, Credentials] = {}
+    for _, infobase_name, login, pwd in by_kind[INFOBASE_ADMIN]:
+        infobase_admins.setdefault(infobase_name.lower(), (login, pwd))
+    return ResolvedCluster(
+        host=ResolvedHost(host_id, address, port, time_zone,
+                          first_credentials([(id_, login, pwd) for id_, _, login, pwd in by_kind[HOST_ADMIN]])),
+        id=cluster_id,
+        name=name,
+        cluster_admin=first_credentials([(id_, login, pwd) for id_, _, login, pwd in by_kind[CLUSTER_ADMIN]]),
+        infobase_admins=infobase_admins,
+        infobase_default_admins=[(login, pwd) for _, _, login, pwd in by_kind[INFOBASE_DEFAULT_ADMIN]],
+    )
+
+
+def resolve_host(host_id) -> 'ResolvedHost':
+    """
+    Адрес сервера и учетные данные администратора агента
+    """
+    return credentials_cache.get(('host', str(host_id)), lambda: load_host(host_id))
+
+
+def resolve_cluster(host_id, cluster_name: str) -> 'ResolvedCluster':
+    """
+    Цепочка учетных данных кластера (имя без учета регистра) вместе с его сервером
+    """
+    return credentials_cache.get(('cluster', str(host_id), cluster_name.lower()),
+                                 lambda: load_cluster(host_id, cluster_name))
+
+
+CREDENTIALS_MODELS = (Host, HostCredentials, Cluster, ClusterCredentials,
+                      InfobaseCredentials, InfobaseDefaultCredentials)
+
+
+def reset_credentials_cache(sender, **kwargs):
+    credentials_cache.clear()
+    # Данные, прочитанные до фиксации транзакции другими соединениями, тоже устарели
+    transaction.on_commit(credentials_cache.clear, using=kwargs.get('using'))
+
+
+for model in CREDENTIALS_MODELS:
+    post_save.connect(reset_credentials_cache, sender=model, dispatch_uid=f'credentials_cache_{model.__name__}')
+    post_delete.connect(reset_credentials_cache, sender=model, dispatch_uid=f'credentials_cache_{model.__name__}')
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import v8webconsole.clusterconfig.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clusterconfig', '0004_auto_20191118_1100'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='time_zone',
+            field=models.CharField(blank=True, help_text='Time zone of the server, e.g. Europe/Moscow. Empty - V8_SERVER_TIME_ZONE', max_length=63, validators=[v8webconsole.clusterconfig.models.validate_time_zone]),
+        ),
+    ]
@@ -1,9 +1,41 @@
+from datetime import datetime, tzinfo
+from typing import Optional
+import pytz
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+
+
+def validate_time_zone(value: str):
+    if value and value not in pytz.all_timezones_set:
+        raise ValidationError(f'Unknown time zone "{value}"')
+
+
+def get_server_timezone(time_zone: str = '') -> 'tzinfo':
+    """
+    Часовой пояс сервера 1С. Пустая строка - часовой пояс по умолчанию V8_SERVER_TIME_ZONE
+    """
+    return pytz.timezone(time_zone or settings.V8_SERVER_TIME_ZONE)
+
+
+def to_server_time(value: Optional['datetime'], time_zone: str = '') -> Optional['datetime']:
+    """
+    Агент сервера принимает и возвращает местное время сервера без часового пояса.
+    Время с часовым поясом переводится в часовой пояс сервера, время без часового пояса
+    считается уже заданным в нем
+    """
+    if value is None or timezone.is_naive(value):
+        return value
+    return timezone.make_naive(value, get_server_timezone(time_zone))
 
 
 class Host(models.Model):
     address = models.CharField(max_length=100)
     port = models.IntegerField()
+    time_zone = models.CharField(max_length=63, blank=True, validators=[validate_time_zone],
+                                 help_text='Time zone of the server, e.g. Europe/Moscow. '
+                                           'Empty - V8_SERVER_TIME_ZONE')
 
     def __str__(self):
         return f'{self.address}:{self.port}'
@@ -1,3 +1,93 @@
 from django.test import TestCase
+from .credentials import (
+    CredentialsCache,
+    credentials_cache,
+    resolve_cluster,
+    resolve_host,
+)
+from .models import (
+    Cluster,
+    ClusterCredentials,
+    Host,
+    HostCredentials,
+    InfobaseCredentials,
+    InfobaseDefaultCredentials,
+)
 
-# Create your tests here.
+
+class CredentialsCacheTest(TestCase):
+
+    def setUp(self):
+        credentials_cache.clear()
+        self.addCleanup(credentials_cache.clear)
+        self.host = Host.objects.create(address='srv1', port=1540)
+        HostCredentials.objects.create(host=self.host, login='agent', pwd='agent-pwd')
+        self.cluster = Cluster.objects.create(host=self.host, name='Local cluster')
+        self.cluster_credentials = ClusterCredentials.objects.create(cluster=self.cluster, login='admin', pwd='pwd')
+        self.infobase_credentials = InfobaseCredentials.objects.create(
+            cluster=self.cluster, name='ib0001', login='ib-admin', pwd='ib-pwd')
+        InfobaseDefaultCredentials.objects.create(cluster=self.cluster, login='default', pwd='default-pwd')
+
+    def resolve(self):
+        return resolve_cluster(self.host.id, 'LOCAL CLUSTER')
+
+    def test_chain_is_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            cluster = self.resolve()
+        self.assertEqual(cluster.id, self.cluster.id)
+        self.assertEqual(cluster.host.agent_admin, ('agent', 'agent-pwd'))
+        self.assertEqual(cluster.cluster_admin, ('admin', 'pwd'))
+        self.assertEqual(cluster.get_infobase_credentials('IB0001'), [('ib-admin', 'ib-pwd')])
+        self.assertEqual(cluster.get_infobase_credentials('ib0002'), [('default', 'default-pwd')])
+
+    def test_chain_is_cached(self):
+        self.resolve()
+        resolve_host(self.host.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve().cluster_admin, ('admin', 'pwd'))
+            self.assertEqual(resolve_host(self.host.id).address, 'srv1')
+
+    def test_saved_credentials_reset_cache(self):
+        self.resolve()
+        self.cluster_credentials.pwd = 'new-pwd'
+        self.cluster_credentials.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve().cluster_admin, ('admin', 'new-pwd'))
+
+    def test_deleted_credentials_reset_cache(self):
+        self.resolve()
+        self.infobase_credentials.delete()
+        self.assertEqual(self.resolve().get_infobase_credentials('ib0001'), [('default', 'default-pwd')])
+
+    def test_saved_host_resets_cache(self):
+        resolve_host(self.host.id)
+        self.host.time_zone = 'Europe/Moscow'
+        self.host.save()
+        self.assertEqual(resolve_host(self.host.id).time_zone, 'Europe/Moscow')
+        self.assertEqual(self.resolve().host.time_zone, 'Europe/Moscow')
+
+    def test_deleted_cluster_is_not_resolved(self):
+        self.resolve()
+        self.cluster.delete()
+        with self.assertRaises(Cluster.DoesNotExist):
+            self.resolve()
+
+    def test_non_numeric_host_is_not_found(self):
+        with self.assertNumQueries(0), self.assertRaises(Host.DoesNotExist):
+            resolve_host('abc')
+
+    def test_value_loaded_before_reset_is_not_stored(self):
+        cache = CredentialsCache(ttl=60)
+
+        def load():
+            # Сброс кэша во время чтения: прочитанное значение могло устареть
+            cache.clear()
+            return 'stale'
+
+        self.assertEqual(cache.get('key', load), 'stale')
+        self.assertEqual(cache.get('key', lambda: 'fresh'), 'fresh')
+
+    def test_zero_ttl_disables_cache(self):
+        cache = CredentialsCache(ttl=0)
+        cache.get('key', lambda: 'first')
+        self.assertEqual(cache.get('key', lambda: 'second'), 'second')
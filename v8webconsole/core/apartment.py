@@ -0,0 +1,160 @@
+"""
+Выполнение работы с COM-объектами в выделенных потоках-апартаментах.
+
+Любые COM-объекты привязаны к апартаменту потока, в котором они созданы, и не могут быть
+переданы между потоками напрямую. Поэтому все обращения к серверам 1С выполняются рабочими потоками
+исполнителя: каждый поток один раз вызывает CoInitialize и владеет созданными в нем соединениями,
+а потоки обработки запросов передают ему задания и получают обратно результат в виде обычных данных Python.
+
+Задания с одинаковым ключом (например, адрес агента) выполняются ограниченным набором из key_workers рабочих потоков,
+что позволяет повторно использовать созданные в них соединения. Из набора выбирается наименее загруженный поток,
+поэтому долгое обращение к одному серверу не задерживает остальные запросы к нему.
+"""
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional
+
+from .comcntr import (
+    co_initialize,
+    co_uninitialize,
+)
+
+
+class _Worker:
+
+    def __init__(self, name: str):
+        self.queue = queue.Queue()
+        self.busy = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    @property
+    def load(self) -> int:
+        return self.queue.qsize() + int(self.busy)
+
+    def _run(self):
+        co_initialize()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                future, ctx, fn, args, kwargs = item
+                self.busy = True
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = ctx.run(fn, *args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+                self.busy = False
+                del item, future, ctx, fn, args, kwargs
+        finally:
+            co_uninitialize()
+
+
+class COMApartmentExecutor:
+    """
+    Пул рабочих потоков-апартаментов.
+    При workers=0 задания выполняются непосредственно в вызывающем потоке.
+    key_workers - число рабочих потоков, между которыми распределяются задания с одним ключом.
+    """
+
+    def __init__(self, workers: int = 4, name: str = 'com-apartment', key_workers: int = 1):
+        self.workers = workers
+        self.name = name
+        self.key_workers = max(key_workers, 1)
+        self._workers: List[_Worker] = []
+        self._worker_threads = set()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._workers or self.workers <= 0:
+            return
+        with self._lock:
+            if not self._workers:
+                workers = [_Worker(f'{self.name}-{i}') for i in range(self.workers)]
+                self._worker_threads = {w.thread.ident for w in workers}
+                self._workers = workers
+
+    def in_worker(self) -> bool:
+        """
+        Выполняется ли текущий код в одном из рабочих потоков исполнителя
+        """
+        return threading.get_ident() in self._worker_threads
+
+    def _select_worker(self, key: Optional[Hashable]) -> '_Worker':
+        if key is None:
+            # Задание без ключа из рабочего потока предназначено для выполнения параллельно с ним
+            current = threading.get_ident()
+            workers = [w for w in self._workers if w.thread.ident != current] or self._workers
+            return min(workers, key=lambda w: w.load)
+        count = len(self._workers)
+        start = hash(key) % count
+        workers = [self._workers[(start + i) % count] for i in range(min(self.key_workers, count))]
+        current = threading.get_ident()
+        for w in workers:
+            if w.thread.ident == current:
+                # Вложенное задание выполняется в текущем потоке, не занимая другой поток набора
+                return w
+        return min(workers, key=lambda w: w.load)
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args, **kwargs) -> Future:
+        """
+        Ставит задание в очередь рабочего потока.
+        :param key: ключ привязки к рабочему потоку. None - наименее загруженный поток.
+        Контекстные переменные вызывающего потока доступны заданию.
+        """
+        self._ensure_started()
+        future = Future()
+        ctx = contextvars.copy_context()
+        if not self._workers:
+            return self._run_inline(future, ctx, fn, args, kwargs)
+        worker = self._select_worker(key)
+        if worker.thread.ident == threading.get_ident():
+            # Ожидание собственной очереди привело бы к взаимоблокировке
+            return self._run_inline(future, ctx, fn, args, kwargs)
+        worker.queue.put((future, ctx, fn, args, kwargs))
+        return future
+
+    def submit_to_thread(self, thread_id: int, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Ставит задание в очередь рабочего потока с указанным идентификатором, например, для освобождения
+        созданных в нем соединений. Если такого потока нет, задание выполняется в вызывающем потоке
+        """
+        future = Future()
+        ctx = contextvars.copy_context()
+        worker = next((w for w in self._workers if w.thread.ident == thread_id), None)
+        if worker is None or thread_id == threading.get_ident():
+            return self._run_inline(future, ctx, fn, args, kwargs)
+        worker.queue.put((future, ctx, fn, args, kwargs))
+        return future
+
+    def call(self, key: Optional[Hashable], fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Выполняет задание в рабочем потоке и ожидает результат
+        """
+        return self.submit(key, fn, *args, **kwargs).result(timeout)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._worker_threads = set()
+        for w in workers:
+            w.queue.put(None)
+        if wait:
+            for w in workers:
+                w.thread.join()
+
+    @staticmethod
+    def _run_inline(future: Future, ctx, fn, args, kwargs) -> Future:
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(ctx.run(fn, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
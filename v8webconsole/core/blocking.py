@@ -0,0 +1,226 @@
+"""
+Анализ цепочек блокировок сеансов.
+
+Свойства сеанса blockedByDBMS и blockedByLS содержат номер сеанса той же информационной базы,
+блокировка которого в СУБД или в менеджере управляемых блокировок задерживает данный сеанс.
+По одному снимку сеансов кластера строится граф "заблокированный сеанс -> блокирующий сеанс",
+в котором находятся корневые блокирующие сеансы, глубина цепочек и взаимные блокировки (циклы).
+
+Граф строится только по снимкам и не требует обращений к агенту сервера, поэтому анализ можно
+повторять как угодно часто по снимку фонового опроса. Для получения свежего снимка функция
+take_blocking_snapshots читает у каждого сеанса только свойства, необходимые для построения графа,
+а остальные свойства отчета - только у сеансов, участвующих в блокировках.
+"""
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .comcntr import Session
+from .snapshots import SessionSnapshot
+
+
+SessionKey = Tuple[str, int]
+
+# Свойства, достаточные для построения графа
+BLOCKING_KEY_FIELDS = ('infobase', 'session_id', 'blocked_by_dbms', 'blocked_by_ls')
+
+# Свойства сеансов, участвующих в блокировках
+BLOCKING_DETAIL_FIELDS = ('user_name', 'app_id', 'host', 'db_proc_info', 'db_proc_took', 'duration_current_dbms')
+
+BLOCKING_REPORT_FIELDS = ('infobase', 'session_id') + BLOCKING_DETAIL_FIELDS
+
+
+def session_key(snapshot: 'SessionSnapshot') -> 'SessionKey':
+    return (snapshot.infobase or '').lower(), snapshot.session_id
+
+
+def blockers_of(snapshot: 'SessionSnapshot') -> List[Tuple[str, 'SessionKey']]:
+    """
+    Блокирующие сеансы в виде пар (вид блокировки, ключ сеанса)
+    """
+    infobase = (snapshot.infobase or '').lower()
+    result = []
+    if snapshot.blocked_by_dbms:
+        result.append(('dbms', (infobase, snapshot.blocked_by_dbms)))
+    if snapshot.blocked_by_ls:
+        result.append(('ls', (infobase, snapshot.blocked_by_ls)))
+    return result
+
+
+def take_blocking_snapshots(sessions: Iterable['Session']) -> List['SessionSnapshot']:
+    """
+    Снимки сеансов для анализа блокировок. Свойства BLOCKING_DETAIL_FIELDS читаются
+    только у заблокированных и блокирующих сеансов
+    """
+    items = []
+    involved: Set['SessionKey'] = set()
+    for session in sessions:
+        iv8obj = session.get_underlying_com_object()
+        snapshot = SessionSnapshot.from_raw(iv8obj, BLOCKING_KEY_FIELDS)
+        blockers = blockers_of(snapshot)
+        if blockers:
+            involved.add(session_key(snapshot))
+            involved.update(key for _, key in blockers)
+        items.append((iv8obj, snapshot))
+    for iv8obj, snapshot in items:
+        if session_key(snapshot) in involved:
+            snapshot.fetch(iv8obj, BLOCKING_DETAIL_FIELDS)
+    return [snapshot for _, snapshot in items]
+
+
+class BlockingGraph:
+    """
+    Граф блокировок одного снимка сеансов.
+    Сильно связные компоненты графа (взаимные блокировки) рассматриваются как один узел:
+    компонента, не ожидающая других компонент, является корнем, глубина остальных
+    на единицу больше наибольшей глубины компонент, которых они ожидают.
+    Сеансы взаимной блокировки, не ожидающей других сеансов, являются корнями и одновременно
+    заблокированы друг другом, поэтому учитываются среди сеансов, ожидающих этот корень
+    """
+
+    def __init__(self, snapshots: Iterable['SessionSnapshot']):
+        self.snapshots: Dict['SessionKey', 'SessionSnapshot'] = {}
+        self.edges: Dict['SessionKey', List[Tuple[str, 'SessionKey']]] = {}
+        for snapshot in snapshots:
+            key = session_key(snapshot)
+            self.snapshots[key] = snapshot
+            blockers = [(kind, blocker) for kind, blocker in blockers_of(snapshot) if blocker != key]
+            if blockers:
+                self.edges[key] = blockers
+        # Блокирующий сеанс мог завершиться после получения снимка, он остается в графе без снимка
+        self.nodes: List['SessionKey'] = list(self.edges)
+        seen = set(self.nodes)
+        for blockers in self.edges.values():
+            for _, blocker in blockers:
+                if blocker not in seen:
+                    seen.add(blocker)
+                    self.nodes.append(blocker)
+        self.components: List[List['SessionKey']] = []
+        self.component_of: Dict['SessionKey', int] = {}
+        self.depth: Dict[int, int] = {}
+        self.roots: Dict[int, Set[int]] = {}
+        self._find_components()
+        self._measure()
+
+    def _successors(self, key: 'SessionKey') -> List['SessionKey']:
+        return [blocker for _, blocker in self.edges.get(key, ())]
+
+    def _find_components(self):
+        """
+        Алгоритм Тарьяна без рекурсии. Компоненты получаются в порядке, при котором компонента
+        следует после всех компонент, которых она ожидает
+        """
+        index: Dict['SessionKey', int] = {}
+        lowlink: Dict['SessionKey', int] = {}
+        stack: List['SessionKey'] = []
+        on_stack: Set['SessionKey'] = set()
+        for start in self.nodes:
+            if start in index:
+                continue
+            work = [(start, iter(self._successors(start)))]
+            index[start] = lowlink[start] = len(index)
+            stack.append(start)
+            on_stack.add(start)
+            while work:
+                node, successors = work[-1]
+                pushed = False
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = lowlink[successor] = len(index)
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(self._successors(successor))))
+                        pushed = True
+                        break
+                    if successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                if pushed:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        self.component_of[member] = len(self.components)
+                        component.append(member)
+                        if member == node:
+                            break
+                    self.components.append(component)
+
+    def _measure(self):
+        for c, component in enumerate(self.components):
+            waits_for = {self.component_of[blocker]
+                         for member in component for blocker in self._successors(member)} - {c}
+            if not waits_for:
+                self.depth[c] = 0
+                self.roots[c] = {c}
+            else:
+                self.depth[c] = 1 + max(self.depth[w] for w in waits_for)
+                self.roots[c] = set().union(*(self.roots[w] for w in waits_for))
+
+    @property
+    def cycles(self) -> List[List['SessionKey']]:
+        return [component for component in self.components if len(component) > 1]
+
+    @property
+    def max_depth(self) -> int:
+        return max(self.depth.values(), default=0)
+
+    @staticmethod
+    def key_data(key: 'SessionKey') -> dict:
+        """
+        Номер сеанса уникален только в пределах информационной базы, поэтому ссылки на сеансы содержат и базу
+        """
+        return {'infobase': key[0], 'session_id': key[1]}
+
+    def session_data(self, key: 'SessionKey') -> dict:
+        snapshot = self.snapshots.get(key)
+        data = {'infobase': snapshot.infobase if snapshot is not None else key[0], 'session_id': key[1]}
+        for name in BLOCKING_REPORT_FIELDS[2:]:
+            data[name] = getattr(snapshot, name, None) if snapshot is not None else None
+        data['exists'] = snapshot is not None
+        return data
+
+    def to_dict(self) -> dict:
+        # Количество сеансов, ожидающих корень прямо или через другие сеансы, и наибольшая глубина его цепочек
+        blocked_count: Dict[int, int] = {}
+        chain_depth: Dict[int, int] = {}
+        for key in self.edges:
+            c = self.component_of[key]
+            for root in self.roots[c]:
+                if root == c and len(self.components[c]) == 1:
+                    continue
+                blocked_count[root] = blocked_count.get(root, 0) + 1
+                chain_depth[root] = max(chain_depth.get(root, 0), self.depth[c])
+        roots = []
+        for c in blocked_count:
+            component = self.components[c]
+            for key in component:
+                roots.append({**self.session_data(key), 'blocked': blocked_count[c], 'depth': chain_depth[c],
+                              'deadlock': len(component) > 1})
+        roots.sort(key=lambda root: (-root['blocked'], root['infobase'], root['session_id']))
+        blocked = []
+        for key, blockers in self.edges.items():
+            c = self.component_of[key]
+            blocked.append({
+                **self.session_data(key),
+                'blocked_by': [{'kind': kind, 'session_id': blocker[1]} for kind, blocker in blockers],
+                'depth': self.depth[c],
+                'roots': [self.key_data(root_key)
+                          for root_key in sorted(root_key for r in self.roots[c] for root_key in self.components[r])],
+            })
+        blocked.sort(key=lambda item: (-item['depth'], item['infobase'], item['session_id']))
+        return {
+            'sessions': len(self.snapshots),
+            'blocked': len(self.edges),
+            'max_depth': self.max_depth,
+            'roots': roots,
+            'blocked_sessions': blocked,
+            'cycles': [[self.key_data(key) for key in sorted(cycle)] for cycle in self.cycles],
+        }
+
+
+def analyze_blocking(snapshots: Iterable['SessionSnapshot']) -> dict:
+    return BlockingGraph(snapshots).to_dict()
@@ -12,8 +12,11 @@ import logging
 Для того чтобы зарегистрировать ComConnector в 64 разрядной операционной системе Windows выполняется
 команда: regsvr32 "C:\\Program Files (x86)\\1cv8\\[version]\\bin\\comcntr.dll" 
 """
-from typing import Tuple, List
+import time
+from datetime import datetime
+from typing import Iterable, Tuple, List, Optional
 from .comcntr import (
+    EMPTY_DATE,
     COMConnector,
     ServerAgentConnection,
     WorkingProcessConnection,
@@ -21,23 +24,65 @@ from .comcntr import (
     InfobaseShort,
     Infobase,
     RegUser,
+    Session,
+    WorkingProcess,
 )
 from .exceptions import ClusterAdminAuthRequired
+from .inventory import InventoryCache
+from .pool import PooledConnection, WorkingProcessConnectionPool
+from .snapshots import WorkingProcessSnapshot
+
+
+WORKING_PROCESS_SELECTION_FIELDS = (
+    'available_performance', 'connections', 'hostname', 'is_enable', 'main_port', 'memory_size', 'pid', 'running',
+)
+
+
+def select_working_process(working_processes: List['WorkingProcess']) -> 'WorkingProcessSnapshot':
+    """
+    Выбирает наименее загруженный рабочий процесс среди активных и включенных:
+    с наибольшей доступной производительностью, при ее равенстве - с наименьшим числом соединений,
+    затем - с наименьшим объемом занятой памяти.
+    Если включенных процессов нет, выбор выполняется среди всех активных.
+    :return: снимок выбранного рабочего процесса
+    """
+    running = [wp for wp in (WorkingProcessSnapshot.from_com(wp, WORKING_PROCESS_SELECTION_FIELDS)
+                             for wp in working_processes) if wp.running == 1]
+    if not running:
+        raise StopIteration('There are no running working processes')
+    candidates = [wp for wp in running if wp.is_enable] or running
+    return min(candidates, key=lambda wp: (-wp.available_performance, wp.connections, wp.memory_size))
 
 
 class ServerAgentControlInterface:
 
-    def __init__(self, host: str, port: int = 1540):
-        self.V8COMConnector = COMConnector()
+    def __init__(self, host: str, port: int = 1540,
+                 v8comconnector: Optional['COMConnector'] = None,
+                 agent_connection: Optional['ServerAgentConnection'] = None,
+                 inventory_cache: Optional['InventoryCache'] = None,
+                 working_process_pool: Optional['WorkingProcessConnectionPool'] = None):
+        """
+        :param v8comconnector: уже созданный COMConnector, например, полученный из пула соединений
+        :param agent_connection: уже установленное соединение с агентом этого сервера
+        :param inventory_cache: кэш списков кластеров и информационных баз. По умолчанию списки не кэшируются
+        :param working_process_pool: пул соединений с рабочими процессами для интерфейсов кластеров
+        """
+        self.V8COMConnector = v8comconnector or COMConnector()
         self.host = host
         self.agent_port = str(port)
-        self.agent_connection = self.V8COMConnector.connect_agent(f'tcp://{host}:{port}')
+        self.agent_connection = agent_connection or self.V8COMConnector.connect_agent(f'tcp://{host}:{port}')
+        self.inventory_cache = inventory_cache or InventoryCache(ttl=0)
+        self.working_process_pool = working_process_pool
         self.__authenticated = False
 
     def authenticate_agent(self, login, password):
         self.agent_connection.authenticate_agent(login, password)
         self.__authenticated = True
 
+    @property
+    def agent_authenticated(self):
+        return self.__authenticated
+
     def get_agent_admins(self) -> List['RegUser']:
         """
         Получает список администраторов центрального сервера.
@@ -54,30 +99,48 @@ class ServerAgentControlInterface:
         ))
 
     def get_cluster_interface(self, cluster_name: str) -> 'ClusterControlInterface':
-        return ClusterControlInterface(self.host,
-                                       self.V8COMConnector, self.agent_connection, self.get_cluster(cluster_name))
+        return ClusterControlInterface(self.host, self.V8COMConnector, self.agent_connection,
+                                       self.get_cluster(cluster_name), **self.__cluster_interface_kwargs())
 
     def get_cluster_interfaces(self) -> List['ClusterControlInterface']:
-        return [ClusterControlInterface(self.host, self.V8COMConnector, self.agent_connection, cluster)
+        return [ClusterControlInterface(self.host, self.V8COMConnector, self.agent_connection, cluster,
+                                        **self.__cluster_interface_kwargs())
                 for cluster in self.get_clusters()]
 
+    def __cluster_interface_kwargs(self) -> dict:
+        return dict(agent_port=self.agent_port, inventory_cache=self.inventory_cache,
+                    working_process_pool=self.working_process_pool)
+
+    def __get_clusters_entry(self):
+        return self.inventory_cache.get(
+            (self.host, self.agent_port, 'clusters'),
+            self.agent_connection.get_clusters,
+            lambda cluster: cluster.cluster_name,
+        )
+
     def get_clusters(self) -> List['Cluster']:
         """
         Получает список кластеров
         """
-        return self.agent_connection.get_clusters()
+        return list(self.__get_clusters_entry().items)
 
     def get_cluster(self, cluster_name: str) -> 'Cluster':
         """
         Получает кластер по его имени
         """
-        return next(filter(
-            lambda cluster: cluster.cluster_name.lower() == cluster_name.lower(),
-            self.get_clusters()
-        ))
+        return self.__get_clusters_entry().find(cluster_name)
+
+    def invalidate_inventory(self):
+        """
+        Сбрасывает закэшированные списки кластеров и информационных баз этого сервера
+        """
+        self.inventory_cache.invalidate(self.host, self.agent_port)
 
     def reg_cluster(self, cluster: 'Cluster'):
-        self.agent_connection.reg_cluster(cluster)
+        try:
+            self.agent_connection.reg_cluster(cluster)
+        finally:
+            self.invalidate_inventory()
 
     def unreg_cluster(self, cluster: 'Cluster', login, pwd):
         """
@@ -88,21 +151,36 @@ class ServerAgentControlInterface:
         :param pwd: пароль администратора кластера
         """
         self.agent_connection.authenticate(cluster, login, pwd)
-        self.agent_connection.unreg_cluster(cluster)
+        try:
+            self.agent_connection.unreg_cluster(cluster)
+        finally:
+            self.invalidate_inventory()
 
 
 class ClusterControlInterface:
+    # Как часто (в секундах) проверять, что выбранный рабочий процесс не был перезапущен или выключен
+    working_process_check_interval = 30
 
     def __init__(self, host: str,
-                 v8comconnector: 'COMConnector', agent_connection: 'ServerAgentConnection',  cluster: 'Cluster'):
+                 v8comconnector: 'COMConnector', agent_connection: 'ServerAgentConnection',  cluster: 'Cluster',
+                 agent_port: str = '1540', inventory_cache: Optional['InventoryCache'] = None,
+                 working_process_pool: Optional['WorkingProcessConnectionPool'] = None):
+        """
+        :param working_process_pool: пул соединений с рабочими процессами. Если не задан,
+        соединение с рабочим процессом устанавливается заново для каждого интерфейса
+        """
         self.host = host  # TODO: это некорректно, необходимо придумать способ лучше
+        self.agent_port = str(agent_port)
         self.V8COMConnector = v8comconnector
         self.agent_connection = agent_connection
         self.cluster = cluster
         self.cluster_admin_name = None
         self.cluster_admin_pwd = None
+        self.inventory_cache = inventory_cache or InventoryCache(ttl=0)
+        self.working_process_pool = working_process_pool
         self.__cluster_auth_passed = False
-        self.__working_process_connection = None
+        self.__working_process_lease: Optional['PooledConnection'] = None
+        self.__infobase_auth = set()
 
     def authenticate_cluster_admin(self, cluster_admin_name: str, cluster_admin_pwd: str):
         """
@@ -123,51 +201,159 @@ class ClusterControlInterface:
         return self.__cluster_auth_passed
 
     @property
-    def working_process_connection(self) -> 'WorkingProcessConnection':
-        if self.__working_process_connection:
-            return self.__working_process_connection
-        self.__check_cluster_auth()
-        working_process = next(filter(
-            lambda wp: wp.running == 1,
-            self.agent_connection.get_working_processes(self.cluster)
-        ))
-        # TODO: корректнее будет использовать working_process.hostname, но есть ньюансы
-        working_process_host = self.host
+    def working_process(self) -> Optional['WorkingProcessSnapshot']:
+        """
+        Снимок рабочего процесса, с которым установлено административное соединение
+        """
+        lease = self.__working_process_lease
+        return lease.state['working_process'] if lease is not None else None
+
+    @property
+    def working_process_pool_key(self) -> tuple:
+        return self.host, self.agent_port, self.cluster.cluster_name.lower()
+
+    def __connect_working_process(self, key) -> 'PooledConnection':
+        working_process = select_working_process(self.agent_connection.get_working_processes(self.cluster))
+        # Имя компьютера рабочего процесса может быть пустым у процесса, запущенного на центральном сервере
+        working_process_host = working_process.hostname or self.host
         working_process_port = str(working_process.main_port)
         working_process_connection = self.V8COMConnector.connect_working_process(
             f'tcp://{working_process_host}:{working_process_port}'
         )
-        # Выполняет аутентификацию администратора кластера.
-        # Администратор кластера должен быть аутентифицирован для создания в этом кластере новой информационной базы.
-        working_process_connection.authenticate_admin(self.cluster_admin_name, self.cluster_admin_pwd)
-        self.__working_process_connection = working_process_connection
-        return self.__working_process_connection
+        lease = PooledConnection(key, self.V8COMConnector, working_process_connection)
+        lease.state['working_process'] = working_process
+        lease.state['working_process_checked_at'] = time.monotonic()
+        # Учетные данные, по которым уже выполнена аутентификация в этом соединении
+        lease.state['admin'] = None
+        lease.state['infobase_auth'] = set()
+        return lease
+
+    def __is_working_process_current(self, lease: 'PooledConnection') -> bool:
+        now = time.monotonic()
+        if now - lease.state['working_process_checked_at'] < self.working_process_check_interval:
+            return True
+        lease.state['working_process_checked_at'] = now
+        selected = lease.state['working_process']
+        for wp in self.agent_connection.get_working_processes(self.cluster):
+            wp = WorkingProcessSnapshot.from_com(wp, ('hostname', 'is_enable', 'main_port', 'pid', 'running'))
+            if (wp.pid, wp.main_port, wp.hostname) == (selected.pid, selected.main_port, selected.hostname):
+                return wp.running == 1 and bool(wp.is_enable)
+        return False
+
+    def __is_working_process_lease_allowed(self, lease: 'PooledConnection') -> bool:
+        # Аутентификации в соединении нельзя отменить. Соединение, аутентифицированное в информационных базах
+        # с учетными данными, которых нет у этого интерфейса, дало бы доступ к чужим базам и к чужому списку
+        # в кэше, поэтому выдается только соединение с подмножеством учетных данных интерфейса
+        return lease.state['infobase_auth'] <= self.__infobase_auth
+
+    def __authenticate_working_process_connection(self, lease: 'PooledConnection'):
+        # Аутентификация выполняется, только если соединение еще не аутентифицировано с этими учетными данными
+        admin = (self.cluster_admin_name, self.cluster_admin_pwd)
+        if lease.state['admin'] != admin:
+            # Выполняет аутентификацию администратора кластера.
+            # Администратор кластера должен быть аутентифицирован для создания в этом кластере
+            # новой информационной базы.
+            lease.connection.authenticate_admin(*admin)
+            lease.state['admin'] = admin
+        registered = lease.state['infobase_auth']
+        for login, password in self.__infobase_auth - registered:
+            # Административный доступ разрешен только к тем информационным базам,
+            # в которых зарегистрирован пользователь с таким именем и он имеет право "Администратор".
+            lease.connection.add_authentication(login, password)
+            registered.add((login, password))
+
+    def reset_working_process_connection(self):
+        """
+        Разрывает связь с выбранным рабочим процессом. При следующем обращении процесс будет выбран заново.
+        """
+        lease, self.__working_process_lease = self.__working_process_lease, None
+        if lease is not None and self.working_process_pool is not None:
+            self.working_process_pool.release(lease, discard=True)
+
+    def close(self, discard: bool = False):
+        """
+        Возвращает соединение с рабочим процессом в пул
+        :param discard: соединение неисправно и не должно использоваться повторно
+        """
+        lease, self.__working_process_lease = self.__working_process_lease, None
+        if lease is not None and self.working_process_pool is not None:
+            self.working_process_pool.release(lease, discard=discard)
+
+    @property
+    def working_process_connection(self) -> 'WorkingProcessConnection':
+        while True:
+            lease = self.__working_process_lease
+            if lease is None:
+                self.__check_cluster_auth()
+                if self.working_process_pool is not None:
+                    lease = self.working_process_pool.acquire(self.working_process_pool_key,
+                                                              self.__connect_working_process,
+                                                              self.__is_working_process_lease_allowed)
+                else:
+                    lease = self.__connect_working_process(self.working_process_pool_key)
+                self.__working_process_lease = lease
+            if self.__is_working_process_current(lease):
+                break
+            # Процесс был перезапущен или выключен кластером, соединение необходимо установить заново
+            logging.debug(f'[{self.host}] Working process {lease.state["working_process"].pid} is recycled, reselect')
+            self.reset_working_process_connection()
+        self.__authenticate_working_process_connection(lease)
+        return lease.connection
 
     def add_infobase_auth(self, login, password):
         """
         Добавляет аутентификацию для информационной базы. Имя информационной базы не требуется т.к. аутентификаия будет
-        выполнена во всех базах, к которым подходит переданная пара логин/пароль
+        выполнена во всех базах, к которым подходит переданная пара логин/пароль.
+        Если соединение с рабочим процессом уже аутентифицировано с этими учетными данными, повторно она не выполняется.
         :param login:
         :param password:
         """
+        self.add_infobase_auths([(login, password)])
+
+    def add_infobase_auths(self, credentials: Iterable[Tuple[str, str]]):
+        """
+        Добавляет аутентификации для информационных баз сразу по всем парам логин/пароль.
+        Соединение из пула выбирается по полному набору учетных данных, поэтому набор следует передавать целиком:
+        соединение, аутентифицированное с несколькими учетными данными, выдается только при всех этих данных
+        """
+        self.__infobase_auth.update(credentials)
+        # Обращение к свойству выполняет недостающие аутентификации в соединении
+        self.working_process_connection
+
+    @property
+    def inventory_key(self) -> tuple:
+        return self.host, self.agent_port, 'cluster', self.cluster.cluster_name.lower()
+
+    def invalidate_inventory(self):
+        """
+        Сбрасывает закэшированные списки информационных баз кластера
+        """
+        self.inventory_cache.invalidate(*self.inventory_key)
+
+    def __get_infobases_entry(self):
         working_process_connection = self.working_process_connection
-        # Административный доступ разрешен только к тем информационным базам,
-        # в которых зарегистрирован пользователь с таким именем и он имеет право "Администратор".
-        working_process_connection.add_authentication(login, password)
+        # Набор доступных для чтения свойств зависит от выполненных в соединении аутентификаций
+        # в информационных базах, поэтому они входят в ключ кэша
+        registered = frozenset(self.__working_process_lease.state['infobase_auth'])
+        return self.inventory_cache.get(
+            (*self.inventory_key, 'infobases', registered),
+            working_process_connection.get_infobases,
+            lambda infobase: infobase.name,
+        )
 
     def get_infobases(self) -> List['Infobase']:
         """
         Получает список информационных баз в кластере
         Для чтения значений всех их свойств, кроме Name, необходимы административные права.
         """
-        return self.working_process_connection.get_infobases()
+        return list(self.__get_infobases_entry().items)
 
     def get_infobase(self, name) -> 'Infobase':
         """
         Получает информационную базу по имени
         Для чтения значений всех их свойств, кроме Name, необходимы административные права.
         """
-        return next(filter(lambda ib: name.lower() == ib.name.lower(), self.get_infobases()))
+        return self.__get_infobases_entry().find(name)
 
     def get_infobases_short(self) -> List['InfobaseShort']:
         """
@@ -175,7 +361,39 @@ class ClusterControlInterface:
         Для успешного выполнения метода необходима аутентификация одного из администраторов кластера.
         """
         self.__check_cluster_auth()
-        return self.agent_connection.get_infobases(self.cluster)
+        entry = self.inventory_cache.get(
+            (*self.inventory_key, 'infobases_short'),
+            lambda: self.agent_connection.get_infobases(self.cluster),
+            lambda infobase: infobase.name,
+        )
+        return list(entry.items)
+
+    def create_infobase(self, infobase: 'Infobase', create_db: bool = False):
+        """
+        Создает информационную базу. Требуется аутентификация администратора кластера.
+        """
+        try:
+            self.working_process_connection.create_infobase(infobase, create_db)
+        finally:
+            self.invalidate_inventory()
+
+    def update_infobase(self, infobase: 'Infobase'):
+        """
+        Устанавливает новые параметры существующей информационной базы.
+        """
+        try:
+            self.working_process_connection.update_infobase(infobase)
+        finally:
+            self.invalidate_inventory()
+
+    def drop_infobase(self, infobase: 'Infobase', mode: int = 0):
+        """
+        Удаляет информационную базу. Для выполнения требуются административные права в удаляемой информационной базе.
+        """
+        try:
+            self.working_process_connection.drop_infobase(infobase, mode)
+        finally:
+            self.invalidate_inventory()
 
     def get_infobase_metadata(self, infobase, infobase_user, infobase_pwd) -> Tuple[str, str]:
         """
@@ -193,54 +411,100 @@ class ClusterControlInterface:
         del external_connection
         return name, version
 
-    def lock_infobase(self, infobase: 'Infobase', permission_code='0000', message='Выполняется обслуживание ИБ'):
+    def __invalidate_clusters(self):
+        # Изменение параметров кластера делает устаревшим закэшированный список кластеров сервера
+        self.inventory_cache.invalidate(self.host, self.agent_port, 'clusters')
+
+    def lock_infobase(self, infobase: 'Infobase', permission_code='0000', message='Выполняется обслуживание ИБ',
+                      denied_from: Optional[datetime] = None, denied_to: Optional[datetime] = None):
         """
         Блокирует фоновые задания и новые сеансы информационной базы
         :param infobase:
         :param permission_code: Код доступа к информационной базе во время блокировки сеансов
         :param message: Сообщение будет выводиться при попытке установить сеанс с ИБ
+        :param denied_from: Начало действия блокировки сеансов. По умолчанию - немедленно
+        :param denied_to: Окончание действия блокировки сеансов. По умолчанию - до снятия блокировки
         """
         # TODO: необходима проверка, есть ли у рабочего процесса необходимые авторизационные данные для этой ИБ
         infobase.scheduled_jobs_denied = True
         infobase.sessions_denied = True
         infobase.permission_code = permission_code
         infobase.denied_message = message
-        self.working_process_connection.update_infobase(infobase)
+        infobase.denied_from = denied_from or EMPTY_DATE
+        infobase.denied_to = denied_to or EMPTY_DATE
+        self.update_infobase(infobase)
         logging.debug(f'[{infobase.name}] Lock info base successfully')
 
     def set_recycling_by_memory(self, max_memory_size: int, duration: int):
         self.agent_connection.set_cluster_recycling_by_memory(self.cluster, max_memory_size, duration)
+        self.__invalidate_clusters()
 
     def set_recycling_by_time(self, lifetime_limit: int):
         self.agent_connection.set_cluster_recycling_by_time(self.cluster, lifetime_limit)
+        self.__invalidate_clusters()
 
     def set_recycling_errors_count_threshold(self, errors_count_threshold: int):
         self.agent_connection.set_cluster_recycling_errors_count_threshold(self.cluster, errors_count_threshold)
+        self.__invalidate_clusters()
 
     def set_recycling_expiration_timeout(self, expiration_timeout: int):
         self.agent_connection.set_cluster_recycling_expiration_timeout(self.cluster, expiration_timeout)
+        self.__invalidate_clusters()
 
     def set_recycling_kill_problem_processes(self, kill_problem_processes: bool):
         self.agent_connection.set_cluster_recycling_kill_problem_processes(self.cluster, kill_problem_processes)
+        self.__invalidate_clusters()
 
     def set_security_level(self, security_level: int):
         self.agent_connection.set_cluster_security_level(self.cluster, security_level)
+        self.__invalidate_clusters()
 
     def unlock_infobase(self, infobase: 'Infobase'):
         """
         Снимает блокировку фоновых заданий и сеансов информационной базы
         """
-        infobase.ScheduledJobsDenied = False
-        infobase.SessionsDenied = False
-        infobase.DeniedMessage = ""
-        self.working_process_connection.update_infobase(infobase)
+        infobase.scheduled_jobs_denied = False
+        infobase.sessions_denied = False
+        infobase.denied_message = ''
+        infobase.denied_from = EMPTY_DATE
+        infobase.denied_to = EMPTY_DATE
+        self.update_infobase(infobase)
         logging.debug(f'[{infobase.name}] Unlock info base successfully')
 
+    def get_sessions(self) -> List['Session']:
+        """
+        Получает список сеансов кластера. Необходима аутентификация администратора кластера
+        """
+        self.__check_cluster_auth()
+        return self.agent_connection.get_sessions(self.cluster)
+
+    def get_working_processes(self) -> List['WorkingProcess']:
+        """
+        Получает список рабочих процессов кластера. Необходима аутентификация администратора кластера
+        """
+        self.__check_cluster_auth()
+        return self.agent_connection.get_working_processes(self.cluster)
+
+    def terminate_session(self, session: 'Session', message: str = ''):
+        """
+        Принудительно завершает сеанс кластера
+        :param message: сообщение пользователю о причине завершения сеанса
+        """
+        self.agent_connection.terminate_session(self.cluster, session, message)
+
+    def get_infobase_sessions(self, infobase_short: 'InfobaseShort') -> List['Session']:
+        """
+        Получает список сеансов информационной базы. Необходима аутентификация администратора кластера
+        :param infobase_short: краткое описание информационной базы
+        """
+        self.__check_cluster_auth()
+        return self.agent_connection.get_infobase_sessions(self.cluster, infobase_short)
+
     def terminate_info_base_sessions(self, infobase_short: 'InfobaseShort'):
         """
         Принудительно завершает текущие сеансы информационной базы
         :param infobase_short: краткое описание информационной базы
         """
-        info_base_sessions = self.agent_connection.get_infobase_sessions(self.cluster, infobase_short)
+        info_base_sessions = self.get_infobase_sessions(infobase_short)
         for session in info_base_sessions:
-            self.agent_connection.terminate_session(self.cluster, session)
+            self.terminate_session(session)
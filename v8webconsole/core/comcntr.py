@@ -1,15 +1,65 @@
-import pythoncom
-import win32com.client
-
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Callable, List, Optional
+
+from .instrumentation import instrument
+
+try:
+    import pythoncom
+    import win32com.client
+except ImportError:
+    # pywin32 доступен только в Windows. Без него можно работать только с подключаемым бэкендом,
+    # например, с имитацией агента сервера из модуля simulator
+    pythoncom = None
+    win32com = None
+
+
+# Пустая дата 1С ('00010101') передается через COM как наименьшая дата OLE Automation
+EMPTY_DATE = datetime(100, 1, 1)
+
+
+def dispatch_com_connector() -> Any:
+    """
+    Создает COM-объект COMConnector установленной платформы 1С:Предприятие
+    """
+    if pythoncom is None:
+        raise RuntimeError('pywin32 is not installed, COMConnector is not available')
+    pythoncom.CoInitialize()
+    # В зависимости от версии платформы используется V82.COMConnector или V83.COMConnector
+    try:
+        return win32com.client.gencache.EnsureDispatch("V83.COMConnector")
+    except pythoncom.com_error:
+        return win32com.client.gencache.EnsureDispatch("V82.COMConnector")
+
+
+connector_factory: Callable[[], Any] = dispatch_com_connector
+
+
+def set_connector_factory(factory: Optional[Callable[[], Any]]):
+    """
+    Подменяет способ создания объекта COMConnector, например, имитацией для тестирования без Windows.
+    None восстанавливает создание настоящего COM-объекта
+    """
+    global connector_factory
+    connector_factory = factory or dispatch_com_connector
+
+
+def co_initialize():
+    """
+    Инициализирует COM в текущем потоке, если COM доступен
+    """
+    if pythoncom is not None:
+        pythoncom.CoInitialize()
+
 
+def co_uninitialize():
+    if pythoncom is not None:
+        pythoncom.CoUninitialize()
 
 
 class COMObjectWrapper:
 
     def __init__(self, iv8obj):
-        self._iv8obj = iv8obj
+        self._iv8obj = instrument(iv8obj)
 
     def get_underlying_com_object(self):
         return self._iv8obj
@@ -28,13 +78,7 @@ class COMConnector(COMObjectWrapper):
     """
 
     def __init__(self):
-        pythoncom.CoInitialize()
-        # В зависимости от версии платформы используется V82.COMConnector или V83.COMConnector
-        try:
-            v8_com_connector = win32com.client.gencache.EnsureDispatch("V83.COMConnector")
-        except pythoncom.com_error:
-            v8_com_connector = win32com.client.gencache.EnsureDispatch("V82.COMConnector")
-        super().__init__(v8_com_connector)
+        super().__init__(connector_factory())
 
     @property
     def high_bound_default(self) -> int:
@@ -757,12 +801,13 @@ class WorkingProcess(COMObjectWrapper):
         return self._iv8obj.IsEnable
 
     @property
-    def license(self) -> 'License':
+    def license(self) -> Optional['License']:
         """
         Содержит информацию о серверной лицензии, используемой рабочим процессом.
         Неопределено - рабочий процесс не использует серверную лицензию.
         """
-        return self._iv8obj.License
+        iv8_license = self._iv8obj.License
+        return License(iv8_license) if iv8_license is not None else None
 
     @property
     def main_port(self) -> int:
@@ -810,12 +855,14 @@ class WorkingProcess(COMObjectWrapper):
         """
         return self._iv8obj.SelectionSize
 
+    @property
     def started_at(self) -> datetime:
         """
         Содержит момент запуска рабочего процесса. Если процесс не запущен, то содержит нулевую дату.
         """
         return self._iv8obj.StartedAt
 
+    @property
     def use(self) -> int:
         """
         Определяет использование рабочего процесса кластером. Устанавливается администратором.
@@ -825,7 +872,7 @@ class WorkingProcess(COMObjectWrapper):
         2 – использовать как резервный, процесс должен быть запущен только
         при невозможности запуска процесса со значением 1 этого свойства.
         """
-        return self._iv8obj.User
+        return self._iv8obj.Use
 
 
 class WorkingProcessConnection(COMObjectWrapper):
@@ -1857,6 +1904,79 @@ class Session(COMObjectWrapper):
         """
         return self._iv8obj.Host
 
+    @property
+    def infobase(self) -> 'InfobaseShort':
+        """
+        Содержит краткое описание информационной базы, с которой установлен сеанс.
+        """
+        return InfobaseShort(self._iv8obj.infoBase)
+
+    @property
+    def last_active_at(self) -> datetime:
+        """
+        Содержит момент времени последней активности сеанса.
+        """
+        return self._iv8obj.LastActiveAt
+
+    @property
+    def license(self) -> Optional['License']:
+        """
+        Содержит информацию о клиентской лицензии, используемой сеансом. Иначе - Неопределено.
+        """
+        iv8_license = self._iv8obj.License
+        return License(iv8_license) if iv8_license is not None else None
+
+    @property
+    def memory_all(self) -> int:
+        """
+        Содержит объем памяти, занятой во время вызовов сервера с момента начала сеанса, в байтах.
+        """
+        return self._iv8obj.MemoryAll
+
+    @property
+    def memory_current(self) -> int:
+        """
+        Содержит объем памяти, занятой с момента начала текущего вызова сервера, в байтах.
+        Если вызов не выполняется, то 0.
+        """
+        return self._iv8obj.MemoryCurrent
+
+    @property
+    def memory_last_5min(self) -> int:
+        """
+        Содержит объем памяти, занятой во время вызовов сервера за последние 5 минут, в байтах.
+        """
+        return self._iv8obj.MemoryLast5Min
+
+    @property
+    def process(self) -> Optional['WorkingProcess']:
+        """
+        Содержит описание рабочего процесса, к которому подключен сеанс. Иначе - Неопределено.
+        """
+        iv8_process = self._iv8obj.process
+        return WorkingProcess(iv8_process) if iv8_process is not None else None
+
+    @property
+    def session_id(self) -> int:
+        """
+        Содержит номер сеанса. Целое число, уникальное среди всех сеансов данной информационной базы.
+        """
+        return self._iv8obj.SessionID
+
+    @property
+    def started_at(self) -> datetime:
+        """
+        Содержит момент времени начала сеанса.
+        """
+        return self._iv8obj.StartedAt
+
+    @property
+    def user_name(self) -> str:
+        """
+        Содержит имя пользователя информационной базы, от имени которого установлен сеанс.
+        """
+        return self._iv8obj.userName
+
 
 class License(COMObjectWrapper):
     """
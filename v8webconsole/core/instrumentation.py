@@ -0,0 +1,167 @@
+"""
+Учет обращений к COM-объектам.
+
+Обертки из comcntr обращаются к COM-объекту через прокси, который измеряет время каждого вызова метода
+и каждого обращения к свойству. Результаты суммируются в объекте COMCallStats, установленном
+в контекстной переменной (например, на время обработки одного запроса). Исполнитель COM-апартаментов
+передает контекстные переменные заданиям, поэтому вызовы в рабочих потоках учитываются в том же объекте.
+Вызовы дольше slow_call_threshold секунд записываются в журнал с именем метода и адресом сервера.
+"""
+import contextvars
+import datetime
+import logging
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Any, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+# Методы, результат которых относится к серверу, адрес которого передан первым параметром
+CONNECT_METHODS = ('ConnectAgent', 'ConnectWorkingProcess')
+
+PLAIN_TYPES = (str, int, float, bool, bytes, datetime.datetime, type(None))
+
+enabled = True
+
+slow_call_threshold = 0.5
+
+
+def configure_instrumentation(enable: bool = True, slow_call_threshold_seconds: float = 0.5):
+    """
+    :param enable: оборачивать ли новые COM-объекты в измеряющий прокси
+    :param slow_call_threshold_seconds: порог записи вызова в журнал медленных вызовов. 0 - не записывать
+    """
+    global enabled, slow_call_threshold
+    enabled = enable
+    slow_call_threshold = slow_call_threshold_seconds
+
+
+class COMCallStats:
+    """
+    Количество и суммарное время обращений к COM-объектам
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.property_accesses = 0
+        self.duration = 0.0
+
+    def add(self, is_call: bool, duration: float):
+        with self._lock:
+            if is_call:
+                self.calls += 1
+            else:
+                self.property_accesses += 1
+            self.duration += duration
+
+
+current_stats: 'contextvars.ContextVar[Optional[COMCallStats]]' = contextvars.ContextVar(
+    'com_call_stats', default=None)
+
+
+@contextmanager
+def collect_com_stats():
+    """
+    Учитывает обращения к COM-объектам, выполненные в текущем контексте, в новом объекте COMCallStats
+    """
+    stats = COMCallStats()
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+
+
+def _record(target: Optional[str], name: str, is_call: bool, started: float):
+    duration = time.perf_counter() - started
+    stats = current_stats.get()
+    if stats is not None:
+        stats.add(is_call, duration)
+    if 0 < slow_call_threshold <= duration:
+        log.warning(f'[{target or "-"}] Slow COM {"call" if is_call else "property access"} {name}: {duration:.3f}s')
+
+
+def unwrap(value: Any) -> Any:
+    """
+    Исходный COM-объект
+    """
+    return object.__getattribute__(value, '_obj') if isinstance(value, InstrumentedCOMObject) else value
+
+
+def _wrap_result(value, target: Optional[str]):
+    if isinstance(value, PLAIN_TYPES) or isinstance(value, InstrumentedCOMObject):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(_wrap_result(item, target) for item in value)
+    return InstrumentedCOMObject(value, target)
+
+
+class InstrumentedCOMObject:
+    """
+    Прокси COM-объекта, измеряющий обращения к нему. Возвращаемые COM-объекты также оборачиваются
+    и наследуют адрес сервера. Имена, начинающиеся с подчеркивания, передаются без учета
+    """
+    __slots__ = ('_obj', '_target')
+
+    def __init__(self, obj, target: Optional[str] = None):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        obj = object.__getattribute__(self, '_obj')
+        if name.startswith('_'):
+            return getattr(obj, name)
+        target = object.__getattribute__(self, '_target')
+        started = time.perf_counter()
+        value = getattr(obj, name)
+        # Вложенные COM-объекты тоже вызываемые (метод по умолчанию), поэтому методы определяются по типу
+        if isinstance(value, types.MethodType):
+            return _InstrumentedMethod(value, name, target)
+        _record(target, name, False, started)
+        return _wrap_result(value, target)
+
+    def __setattr__(self, name, value):
+        obj = object.__getattribute__(self, '_obj')
+        if name.startswith('_'):
+            setattr(obj, name, value)
+            return
+        started = time.perf_counter()
+        try:
+            setattr(obj, name, unwrap(value))
+        finally:
+            _record(object.__getattribute__(self, '_target'), name, False, started)
+
+    def __repr__(self):
+        return f'<Instrumented {object.__getattribute__(self, "_obj")!r}>'
+
+
+class _InstrumentedMethod:
+    __slots__ = ('method', 'name', 'target')
+
+    def __init__(self, method, name: str, target: Optional[str]):
+        self.method = method
+        self.name = name
+        self.target = target
+
+    def __call__(self, *args, **kwargs):
+        target = args[0] if self.name in CONNECT_METHODS and args else self.target
+        started = time.perf_counter()
+        try:
+            result = self.method(*(unwrap(arg) for arg in args), **{k: unwrap(v) for k, v in kwargs.items()})
+        finally:
+            _record(target, self.name, True, started)
+        return _wrap_result(result, target)
+
+
+def instrument(obj: Any, target: Optional[str] = None) -> Any:
+    """
+    Оборачивает COM-объект в измеряющий прокси, если учет включен
+    """
+    if not enabled or obj is None or isinstance(obj, (InstrumentedCOMObject,) + PLAIN_TYPES):
+        return obj
+    return InstrumentedCOMObject(obj, target)
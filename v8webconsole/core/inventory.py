@@ -0,0 +1,83 @@
+"""
+Кэш состава серверов: списков кластеров и информационных баз.
+
+Поиск кластера или информационной базы по имени требует загрузки полного списка с агента или рабочего процесса.
+Кэш хранит загруженные списки ограниченное время вместе с индексом по имени
+и явно сбрасывается операциями, изменяющими состав или свойства объектов.
+
+Закэшированные объекты являются COM-объектами и выдаются только тому потоку, в котором были загружены.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+
+class InventoryEntry:
+
+    def __init__(self, items: List[Any], name_of: Callable[[Any], str]):
+        self.items = items
+        self.index = {name_of(item).lower(): item for item in items}
+        self.loaded_at = time.monotonic()
+
+    def find(self, name: str) -> Any:
+        """
+        Ищет объект по имени без учета регистра.
+        Если объект не найден, вызывается StopIteration, так же, как при поиске в полном списке.
+        """
+        try:
+            return self.index[name.lower()]
+        except KeyError:
+            raise StopIteration(name)
+
+
+class InventoryCache:
+    """
+    Кэш с ограниченным временем жизни записей. Ключ записи - кортеж, начинающийся с адреса и порта агента,
+    что позволяет сбрасывать все записи сервера или кластера по префиксу ключа.
+    Для каждого ключа хранится отдельная запись каждого потока, чтобы потоки-апартаменты одного сервера
+    не вытесняли записи друг друга.
+    При ttl=0 кэширование не выполняется.
+    """
+
+    def __init__(self, ttl: float = 10):
+        self.ttl = ttl
+        self._entries: Dict[Tuple, Dict[int, InventoryEntry]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Hashable, ...], loader: Callable[[], List[Any]],
+            name_of: Callable[[Any], str]) -> 'InventoryEntry':
+        """
+        Возвращает актуальную запись, либо загружает список функцией loader
+        :param name_of: функция получения имени объекта для индекса
+        """
+        thread_id = threading.get_ident()
+        if self.ttl > 0:
+            with self._lock:
+                entry = self._entries.get(key, {}).get(thread_id)
+            if entry is not None and not self._expired(entry):
+                return entry
+        entry = InventoryEntry(list(loader()), name_of)
+        if self.ttl > 0:
+            with self._lock:
+                slots = self._entries.setdefault(key, {})
+                # Записи завершившихся потоков не будут запрошены повторно, поэтому устаревшие записи удаляются
+                for expired in [t for t, e in slots.items() if self._expired(e)]:
+                    del slots[expired]
+                slots[thread_id] = entry
+        return entry
+
+    def _expired(self, entry: 'InventoryEntry') -> bool:
+        return time.monotonic() - entry.loaded_at >= self.ttl
+
+    def invalidate(self, *key_prefix: Hashable):
+        """
+        Сбрасывает все записи, ключ которых начинается с key_prefix
+        """
+        size = len(key_prefix)
+        with self._lock:
+            for key in [k for k in self._entries if k[:size] == key_prefix]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
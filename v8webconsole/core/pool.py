@@ -0,0 +1,213 @@
+"""
+Пулы живых соединений с серверами 1С.
+
+Установка соединения с агентом сервера требует создания COMConnector (CoInitialize + EnsureDispatch)
+и вызова ConnectAgent, что заметно дороже самих административных вызовов.
+Пул хранит уже установленные соединения и выдает их повторно.
+
+COM-объекты привязаны к апартаменту потока, в котором они созданы,
+поэтому соединение выдается повторно только тому же потоку, который его создал.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Optional
+
+from .comcntr import COMConnector, ServerAgentConnection
+
+
+log = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """
+    Соединение, находящееся под управлением пула.
+    В state можно сохранять произвольное состояние соединения (например, выполненные аутентификации),
+    которое живет ровно столько же, сколько само соединение.
+    """
+
+    def __init__(self, key: Hashable, connector: 'COMConnector', connection: Any):
+        self.key = key
+        self.connector = connector
+        self.connection = connection
+        self.thread_id = threading.get_ident()
+        self.created_at = self.last_used_at = self.last_checked_at = time.monotonic()
+        self.state = dict()
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.key!r}>'
+
+
+class ConnectionPool:
+    """
+    Пул соединений с ключом. Неиспользуемые соединения хранятся не дольше idle_timeout секунд,
+    общее число неиспользуемых соединений не превышает max_size.
+    Перед повторной выдачей соединение, не проверявшееся дольше health_check_interval секунд, проверяется
+    методом check, и если проверка не пройдена, то соединение отбрасывается.
+    """
+
+    def __init__(self, max_size: int = 32, idle_timeout: float = 300, health_check_interval: float = 30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def connect(self, key: Hashable) -> 'PooledConnection':
+        raise NotImplementedError('`connect()` must be implemented.')
+
+    def check(self, pooled: 'PooledConnection') -> bool:
+        return True
+
+    def acquire(self, key: Hashable,
+                factory: Optional[Callable[[Hashable], 'PooledConnection']] = None,
+                accept: Optional[Callable[['PooledConnection'], bool]] = None) -> 'PooledConnection':
+        """
+        Выдает соединение по ключу: неиспользуемое из пула, либо новое.
+        :param factory: функция создания соединения, если нужно заменить метод connect
+        :param accept: выдаются только неиспользуемые соединения, для которых функция возвращает True
+        """
+        while True:
+            pooled = self._take_idle(key, accept)
+            if pooled is None:
+                break
+            if self._is_healthy(pooled):
+                pooled.last_used_at = time.monotonic()
+                return pooled
+            self._close(pooled)
+        pooled = (factory or self.connect)(key)
+        pooled.last_used_at = time.monotonic()
+        return pooled
+
+    def release(self, pooled: 'PooledConnection', discard: bool = False):
+        """
+        Возвращает соединение в пул.
+        :param discard: соединение неисправно и должно быть закрыто
+        """
+        if discard or self.max_size <= 0:
+            self._close(pooled)
+            return
+        pooled.last_used_at = time.monotonic()
+        evicted = []
+        with self._lock:
+            self._idle[id(pooled)] = pooled
+            evicted.extend(self._pop_expired())
+            evicted.extend(self._pop_overflow())
+        for e in evicted:
+            self._close(e)
+
+    @contextmanager
+    def connection(self, key: Hashable):
+        pooled = self.acquire(key)
+        try:
+            yield pooled
+        except Exception:
+            self.release(pooled, discard=True)
+            raise
+        else:
+            self.release(pooled)
+
+    def evict_idle(self):
+        """
+        Закрывает соединения, которые не использовались дольше idle_timeout
+        """
+        with self._lock:
+            evicted = self._pop_expired()
+        for e in evicted:
+            self._close(e)
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._idle.values())
+            self._idle.clear()
+        for e in evicted:
+            self._close(e)
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def _take_idle(self, key: Hashable,
+                   accept: Optional[Callable[['PooledConnection'], bool]] = None) -> Optional['PooledConnection']:
+        thread_id = threading.get_ident()
+        with self._lock:
+            evicted = self._pop_expired()
+            # Последнее возвращенное соединение самое "теплое"
+            for pooled_id, pooled in reversed(self._idle.items()):
+                if pooled.key == key and pooled.thread_id == thread_id and (accept is None or accept(pooled)):
+                    del self._idle[pooled_id]
+                    break
+            else:
+                pooled = None
+        for e in evicted:
+            self._close(e)
+        return pooled
+
+    def _pop_expired(self):
+        deadline = time.monotonic() - self.idle_timeout
+        thread_id = threading.get_ident()
+        expired = [pooled_id for pooled_id, pooled in self._idle.items()
+                   if pooled.last_used_at < deadline and pooled.thread_id == thread_id]
+        return [self._idle.pop(pooled_id) for pooled_id in expired]
+
+    def _pop_overflow(self):
+        overflow = len(self._idle) - self.max_size
+        if overflow <= 0:
+            return []
+        # В первую очередь вытесняются самые старые соединения текущего потока,
+        # чтобы освобождение COM-объектов происходило в их апартаменте
+        thread_id = threading.get_ident()
+        candidates = [pooled_id for pooled_id, pooled in self._idle.items() if pooled.thread_id == thread_id]
+        candidates += [pooled_id for pooled_id in self._idle if pooled_id not in candidates]
+        return [self._idle.pop(pooled_id) for pooled_id in candidates[:overflow]]
+
+    def _is_healthy(self, pooled: 'PooledConnection') -> bool:
+        now = time.monotonic()
+        if now - pooled.last_checked_at < self.health_check_interval:
+            return True
+        try:
+            healthy = self.check(pooled)
+        except Exception as e:
+            log.debug(f'[{pooled.key}] Health check failed: {e}')
+            healthy = False
+        pooled.last_checked_at = now
+        return healthy
+
+    def _close(self, pooled: 'PooledConnection'):
+        log.debug(f'[{pooled.key}] Close pooled connection')
+        pooled.connection = None
+        pooled.connector = None
+        pooled.state.clear()
+
+
+class ServerAgentConnectionPool(ConnectionPool):
+    """
+    Пул соединений с агентами серверов. Ключ соединения - пара (адрес, порт) агента.
+    """
+
+    def connect(self, key) -> 'PooledConnection':
+        host, port = key
+        connector = COMConnector()
+        log.debug(f'[{host}:{port}] Connect to server agent')
+        agent_connection = connector.connect_agent(f'tcp://{host}:{port}')
+        return PooledConnection(key, connector, agent_connection)
+
+    def check(self, pooled: 'PooledConnection') -> bool:
+        agent_connection: 'ServerAgentConnection' = pooled.connection
+        agent_connection.get_clusters()
+        return True
+
+
+class WorkingProcessConnectionPool(ConnectionPool):
+    """
+    Пул административных соединений с рабочими процессами. Ключ соединения - (адрес агента, порт агента, имя кластера).
+    Соединение устанавливается функцией, передаваемой в acquire, так как для этого требуется выбрать рабочий процесс
+    через аутентифицированное соединение с агентом.
+    В state соединения хранятся выбранный рабочий процесс и учетные данные, по которым в нем уже выполнена
+    аутентификация, что позволяет не выполнять ее повторно при следующем использовании соединения.
+    """
+
+    def connect(self, key) -> 'PooledConnection':
+        raise NotImplementedError('Working process connection requires a factory')
@@ -0,0 +1,625 @@
+"""
+Имитация агента сервера 1С:Предприятия в памяти процесса.
+
+Имитация подменяет COM-объект COMConnector (см. comcntr.set_connector_factory) и позволяет запускать
+и нагружать весь стек приложения без Windows и установленной платформы.
+Объекты имитации имеют те же имена свойств и методов, что и настоящие COM-объекты,
+поэтому с ними работают те же обертки из comcntr и снимки из snapshots.
+
+Каждый вызов метода и каждое обращение к свойству могут выполняться с заданной задержкой,
+что позволяет воспроизвести стоимость обращений через IDispatch и сеть. Количество вызовов подсчитывается.
+"""
+import copy
+import datetime
+import functools
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import comcntr
+
+
+EMPTY_DATE = comcntr.EMPTY_DATE
+
+APP_IDS = ('1CV8C', '1CV8C', '1CV8C', 'WebClient', 'Designer', 'BackgroundJob', 'COMConnection', 'WSConnection')
+
+
+class SimulatorError(Exception):
+    """
+    Аналог исключения pythoncom.com_error, вызываемого агентом сервера
+    """
+
+
+class SimulatorConfig:
+    """
+    Параметры имитации. Размеры набора данных задаются на один кластер.
+    :param call_latency: задержка каждого вызова метода, в секундах
+    :param property_latency: задержка каждого обращения к свойству, в секундах
+    """
+
+    def __init__(self, clusters: int = 1, infobases: int = 100, sessions: int = 1000, working_processes: int = 2,
+                 call_latency: float = 0, property_latency: float = 0, seed: int = 0):
+        self.clusters = clusters
+        self.infobases = infobases
+        self.sessions = sessions
+        self.working_processes = working_processes
+        self.call_latency = call_latency
+        self.property_latency = property_latency
+        self.seed = seed
+
+
+class SimulatorStats:
+    """
+    Счетчики обращений к объектам имитации
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.property_accesses = 0
+
+    def add(self, calls: int = 0, property_accesses: int = 0):
+        with self._lock:
+            self.calls += calls
+            self.property_accesses += property_accesses
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.property_accesses = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {'calls': self.calls, 'property_accesses': self.property_accesses}
+
+
+class SimulatedObject:
+    """
+    Объект имитации. Свойства хранятся в словаре под именами свойств COM-объекта,
+    каждое обращение к ним учитывается и выполняется с задержкой property_latency
+    """
+
+    def __init__(self, simulator: 'Simulator', **properties):
+        object.__setattr__(self, '_simulator', simulator)
+        object.__setattr__(self, '_properties', properties)
+
+    def __getattr__(self, name):
+        properties = self.__dict__.get('_properties', {})
+        if name not in properties:
+            raise AttributeError(f'{type(self).__name__} has no property {name}')
+        self._simulator.access_property()
+        return properties[name]
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+            return
+        self._simulator.access_property()
+        self._properties[name] = value
+
+    def copy(self) -> 'SimulatedObject':
+        """
+        Агент сервера каждый раз возвращает новые объекты, поэтому изменение полученного объекта
+        не затрагивает состояние сервера до вызова соответствующего метода
+        """
+        return type(self)(self._simulator, **copy.copy(self._properties))
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self._properties.get("Name") or self._properties.get("ClusterName") or ""}>'
+
+
+def com_method(method):
+    """
+    Учитывает вызов метода объекта имитации и выполняет его с задержкой call_latency
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._simulator.call_method()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class SimulatedCluster(SimulatedObject):
+    pass
+
+
+class SimulatedInfobase(SimulatedObject):
+    pass
+
+
+class SimulatedSession(SimulatedObject):
+    pass
+
+
+class SimulatedWorkingProcess(SimulatedObject):
+    pass
+
+
+class SimulatedRegUser(SimulatedObject):
+    pass
+
+
+class SimulatedLicense(SimulatedObject):
+    pass
+
+
+def parse_identity(identity: str, default_port: int) -> Tuple[str, int]:
+    """
+    Разбирает адрес вида [tcp://]host[:port]
+    """
+    address = identity.split('://', 1)[-1]
+    host, _, port = address.partition(':')
+    return host.lower(), int(port) if port else default_port
+
+
+class ClusterState:
+    """
+    Состояние одного кластера имитируемого сервера
+    """
+
+    def __init__(self, cluster: 'SimulatedCluster'):
+        self.cluster = cluster
+        self.infobases: Dict[str, 'SimulatedInfobase'] = {}
+        self.sessions: List['SimulatedSession'] = []
+        self.working_processes: List['SimulatedWorkingProcess'] = []
+
+    @property
+    def name(self) -> str:
+        return self.cluster._properties['ClusterName']
+
+    def find_infobase(self, infobase) -> 'SimulatedInfobase':
+        try:
+            return self.infobases[infobase._properties['Name'].lower()]
+        except KeyError:
+            raise SimulatorError(f'Infobase {infobase._properties["Name"]} not found')
+
+
+class SimulatedAgent:
+    """
+    Имитируемый агент сервера со всеми его кластерами
+    """
+
+    def __init__(self, simulator: 'Simulator', host: str, port: int):
+        self.simulator = simulator
+        self.host = host
+        self.port = port
+        self.lock = threading.RLock()
+        self.clusters: Dict[str, 'ClusterState'] = {}
+        self.admins = [simulator.new(SimulatedRegUser, Name='admin', Descr='Administrator', PasswordAuthAllowed=True,
+                                     SysAuthAllowed=False, SysUserName='')]
+
+    def find_cluster(self, cluster) -> 'ClusterState':
+        try:
+            return self.clusters[cluster._properties['ClusterName'].lower()]
+        except KeyError:
+            raise SimulatorError(f'Cluster {cluster._properties["ClusterName"]} not found')
+
+    def new_cluster_info(self, **properties) -> 'SimulatedCluster':
+        return self.simulator.new(SimulatedCluster, **{
+            'ClusterName': '',
+            'ErrorsCountThreshold': 0,
+            'ExpirationTimeout': 0,
+            'HostName': self.host,
+            'KillProblemProcesses': False,
+            'LifeTimeLimit': 0,
+            'LoadBalancingMode': 0,
+            'MainPort': 1541,
+            'MaxMemorySize': 0,
+            'MaxMemoryTimeLimit': 0,
+            'SecurityLevel': 0,
+            'SessionFaultToleranceLevel': 0,
+            **properties,
+        })
+
+    def add_cluster(self, cluster: 'SimulatedCluster', working_processes: int) -> 'ClusterState':
+        state = ClusterState(cluster.copy())
+        self.clusters[state.name.lower()] = state
+        base_port = cluster._properties['MainPort'] + 19
+        for i in range(max(1, working_processes)):
+            state.working_processes.append(self.simulator.new_working_process(self.host, base_port + i))
+            self.simulator.register_working_process(self.host, base_port + i, self, state)
+        return state
+
+
+class Simulator:
+    """
+    Набор имитируемых серверов. Сервер создается и наполняется данными при первом подключении к его агенту
+    """
+
+    def __init__(self, config: Optional['SimulatorConfig'] = None):
+        self.config = config or SimulatorConfig()
+        self.stats = SimulatorStats()
+        self._agents: Dict[Tuple[str, int], 'SimulatedAgent'] = {}
+        self._working_processes: Dict[Tuple[str, int], Tuple['SimulatedAgent', 'ClusterState']] = {}
+        self._lock = threading.Lock()
+
+    def call_method(self):
+        self.stats.add(calls=1)
+        if self.config.call_latency > 0:
+            time.sleep(self.config.call_latency)
+
+    def access_property(self):
+        self.stats.add(property_accesses=1)
+        if self.config.property_latency > 0:
+            time.sleep(self.config.property_latency)
+
+    def new(self, object_class, **properties):
+        return object_class(self, **properties)
+
+    def create_connector(self) -> 'SimulatedCOMConnector':
+        return SimulatedCOMConnector(self)
+
+    def install(self) -> 'Simulator':
+        """
+        Подменяет создание COMConnector имитацией
+        """
+        comcntr.set_connector_factory(self.create_connector)
+        return self
+
+    def agent(self, host: str, port: int) -> 'SimulatedAgent':
+        with self._lock:
+            agent = self._agents.get((host, port))
+            if agent is None:
+                agent = self._agents[(host, port)] = SimulatedAgent(self, host, port)
+                self.populate(agent)
+            return agent
+
+    def register_working_process(self, host: str, port: int, agent: 'SimulatedAgent', state: 'ClusterState'):
+        self._working_processes[(host.lower(), port)] = (agent, state)
+
+    def working_process(self, host: str, port: int) -> Tuple['SimulatedAgent', 'ClusterState']:
+        try:
+            return self._working_processes[(host, port)]
+        except KeyError:
+            raise SimulatorError(f'Working process {host}:{port} not found')
+
+    def new_working_process(self, host: str, port: int) -> 'SimulatedWorkingProcess':
+        rng = random.Random(f'{self.config.seed}:{host}:{port}')
+        started_at = datetime.datetime.now() - datetime.timedelta(seconds=rng.randint(600, 86400))
+        return self.new(
+            SimulatedWorkingProcess,
+            AvailablePerfomance=rng.randint(50, 250),
+            AvgCallTime=rng.uniform(0.001, 0.5),
+            AvgDBCallTime=rng.uniform(0.001, 0.3),
+            AvgLockCallTime=rng.uniform(0, 0.05),
+            AvgServerCallTime=rng.uniform(0.001, 0.2),
+            AvgThreads=rng.uniform(1, 20),
+            Capacity=1000,
+            Connections=rng.randint(0, 200),
+            HostName=host,
+            IsEnable=True,
+            License=self.new(
+                SimulatedLicense,
+                FileName='',
+                FullPresentation=f'Серверная лицензия {host}',
+                IssuedByServer=True,
+                LicenseType=1,
+                MaxUsersAll=0,
+                MaxUsersCur=0,
+                Net=False,
+                RMngrAddress=host,
+                RMngrPID=str(rng.randint(1000, 65000)),
+                RMngrPort=1541,
+                Series=f'8100{rng.randint(100000, 999999)}',
+                ShortPresentation='Сервер',
+            ),
+            MainPort=port,
+            MemoryExcessTime=0,
+            MemorySize=rng.randint(200_000, 4_000_000),
+            PID=str(rng.randint(1000, 65000)),
+            Running=1,
+            SelectionSize=rng.randint(100, 10000),
+            StartedAt=started_at,
+            Use=1,
+        )
+
+    def new_infobase_info(self, **properties) -> 'SimulatedInfobase':
+        return self.new(SimulatedInfobase, **{
+            'Name': '',
+            'Descr': '',
+            'DateOffset': 0,
+            'DBMS': 'PostgreSQL',
+            'dbName': '',
+            'dbPassword': '',
+            'dbServerName': '',
+            'dbUser': '',
+            'DeniedFrom': EMPTY_DATE,
+            'DeniedMessage': '',
+            'DeniedParameter': '',
+            'DeniedTo': EMPTY_DATE,
+            'ExternalSessionManagerConnectionString': '',
+            'ExternalSessionManagerRequired': False,
+            'LicenseDistributionAllowed': 0,
+            'Locale': 'ru_RU',
+            'PermissionCode': '',
+            'SafeModeSecurityProfileName': '',
+            'ScheduledJobsDenied': False,
+            'SecurityLevel': 0,
+            'SecurityProfileName': '',
+            'SessionsDenied': False,
+            **properties,
+        })
+
+    def populate(self, agent: 'SimulatedAgent'):
+        """
+        Наполняет сервер кластерами, информационными базами и сеансами согласно конфигурации
+        """
+        config = self.config
+        rng = random.Random(f'{config.seed}:{agent.host}:{agent.port}')
+        now = datetime.datetime.now()
+        for c in range(config.clusters):
+            name = 'Локальный кластер' if c == 0 else f'Кластер {c + 1}'
+            state = agent.add_cluster(agent.new_cluster_info(ClusterName=name, MainPort=1541 + c * 100),
+                                      config.working_processes)
+            infobases = []
+            for i in range(config.infobases):
+                infobase = self.new_infobase_info(
+                    Name=f'ib{i + 1:04d}', Descr=f'Информационная база {i + 1}',
+                    dbName=f'ib{i + 1:04d}', dbServerName=agent.host, dbUser='postgres',
+                )
+                state.infobases[infobase._properties['Name'].lower()] = infobase
+                infobases.append(infobase)
+            session_ids = {}
+            for s in range(config.sessions if infobases else 0):
+                infobase = infobases[rng.randrange(len(infobases))]
+                infobase_name = infobase._properties['Name']
+                session_id = session_ids[infobase_name] = session_ids.get(infobase_name, 0) + 1
+                started_at = now - datetime.timedelta(seconds=rng.randint(0, 8 * 3600))
+                last_active_at = min(now, started_at + datetime.timedelta(seconds=rng.randint(0, 8 * 3600)))
+                blocked_by_dbms = 0
+                if session_id > 1 and rng.random() < 0.02:
+                    blocked_by_dbms = rng.randint(1, session_id - 1)
+                state.sessions.append(self.new(
+                    SimulatedSession,
+                    AppID=rng.choice(APP_IDS),
+                    blockedByDBMS=blocked_by_dbms,
+                    blockedByLS=0,
+                    bytesAll=rng.randint(0, 10 ** 9),
+                    bytesLast5Min=rng.randint(0, 10 ** 7),
+                    callsAll=rng.randint(0, 10 ** 5),
+                    callsLast5Min=rng.randint(0, 1000),
+                    Connection=None,
+                    cpuTimeAll=rng.randint(0, 10 ** 7),
+                    cpuTimeCurrent=rng.randint(0, 10 ** 4),
+                    cpuTimeLast5Min=rng.randint(0, 10 ** 5),
+                    CurrentServiceName='',
+                    dbmsBytesAll=rng.randint(0, 10 ** 9),
+                    dbmsBytesLast5Min=rng.randint(0, 10 ** 7),
+                    dbProcInfo='',
+                    dbProcTook=0,
+                    dbProcTookAt=EMPTY_DATE,
+                    durationAll=rng.randint(0, 10 ** 7),
+                    durationAllDBMS=rng.randint(0, 10 ** 6),
+                    durationAllService=rng.randint(0, 10 ** 5),
+                    durationCurrent=rng.randint(0, 10 ** 4),
+                    durationCurrentDBMS=rng.randint(0, 10 ** 4) if blocked_by_dbms else 0,
+                    durationCurrentService=0,
+                    durationLast5Min=rng.randint(0, 10 ** 5),
+                    durationLast5MinDBMS=rng.randint(0, 10 ** 5),
+                    durationLast5MinService=rng.randint(0, 10 ** 4),
+                    Hibernate=rng.random() < 0.05,
+                    HibernateSessionTerminateTime=0,
+                    Host=f'ws{rng.randint(1, 500):03d}',
+                    infoBase=self.new(SimulatedInfobase, Name=infobase_name, Descr=infobase._properties['Descr']),
+                    LastActiveAt=last_active_at,
+                    License=None,
+                    MemoryAll=rng.randint(0, 10 ** 9),
+                    MemoryCurrent=rng.randint(0, 10 ** 7),
+                    MemoryLast5Min=rng.randint(0, 10 ** 8),
+                    process=rng.choice(state.working_processes),
+                    SessionID=session_id,
+                    StartedAt=started_at,
+                    userName=f'user{rng.randint(1, 2000):04d}',
+                ))
+
+
+class SimulatedCOMConnector(SimulatedObject):
+
+    def __init__(self, simulator: 'Simulator'):
+        super().__init__(
+            simulator,
+            HighBoundDefault=1591,
+            LowBoundDefault=1560,
+            MaxConnections=0,
+            PoolCapacity=10,
+            PoolTimeout=60,
+            RAgentPortDefault=1540,
+            RMngrPortDefault=1541,
+        )
+
+    @com_method
+    def Connect(self, connection_string):
+        raise SimulatorError('External connections to infobases are not simulated')
+
+    @com_method
+    def ConnectAgent(self, identity):
+        host, port = parse_identity(identity, 1540)
+        return SimulatedAgentConnection(self._simulator, self._simulator.agent(host, port), identity)
+
+    @com_method
+    def ConnectWorkingProcess(self, identity):
+        host, port = parse_identity(identity, 1560)
+        agent, state = self._simulator.working_process(host, port)
+        return SimulatedWorkingProcessConnection(self._simulator, agent, state)
+
+
+class SimulatedAgentConnection(SimulatedObject):
+
+    def __init__(self, simulator: 'Simulator', agent: 'SimulatedAgent', identity: str):
+        super().__init__(simulator, ConnectionString=identity)
+        object.__setattr__(self, '_agent', agent)
+
+    @com_method
+    def Authenticate(self, cluster, login, password):
+        with self._agent.lock:
+            self._agent.find_cluster(cluster)
+
+    @com_method
+    def AuthenticateAgent(self, login, password):
+        pass
+
+    @com_method
+    def CreateClusterInfo(self):
+        return self._agent.new_cluster_info()
+
+    @com_method
+    def GetAgentAdmins(self):
+        with self._agent.lock:
+            return [admin.copy() for admin in self._agent.admins]
+
+    @com_method
+    def GetClusters(self):
+        with self._agent.lock:
+            return [state.cluster.copy() for state in self._agent.clusters.values()]
+
+    @com_method
+    def GetInfoBases(self, cluster):
+        with self._agent.lock:
+            state = self._agent.find_cluster(cluster)
+            return [self._simulator.new(SimulatedInfobase, Name=ib._properties['Name'], Descr=ib._properties['Descr'])
+                    for ib in state.infobases.values()]
+
+    @com_method
+    def GetInfoBaseSessions(self, cluster, infobase):
+        with self._agent.lock:
+            state = self._agent.find_cluster(cluster)
+            name = infobase._properties['Name'].lower()
+            return [s.copy() for s in state.sessions if s._properties['infoBase']._properties['Name'].lower() == name]
+
+    @com_method
+    def GetSessions(self, cluster):
+        with self._agent.lock:
+            return [s.copy() for s in self._agent.find_cluster(cluster).sessions]
+
+    @com_method
+    def GetWorkingProcesses(self, cluster):
+        with self._agent.lock:
+            return [wp.copy() for wp in self._agent.find_cluster(cluster).working_processes]
+
+    @com_method
+    def RegCluster(self, cluster):
+        with self._agent.lock:
+            name = cluster._properties['ClusterName'].lower()
+            if name in self._agent.clusters:
+                self._agent.clusters[name].cluster._properties.update(cluster._properties)
+            else:
+                self._agent.add_cluster(cluster, 1)
+
+    def _set_cluster_properties(self, cluster, **properties):
+        with self._agent.lock:
+            self._agent.find_cluster(cluster).cluster._properties.update(properties)
+
+    @com_method
+    def SetClusterRecyclingByMemory(self, cluster, max_memory_size, max_memory_time_limit):
+        self._set_cluster_properties(cluster, MaxMemorySize=max_memory_size, MaxMemoryTimeLimit=max_memory_time_limit)
+
+    @com_method
+    def SetClusterRecyclingByTime(self, cluster, lifetime_limit):
+        self._set_cluster_properties(cluster, LifeTimeLimit=lifetime_limit)
+
+    @com_method
+    def SetClusterRecyclingErrorsCountThreshold(self, cluster, errors_count_threshold):
+        self._set_cluster_properties(cluster, ErrorsCountThreshold=errors_count_threshold)
+
+    @com_method
+    def SetClusterRecyclingExpirationTimeout(self, cluster, expiration_timeout):
+        self._set_cluster_properties(cluster, ExpirationTimeout=expiration_timeout)
+
+    @com_method
+    def SetClusterRecyclingKillProblemProcesses(self, cluster, kill_problem_processes):
+        self._set_cluster_properties(cluster, KillProblemProcesses=kill_problem_processes)
+
+    @com_method
+    def SetClusterSecurityLevel(self, cluster, security_level):
+        self._set_cluster_properties(cluster, SecurityLevel=security_level)
+
+    @com_method
+    def TerminateSession(self, cluster, session, message=''):
+        with self._agent.lock:
+            state = self._agent.find_cluster(cluster)
+            key = (session._properties['infoBase']._properties['Name'].lower(), session._properties['SessionID'])
+            for i, s in enumerate(state.sessions):
+                if (s._properties['infoBase']._properties['Name'].lower(), s._properties['SessionID']) == key:
+                    del state.sessions[i]
+                    return
+            raise SimulatorError(f'Session {key} not found')
+
+    @com_method
+    def UnregCluster(self, cluster):
+        with self._agent.lock:
+            state = self._agent.find_cluster(cluster)
+            if state.infobases:
+                raise SimulatorError('Only an empty cluster can be unregistered')
+            del self._agent.clusters[state.name.lower()]
+
+
+class SimulatedWorkingProcessConnection(SimulatedObject):
+
+    def __init__(self, simulator: 'Simulator', agent: 'SimulatedAgent', state: 'ClusterState'):
+        super().__init__(simulator)
+        object.__setattr__(self, '_agent', agent)
+        object.__setattr__(self, '_state', state)
+
+    @com_method
+    def AddAuthentication(self, login, password):
+        pass
+
+    @com_method
+    def AuthenticateAdmin(self, login, password):
+        pass
+
+    @com_method
+    def Connect(self, infobase, login, password):
+        raise SimulatorError('Infobase connections are not simulated')
+
+    @com_method
+    def CreateInfoBase(self, infobase, mode):
+        with self._agent.lock:
+            name = infobase._properties['Name'].lower()
+            if name in self._state.infobases:
+                raise SimulatorError(f'Infobase {infobase._properties["Name"]} already exists')
+            self._state.infobases[name] = infobase.copy()
+
+    @com_method
+    def CreateInfoBaseInfo(self):
+        return self._simulator.new_infobase_info()
+
+    @com_method
+    def Disconnect(self, connection):
+        pass
+
+    @com_method
+    def DropInfoBase(self, infobase, mode):
+        with self._agent.lock:
+            dropped = self._state.find_infobase(infobase)
+            name = dropped._properties['Name'].lower()
+            del self._state.infobases[name]
+            self._state.sessions = [s for s in self._state.sessions
+                                    if s._properties['infoBase']._properties['Name'].lower() != name]
+
+    @com_method
+    def GetInfoBaseConnections(self, infobase):
+        with self._agent.lock:
+            self._state.find_infobase(infobase)
+            return []
+
+    @com_method
+    def GetInfoBases(self):
+        with self._agent.lock:
+            return [ib.copy() for ib in self._state.infobases.values()]
+
+    @com_method
+    def UpdateInfoBase(self, infobase):
+        with self._agent.lock:
+            self._state.find_infobase(infobase)._properties.update(infobase._properties)
+
+
+def install_simulator(config: Optional['SimulatorConfig'] = None) -> 'Simulator':
+    """
+    Создает имитацию серверов и подменяет ей создание COMConnector
+    """
+    return Simulator(config).install()
+
+
+def uninstall_simulator():
+    comcntr.set_connector_factory(None)
@@ -0,0 +1,265 @@
+"""
+Снимки состояния COM-объектов в виде обычных данных Python.
+
+Каждое чтение свойства обертки из comcntr - это отдельный вызов через IDispatch.
+Снимок читает нужные свойства исходного COM-объекта за один проход, ровно по одному разу каждое,
+и сохраняет их в компактную запись со __slots__. Дальше снимок можно читать сколько угодно раз,
+а также передавать между потоками, так как он не содержит ссылок на COM-объекты.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+from .comcntr import (
+    COMObjectWrapper,
+    Cluster,
+    InfobaseShort,
+    Infobase,
+    License,
+    RegUser,
+    Session,
+    WorkingProcess,
+)
+
+
+PropertySpec = Union[str, Tuple[str, Callable[[Any], Any]]]
+
+
+class Snapshot:
+    """
+    Базовый класс снимков. В наследниках properties сопоставляет имени атрибута снимка
+    имя свойства COM-объекта, либо пару (имя свойства, функция преобразования значения).
+    Имена атрибутов совпадают с именами свойств соответствующих оберток из comcntr,
+    поэтому снимок может быть передан в те же сериализаторы, что и обертка.
+    """
+    __slots__ = ()
+
+    properties: Dict[str, PropertySpec] = {}
+
+    @classmethod
+    def field_names(cls) -> Tuple[str, ...]:
+        return tuple(cls.properties)
+
+    @classmethod
+    def from_raw(cls, iv8obj, fields: Optional[Iterable[str]] = None) -> 'Snapshot':
+        """
+        Создает снимок непосредственно из COM-объекта.
+        :param fields: имена атрибутов, которые необходимо прочитать. По умолчанию - все.
+        Непрочитанные атрибуты в снимке отсутствуют.
+        """
+        snapshot = cls.__new__(cls)
+        snapshot.fetch(iv8obj, fields)
+        return snapshot
+
+    def fetch(self, iv8obj, fields: Optional[Iterable[str]] = None):
+        """
+        Дочитывает в снимок атрибуты fields из исходного COM-объекта
+        """
+        names = self.properties if fields is None else [name for name in fields if name in self.properties]
+        for name in names:
+            spec = self.properties[name]
+            if isinstance(spec, str):
+                value = getattr(iv8obj, spec)
+            else:
+                com_name, convert = spec
+                value = convert(getattr(iv8obj, com_name))
+            setattr(self, name, value)
+
+    @classmethod
+    def from_com(cls, wrapper: 'COMObjectWrapper', fields: Optional[Iterable[str]] = None) -> 'Snapshot':
+        return cls.from_raw(wrapper.get_underlying_com_object(), fields)
+
+    def fetched_fields(self) -> List[str]:
+        return [name for name in self.properties if hasattr(self, name)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.fetched_fields()}
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())
+        return f'{type(self).__name__}({fields})'
+
+
+def _nested(snapshot_class: Type['Snapshot']) -> Callable[[Any], Optional['Snapshot']]:
+    def convert(iv8obj):
+        return snapshot_class.from_raw(iv8obj) if iv8obj is not None else None
+    return convert
+
+
+def _name_of(iv8obj) -> Optional[str]:
+    return iv8obj.Name if iv8obj is not None else None
+
+
+class ClusterSnapshot(Snapshot):
+    properties = {
+        'cluster_name': 'ClusterName',
+        'errors_count_threshold': 'ErrorsCountThreshold',
+        'expiration_timeout': 'ExpirationTimeout',
+        'hostname': 'HostName',
+        'kill_problem_processes': 'KillProblemProcesses',
+        'lifetime_limit': 'LifeTimeLimit',
+        'load_balancing_mode': 'LoadBalancingMode',
+        'main_port': 'MainPort',
+        'max_memory_size': 'MaxMemorySize',
+        'max_memory_time_limit': 'MaxMemoryTimeLimit',
+        'security_level': 'SecurityLevel',
+        'session_fault_tolerance_level': 'SessionFaultToleranceLevel',
+    }
+    __slots__ = tuple(properties)
+
+
+class InfobaseShortSnapshot(Snapshot):
+    properties = {
+        'descr': 'Descr',
+        'name': 'Name',
+    }
+    __slots__ = tuple(properties)
+
+
+class InfobaseSnapshot(InfobaseShortSnapshot):
+    # Свойства DateOffset, Locale и dbPassword доступны только для записи и в снимок не входят
+    properties = {
+        **InfobaseShortSnapshot.properties,
+        'dbms': 'DBMS',
+        'db_name': 'dbName',
+        'db_server_name': 'dbServerName',
+        'db_user': 'dbUser',
+        'denied_from': 'DeniedFrom',
+        'denied_message': 'DeniedMessage',
+        'denied_parameter': 'DeniedParameter',
+        'denied_to': 'DeniedTo',
+        'external_session_manager_connection_string': 'ExternalSessionManagerConnectionString',
+        'external_session_manager_required': 'ExternalSessionManagerRequired',
+        'license_distribution_allowed': ('LicenseDistributionAllowed', bool),
+        'permission_code': 'PermissionCode',
+        'safe_mode_security_profile_name': 'SafeModeSecurityProfileName',
+        'scheduled_jobs_denied': 'ScheduledJobsDenied',
+        'security_level': 'SecurityLevel',
+        'security_profile_name': 'SecurityProfileName',
+        'sessions_denied': 'SessionsDenied',
+    }
+    __slots__ = tuple(name for name in properties if name not in InfobaseShortSnapshot.properties)
+
+
+class LicenseSnapshot(Snapshot):
+    properties = {
+        'filename': 'FileName',
+        'full_presentation': 'FullPresentation',
+        'issued_by_server': 'IssuedByServer',
+        'license_type': 'LicenseType',
+        'max_users_all': 'MaxUsersAll',
+        'max_users_cur': 'MaxUsersCur',
+        'net': 'Net',
+        'rmngr_address': 'RMngrAddress',
+        'rmngr_pid': 'RMngrPID',
+        'rmngr_port': 'RMngrPort',
+        'series': 'Series',
+        'short_presentation': 'ShortPresentation',
+    }
+    __slots__ = tuple(properties)
+
+
+class WorkingProcessSnapshot(Snapshot):
+    properties = {
+        'available_performance': 'AvailablePerfomance',
+        'avg_call_time': 'AvgCallTime',
+        'avg_db_call_time': 'AvgDBCallTime',
+        'avg_lock_call_time': 'AvgLockCallTime',
+        'avg_server_call_time': 'AvgServerCallTime',
+        'avg_threads': 'AvgThreads',
+        'capacity': 'Capacity',
+        'connections': 'Connections',
+        'hostname': 'HostName',
+        'is_enable': 'IsEnable',
+        'license': ('License', _nested(LicenseSnapshot)),
+        'main_port': 'MainPort',
+        'memory_excess_time': 'MemoryExcessTime',
+        'memory_size': 'MemorySize',
+        'pid': 'PID',
+        'running': 'Running',
+        'selection_size': 'SelectionSize',
+        'started_at': 'StartedAt',
+        'use': 'Use',
+    }
+    __slots__ = tuple(properties)
+
+
+class SessionSnapshot(Snapshot):
+    # Вложенные объекты соединения, рабочего процесса и лицензии не читаются: каждый из них
+    # потребовал бы еще нескольких вызовов на каждый сеанс. От информационной базы берется только имя.
+    properties = {
+        'app_id': 'AppID',
+        'blocked_by_dbms': 'blockedByDBMS',
+        'blocked_by_ls': 'blockedByLS',
+        'bytes_all': 'bytesAll',
+        'bytes_last_5min': 'bytesLast5Min',
+        'calls_all': 'callsAll',
+        'calls_last_5min': 'callsLast5Min',
+        'cpu_time_all': 'cpuTimeAll',
+        'cpu_time_current': 'cpuTimeCurrent',
+        'cpu_time_last_5min': 'cpuTimeLast5Min',
+        'current_service_name': 'CurrentServiceName',
+        'dbms_bytes_all': 'dbmsBytesAll',
+        'dbms_bytes_last_5min': 'dbmsBytesLast5Min',
+        'db_proc_info': 'dbProcInfo',
+        'db_proc_took': 'dbProcTook',
+        'db_proc_took_at': 'dbProcTookAt',
+        'duration_all': 'durationAll',
+        'duration_all_dbms': 'durationAllDBMS',
+        'duration_all_service': 'durationAllService',
+        'duration_current': 'durationCurrent',
+        'duration_current_dbms': 'durationCurrentDBMS',
+        'duration_current_service': 'durationCurrentService',
+        'duration_last_5min': 'durationLast5Min',
+        'duration_last_5min_dbms': 'durationLast5MinDBMS',
+        'duration_last_5min_service': 'durationLast5MinService',
+        'hibernate': 'Hibernate',
+        'hibernate_session_terminate_time': 'HibernateSessionTerminateTime',
+        'host': 'Host',
+        'infobase': ('infoBase', _name_of),
+        'last_active_at': 'LastActiveAt',
+        'memory_all': 'MemoryAll',
+        'memory_current': 'MemoryCurrent',
+        'memory_last_5min': 'MemoryLast5Min',
+        'session_id': 'SessionID',
+        'started_at': 'StartedAt',
+        'user_name': 'userName',
+    }
+    __slots__ = tuple(properties)
+
+
+class RegUserSnapshot(Snapshot):
+    properties = {
+        'descr': 'Descr',
+        'name': 'Name',
+        'password_auth_allowed': 'PasswordAuthAllowed',
+        'sys_auth_allowed': 'SysAuthAllowed',
+        'sys_username': 'SysUserName',
+    }
+    __slots__ = tuple(properties)
+
+
+SNAPSHOT_CLASSES: Dict[Type['COMObjectWrapper'], Type['Snapshot']] = {
+    Cluster: ClusterSnapshot,
+    InfobaseShort: InfobaseShortSnapshot,
+    Infobase: InfobaseSnapshot,
+    License: LicenseSnapshot,
+    WorkingProcess: WorkingProcessSnapshot,
+    Session: SessionSnapshot,
+    RegUser: RegUserSnapshot,
+}
+
+
+def take_snapshot(obj, fields: Optional[Iterable[str]] = None):
+    """
+    Возвращает снимок обертки COM-объекта. Объекты, не являющиеся обертками (в том числе снимки),
+    возвращаются без изменений.
+    """
+    snapshot_class = SNAPSHOT_CLASSES.get(type(obj))
+    if snapshot_class is None:
+        return obj
+    return snapshot_class.from_com(obj, fields)
+
+
+def take_snapshots(objs: Iterable, fields: Optional[Iterable[str]] = None) -> list:
+    if fields is not None:
+        fields = list(fields)
+    return [take_snapshot(obj, fields) for obj in objs]
@@ -0,0 +1,245 @@
+"""
+Хранилище временных рядов в массивах фиксированной ширины.
+
+Ряд состоит из нескольких уровней детализации. Каждый уровень делит время на интервалы длиной step секунд
+и хранит одну точку на интервал: время начала интервала (uint32) и средние значения показателей
+за интервал (float32) в отдельных массивах array. Массивы растут по мере поступления точек
+до capacity = retention / step элементов, после чего используются как кольцевой буфер,
+вытесняя самые старые точки. Таким образом, каждый уровень хранит данные не дольше retention секунд,
+а старые данные остаются доступными только на более грубых уровнях.
+
+Запрос диапазона выполняется по самому детальному уровню, который еще хранит начало диапазона.
+Точки уровня упорядочены по времени, поэтому границы диапазона находятся двоичным поиском.
+"""
+import threading
+import time
+from array import array
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+
+TierSpec = Tuple[int, int]
+
+# Уровни детализации по умолчанию: (длина интервала, время хранения) в секундах
+DEFAULT_TIERS: Tuple[TierSpec, ...] = (
+    (60, 6 * 3600),
+    (600, 3 * 86400),
+    (3600, 30 * 86400),
+)
+
+
+def parse_tiers(value: str) -> Tuple[TierSpec, ...]:
+    """
+    Разбирает описание уровней вида "60:21600,600:259200"
+    """
+    tiers = []
+    for item in value.split(','):
+        step, _, retention = item.partition(':')
+        tiers.append((int(step), int(retention)))
+    return tuple(sorted(tiers))
+
+
+def percentile(ordered: Sequence[float], p: float) -> Optional[float]:
+    """
+    Перцентиль методом ближайшего ранга по отсортированной выборке
+    """
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class Tier:
+    """
+    Один уровень детализации ряда. Точки последнего, еще не завершенного интервала
+    накапливаются в суммах и попадают в массивы при переходе к следующему интервалу
+    """
+    __slots__ = ('step', 'capacity', 'times', 'columns', 'head', 'pending_start', 'pending_sums', 'pending_count')
+
+    def __init__(self, step: int, retention: int, width: int):
+        self.step = step
+        self.capacity = max(1, retention // step)
+        self.times = array('I')
+        self.columns = [array('f') for _ in range(width)]
+        # Логически первая (самая старая) точка после заполнения буфера
+        self.head = 0
+        self.pending_start: Optional[int] = None
+        self.pending_sums = [0.0] * width
+        self.pending_count = 0
+
+    @property
+    def retention(self) -> int:
+        return self.step * self.capacity
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, timestamp: float, values: Sequence[float]):
+        start = int(timestamp) // self.step * self.step
+        if self.pending_start is not None and start != self.pending_start:
+            if start < self.pending_start:
+                # Точки, опоздавшие к уже закрытому интервалу, не учитываются
+                return
+            self.flush()
+        if self.pending_start is None:
+            self.pending_start = start
+        for i, value in enumerate(values):
+            self.pending_sums[i] += value
+        self.pending_count += 1
+
+    def flush(self):
+        if self.pending_start is None:
+            return
+        means = [s / self.pending_count for s in self.pending_sums]
+        if len(self.times) < self.capacity:
+            self.times.append(self.pending_start)
+            for column, value in zip(self.columns, means):
+                column.append(value)
+        else:
+            self.times[self.head] = self.pending_start
+            for column, value in zip(self.columns, means):
+                column[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+        self.pending_start = None
+        self.pending_sums = [0.0] * len(self.pending_sums)
+        self.pending_count = 0
+
+    def _physical(self, i: int) -> int:
+        return (self.head + i) % len(self.times)
+
+    def _time_at(self, i: int) -> int:
+        return self.times[self._physical(i)]
+
+    def _lower_bound(self, timestamp: float) -> int:
+        lo, hi = 0, len(self.times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def oldest(self) -> Optional[int]:
+        if self.times:
+            return self._time_at(0)
+        return self.pending_start
+
+    def latest(self) -> Optional[int]:
+        if self.pending_start is not None:
+            return self.pending_start
+        return self._time_at(len(self.times) - 1) if self.times else None
+
+    def select(self, column: int, start: float, end: float) -> List[Tuple[int, float]]:
+        """
+        Точки интервалов, начинающихся в [start, end], включая незавершенный интервал
+        """
+        points = []
+        for i in range(self._lower_bound(start), len(self.times)):
+            p = self._physical(i)
+            t = self.times[p]
+            if t > end:
+                break
+            points.append((t, self.columns[column][p]))
+        if self.pending_start is not None and start <= self.pending_start <= end:
+            points.append((self.pending_start, self.pending_sums[column] / self.pending_count))
+        return points
+
+    def nbytes(self) -> int:
+        return self.times.itemsize * len(self.times) + sum(c.itemsize * len(c) for c in self.columns)
+
+
+class TimeSeries:
+    __slots__ = ('tiers', )
+
+    def __init__(self, tiers: Iterable[TierSpec], width: int):
+        self.tiers = [Tier(step, retention, width) for step, retention in tiers]
+
+    def add(self, timestamp: float, values: Sequence[float]):
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def latest(self) -> Optional[int]:
+        return self.tiers[0].latest()
+
+    def select_tier(self, start: float, now: float) -> 'Tier':
+        """
+        Самый детальный уровень, время хранения которого покрывает начало диапазона
+        """
+        for tier in self.tiers:
+            if now - tier.retention <= start:
+                return tier
+        return self.tiers[-1]
+
+
+class TimeSeriesStore:
+    """
+    Набор рядов с одинаковым составом показателей, доступ к которым выполняется по ключу.
+    Ряды, в которые не поступало данных дольше времени хранения самого грубого уровня, удаляются
+    """
+
+    def __init__(self, metrics: Sequence[str], tiers: Iterable[TierSpec] = DEFAULT_TIERS):
+        self.metrics = tuple(metrics)
+        self.tiers = tuple(sorted(tiers))
+        self._columns = {name: i for i, name in enumerate(self.metrics)}
+        self._series: Dict[Hashable, 'TimeSeries'] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def retention(self) -> int:
+        return max(retention for _, retention in self.tiers)
+
+    def column(self, metric: str) -> int:
+        try:
+            return self._columns[metric]
+        except KeyError:
+            raise ValueError(f'Unknown metric {metric}')
+
+    def add(self, timestamp: float, points: Iterable[Tuple[Hashable, Sequence[float]]]):
+        """
+        Добавляет значения показателей нескольких рядов на момент timestamp
+        :param points: пары (ключ ряда, значения в порядке metrics)
+        """
+        with self._lock:
+            for key, values in points:
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = TimeSeries(self.tiers, len(self.metrics))
+                series.add(timestamp, values)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [key for key, series in self._series.items()
+                       if series.latest() is None or series.latest() < now - self.retention]
+            for key in expired:
+                del self._series[key]
+        return len(expired)
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._series)
+
+    def range(self, key: Hashable, metric: str, start: float, end: float,
+              now: Optional[float] = None) -> Tuple[int, List[Tuple[int, float]]]:
+        """
+        Точки ряда в диапазоне [start, end]
+        :return: длина интервала выбранного уровня и пары (время начала интервала, среднее значение)
+        """
+        column = self.column(metric)
+        now = time.time() if now is None else now
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return self.tiers[0][0], []
+            tier = series.select_tier(start, now)
+            return tier.step, tier.select(column, start, end)
+
+    def percentiles(self, key: Hashable, metric: str, start: float, end: float, ps: Iterable[float],
+                    now: Optional[float] = None) -> Dict[float, Optional[float]]:
+        _, points = self.range(key, metric, start, end, now)
+        ordered = sorted(value for _, value in points)
+        return {p: percentile(ordered, p) for p in ps}
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(tier.nbytes() for series in self._series.values() for tier in series.tiers)
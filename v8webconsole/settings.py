@@ -24,6 +24,26 @@ def get_bool_from_env(name, default_value):
     return default_value
 
 
+def get_int_from_env(name, default_value):
+    if name in os.environ:
+        value = os.environ[name]
+        try:
+            return int(value)
+        except ValueError as e:
+            raise ValueError(f"{value} is an invalid value for {name}") from e
+    return default_value
+
+
+def get_float_from_env(name, default_value):
+    if name in os.environ:
+        value = os.environ[name]
+        try:
+            return float(value)
+        except ValueError as e:
+            raise ValueError(f"{value} is an invalid value for {name}") from e
+    return default_value
+
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -59,6 +79,7 @@ if DEBUG:
     INSTALLED_APPS += ['django_extensions', ]
 
 MIDDLEWARE = [
+    'v8webconsole.webconsole.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -189,6 +210,95 @@ SIMPLE_JWT = {
 }
 
 
+# 1C:Enterprise server interaction
+
+# Maximum number of idle server agent connections kept in the process-wide pool
+V8_AGENT_POOL_MAX_SIZE = get_int_from_env("V8_AGENT_POOL_MAX_SIZE", 32)
+# Idle connections older than this (seconds) are closed
+V8_AGENT_POOL_IDLE_TIMEOUT = get_float_from_env("V8_AGENT_POOL_IDLE_TIMEOUT", 300)
+# Idle connections are health-checked before reuse if not checked for this long (seconds)
+V8_AGENT_POOL_HEALTH_CHECK_INTERVAL = get_float_from_env("V8_AGENT_POOL_HEALTH_CHECK_INTERVAL", 30)
+# Maximum number of idle working process connections kept in the process-wide pool
+V8_WORKING_PROCESS_POOL_MAX_SIZE = get_int_from_env("V8_WORKING_PROCESS_POOL_MAX_SIZE", 32)
+# Idle working process connections older than this (seconds) are closed
+V8_WORKING_PROCESS_POOL_IDLE_TIMEOUT = get_float_from_env("V8_WORKING_PROCESS_POOL_IDLE_TIMEOUT", 300)
+# Lifetime (seconds) of cached cluster and infobase lists. 0 - lists are not cached
+V8_INVENTORY_TTL = get_float_from_env("V8_INVENTORY_TTL", 10)
+# Number of COM apartment threads owning the server connections. 0 - use the request thread itself
+V8_COM_WORKERS = get_int_from_env("V8_COM_WORKERS", 4)
+# Number of COM apartments serving requests to one 1C server. A slow call to a server then holds only one of them
+V8_COM_WORKERS_PER_HOST = get_int_from_env("V8_COM_WORKERS_PER_HOST", 2)
+# Time (seconds) a request waits for its COM apartment. The request is answered with 503 if it is still queued
+# and with 504 if the server agent is still responding. 0 - wait without a limit
+V8_COM_CALL_TIMEOUT = get_float_from_env("V8_COM_CALL_TIMEOUT", 120)
+# Default time budget (seconds) of every host in fleet-wide requests, can be overridden by ?timeout=
+V8_FLEET_HOST_TIMEOUT = get_float_from_env("V8_FLEET_HOST_TIMEOUT", 10)
+# Maximum number of COM apartments terminating sessions of one cluster in parallel
+V8_SESSION_TERMINATION_CONCURRENCY = get_int_from_env("V8_SESSION_TERMINATION_CONCURRENCY", 4)
+# Time (seconds) to wait for parallel session termination before reporting sessions as timed out
+V8_SESSION_TERMINATION_TIMEOUT = get_float_from_env("V8_SESSION_TERMINATION_TIMEOUT", 60)
+# Lifetime (seconds) of host, cluster and infobase credentials cached in process memory. Changes saved
+# through this process reset the cache at once, changes made by other processes show up within this period
+V8_CREDENTIALS_CACHE_TTL = get_float_from_env("V8_CREDENTIALS_CACHE_TTL", 60)
+# Default and maximum page size of cluster, infobase and session lists requested with ?page_size= or ?cursor=
+V8_PAGE_SIZE = get_int_from_env("V8_PAGE_SIZE", 100)
+V8_PAGE_MAX_SIZE = get_int_from_env("V8_PAGE_MAX_SIZE", 1000)
+# Unpaginated JSON lists of at least this many items are serialized and sent as a stream
+V8_STREAMING_LIST_THRESHOLD = get_int_from_env("V8_STREAMING_LIST_THRESHOLD", 500)
+# Maximum number of sub-requests in one /api/v1/batch request
+V8_BATCH_MAX_OPERATIONS = get_int_from_env("V8_BATCH_MAX_OPERATIONS", 100)
+# Time zone of 1C servers that have no time zone of their own in the admin. The server agent accepts and returns
+# local time without a time zone, so aware times sent to it are converted to this zone
+V8_SERVER_TIME_ZONE = os.environ.get("V8_SERVER_TIME_ZONE", "UTC")
+# Maximum number of COM apartments locking or unlocking infobases of one cluster in parallel
+V8_MAINTENANCE_CONCURRENCY = get_int_from_env("V8_MAINTENANCE_CONCURRENCY", 4)
+# Apartment threads running the parts of bulk infobase locking and session termination. They are separate
+# from request and job apartments, so bulk operations neither occupy nor wait for them
+V8_MAINTENANCE_WORKERS = get_int_from_env("V8_MAINTENANCE_WORKERS", 4)
+# Measure every COM method call and property access, totals are reported in the Server-Timing header
+V8_COM_INSTRUMENTATION = get_bool_from_env("V8_COM_INSTRUMENTATION", True)
+# COM calls slower than this (seconds) are logged with the method name and server address. 0 - disabled
+V8_COM_SLOW_CALL_THRESHOLD = get_float_from_env("V8_COM_SLOW_CALL_THRESHOLD", 0.5)
+# Server interaction backend: "com" - COMConnector of the installed 1C:Enterprise platform (Windows only),
+# "simulator" - in-memory simulation of 1C servers for development and load testing
+V8_BACKEND = os.environ.get("V8_BACKEND", "com")
+# Simulated dataset size per cluster of every simulated server
+V8_SIMULATOR_CLUSTERS = get_int_from_env("V8_SIMULATOR_CLUSTERS", 1)
+V8_SIMULATOR_INFOBASES = get_int_from_env("V8_SIMULATOR_INFOBASES", 100)
+V8_SIMULATOR_SESSIONS = get_int_from_env("V8_SIMULATOR_SESSIONS", 1000)
+V8_SIMULATOR_WORKING_PROCESSES = get_int_from_env("V8_SIMULATOR_WORKING_PROCESSES", 2)
+# Simulated latency (seconds) of every method call and every property access
+V8_SIMULATOR_CALL_LATENCY = get_float_from_env("V8_SIMULATOR_CALL_LATENCY", 0)
+V8_SIMULATOR_PROPERTY_LATENCY = get_float_from_env("V8_SIMULATOR_PROPERTY_LATENCY", 0)
+V8_SIMULATOR_SEED = get_int_from_env("V8_SIMULATOR_SEED", 0)
+# Interval (seconds) between background samples of cluster sessions and working processes
+V8_MONITORING_INTERVAL = get_float_from_env("V8_MONITORING_INTERVAL", 15)
+# Number of the latest samples kept in memory for every cluster
+V8_MONITORING_HISTORY = get_int_from_env("V8_MONITORING_HISTORY", 20)
+# Start background sampling when the application is loaded. wsgi.py enables it for web server processes,
+# otherwise every process starts sampling on its first monitoring request. Each process keeps its own samples
+V8_MONITORING_AUTOSTART = get_bool_from_env("V8_MONITORING_AUTOSTART", False)
+# Session metrics history tiers as step:retention pairs in seconds. Older data is kept only in coarser tiers
+V8_SERIES_TIERS = os.environ.get("V8_SERIES_TIERS", "60:21600,600:259200,3600:2592000")
+# Apartment threads executing background jobs (infobase creation and deletion, bulk session termination)
+V8_JOB_WORKERS = get_int_from_env("V8_JOB_WORKERS", 4)
+# Maximum number of jobs running at once against one 1C server
+V8_JOB_HOST_CONCURRENCY = get_int_from_env("V8_JOB_HOST_CONCURRENCY", 2)
+# Maximum number of database-heavy jobs running at once against one DBMS server
+V8_JOB_DBMS_CONCURRENCY = get_int_from_env("V8_JOB_DBMS_CONCURRENCY", 1)
+# Interval (seconds) between job queue scans
+V8_JOB_POLL_INTERVAL = get_float_from_env("V8_JOB_POLL_INTERVAL", 2)
+# Running jobs not confirmed by their process for this many seconds are failed as interrupted
+V8_JOB_HEARTBEAT_TIMEOUT = get_float_from_env("V8_JOB_HEARTBEAT_TIMEOUT", 60)
+# Start the job dispatcher when the application is loaded. wsgi.py enables it for web server processes,
+# management commands leave it off. A dedicated dispatcher process can be run with "manage.py run_jobs"
+V8_JOB_AUTOSTART = get_bool_from_env("V8_JOB_AUTOSTART", False)
+# Seconds the collected /metrics output is reused for, concurrent scrapes within this period hit no server agent
+V8_METRICS_CACHE_TTL = get_float_from_env("V8_METRICS_CACHE_TTL", 10)
+# Static bearer token accepted by /metrics in addition to JWT. Empty - JWT only
+V8_METRICS_TOKEN = os.environ.get("V8_METRICS_TOKEN", "")
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -0,0 +1 @@
+default_app_config = 'v8webconsole.webconsole.apps.WebconsoleConfig'
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class WebconsoleConfig(AppConfig):
-    name = 'webconsole'
+    name = 'v8webconsole.webconsole'
+    label = 'webconsole'
+
+    def ready(self):
+        if settings.V8_JOB_AUTOSTART:
+            # Задания, оставшиеся в очереди после перезапуска, выполняются без ожидания обращений к API
+            from .jobs import job_runner
+            job_runner.ensure_started()
+        if settings.V8_MONITORING_AUTOSTART:
+            # Снимки кластеров готовы к первому обращению к мониторингу
+            from .monitoring import cluster_poller
+            cluster_poller.ensure_started()
@@ -0,0 +1,163 @@
+"""
+Пакетное выполнение запросов к API.
+
+Пакет - список подзапросов (метод, путь, тело), которые по очереди обрабатываются обычными представлениями API
+и возвращаются одним ответом. Подзапросы аутентифицируются пользователем самого пакета.
+
+Подзапросы пакета используют общую область соединений ConnectionScope: соединение с агентом сервера
+и интерфейсы кластеров с уже выполненными аутентификациями запоминаются первым обратившимся к ним
+подзапросом и используются остальными.
+Область передается представлениям через контекстную переменную, которая доступна и в рабочих потоках-апартаментах.
+Запросы к одному серверу могут выполняться разными апартаментами, поэтому область хранит соединения
+отдельно для каждой пары сервер - апартамент. Соединения используются только в создавшем их апартаменте
+и освобождаются там же по завершении пакета.
+"""
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, unquote_to_bytes
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from v8webconsole.core.cluster import ClusterControlInterface, ServerAgentControlInterface
+from v8webconsole.core.pool import PooledConnection
+from .resources import (
+    agent_connection_pool,
+    com_executor,
+)
+
+
+class HostConnections:
+    """
+    Соединения области с одним сервером. Используются только в COM-апартаменте сервера
+    """
+
+    def __init__(self, lease: 'PooledConnection', ragent_interface: 'ServerAgentControlInterface'):
+        self.lease = lease
+        self.ragent_interface = ragent_interface
+        self.cluster_interfaces: Dict[str, 'ClusterControlInterface'] = {}
+
+    def get_cluster_interface(self, cluster_name: str) -> 'ClusterControlInterface':
+        key = cluster_name.lower()
+        if key not in self.cluster_interfaces:
+            self.cluster_interfaces[key] = self.ragent_interface.get_cluster_interface(cluster_name)
+        return self.cluster_interfaces[key]
+
+    def release(self, discard: bool = False):
+        for cluster_interface in self.cluster_interfaces.values():
+            cluster_interface.close(discard=discard)
+        self.cluster_interfaces.clear()
+        self.ragent_interface = None
+        agent_connection_pool.release(self.lease, discard=discard)
+
+
+class ConnectionScope:
+    """
+    Общие для нескольких запросов соединения с серверами.
+    Соединения доступны только в том апартаменте, в котором созданы
+    """
+
+    def __init__(self):
+        self._connections: Dict[Tuple[str, int], 'HostConnections'] = {}
+
+    def get_connections(self, host_id) -> Optional['HostConnections']:
+        return self._connections.get((str(host_id), threading.get_ident()))
+
+    def add_connections(self, host_id, connections: 'HostConnections'):
+        self._connections[(str(host_id), threading.get_ident())] = connections
+
+    def release(self, host_id, discard: bool = False, thread_id: Optional[int] = None):
+        """
+        Освобождает соединения сервера, созданные в апартаменте thread_id (по умолчанию - в текущем).
+        Выполняется в этом апартаменте
+        """
+        key = (str(host_id), threading.get_ident() if thread_id is None else thread_id)
+        connections = self._connections.pop(key, None)
+        if connections is not None:
+            connections.release(discard)
+
+    def close(self):
+        for host_id, thread_id in list(self._connections):
+            # thread_id передается позиционно: именованный аргумент совпал бы с параметром submit_to_thread
+            com_executor.submit_to_thread(thread_id, self.release, host_id, False, thread_id).result()
+
+
+current_connection_scope: 'contextvars.ContextVar[Optional[ConnectionScope]]' = contextvars.ContextVar(
+    'connection_scope', default=None)
+
+
+@contextmanager
+def connection_scope() -> Iterator['ConnectionScope']:
+    """
+    Область соединений, общая для всех запросов, выполняемых внутри блока
+    """
+    scope = ConnectionScope()
+    token = current_connection_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_connection_scope.reset(token)
+        scope.close()
+
+
+def make_subrequest(request, method: str, path: str, body=None) -> 'WSGIRequest':
+    path, _, query_string = path.partition('?')
+    content = json.dumps(body).encode() if body is not None else b''
+    environ = dict(request.META)
+    environ.update({
+        'REQUEST_METHOD': method,
+        # По спецификации WSGI путь передается раскодированным, байты пути - символами latin-1
+        'PATH_INFO': unquote_to_bytes(path).decode('iso-8859-1'),
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': BytesIO(content),
+    })
+    subrequest = WSGIRequest(environ)
+    # Подзапрос не аутентифицируется повторно: пользователь пакета передается так же, как при force_authenticate
+    subrequest._force_auth_user = request.user
+    subrequest._force_auth_token = request.auth
+    return subrequest
+
+
+def response_data(response) -> Any:
+    if isinstance(response, Response):
+        return response.data
+    if getattr(response, 'streaming', False):
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    try:
+        return json.loads(content) if content else None
+    except ValueError:
+        return content.decode(response.charset or 'utf-8', 'replace')
+
+
+def execute_operation(request, operation: dict, excluded_views: tuple = ()) -> dict:
+    try:
+        match = resolve(unquote(operation['path'].partition('?')[0]))
+    except Resolver404:
+        match = None
+    view_class = getattr(match.func, 'cls', None) if match is not None else None
+    if view_class is None or not issubclass(view_class, APIView) or issubclass(view_class, excluded_views):
+        return {'status': 404, 'body': {'errors': [{'code': 'path', 'detail': 'Not found'}]}}
+    subrequest = make_subrequest(request, operation['method'], operation['path'], operation.get('body'))
+    response = match.func(subrequest, *match.args, **match.kwargs)
+    result = {'status': response.status_code, 'body': response_data(response)}
+    if response.has_header('Location'):
+        result['location'] = response['Location']
+    return result
+
+
+def execute_batch(request, operations: List[dict], excluded_views: tuple = ()) -> List[dict]:
+    """
+    Выполняет подзапросы по очереди в общей области соединений
+    :param excluded_views: представления, которые нельзя вызывать из пакета (например, само пакетное)
+    :return: код ответа и данные по каждому подзапросу в порядке их следования
+    """
+    with connection_scope():
+        return [execute_operation(request, operation, excluded_views) for operation in operations]
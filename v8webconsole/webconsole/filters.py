@@ -0,0 +1,154 @@
+"""
+Отбор и сортировка списков снимков COM-объектов по их полям.
+
+Агент сервера не умеет отбирать и сортировать объекты, поэтому списки обрабатываются в памяти
+после получения снимков, до сериализации: клиент получает и сериализуются только нужные объекты.
+Отбирать и сортировать можно по полям сериализатора действия (см. MultiSerializerViewSetMixin.get_filterable_fields),
+значения параметров разбираются этими же полями.
+
+Отбор: ?user_name=ivanov, ?app_id__in=Designer,1CV8C, ?infobase__contains=buh, ?memory_current__gte=1000000.
+Строки сравниваются без учета регистра, как и имена объектов 1С. Агент сервера возвращает местное время сервера
+без часового пояса, поэтому время из параметров переводится в часовой пояс сервера (см. Host.time_zone).
+Сортировка: ?ordering=-memory_current,user_name. Пустые значения всегда в конце списка.
+
+Параметры проверяются методом validate_query до получения списка у агента сервера.
+"""
+from datetime import datetime
+from typing import Any, List, Tuple
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from v8webconsole.clusterconfig.models import to_server_time
+
+
+LOOKUPS = ('exact', 'in', 'contains', 'gt', 'gte', 'lt', 'lte')
+
+
+def normalize(value: Any, time_zone: str = '') -> Any:
+    """
+    Приводит значения снимка и параметра к сравнимому виду
+    :param time_zone: часовой пояс сервера, в котором агент возвращает время
+    """
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, datetime):
+        return to_server_time(value, time_zone)
+    return value
+
+
+def get_server_time_zone(view) -> str:
+    getter = getattr(view, 'get_server_time_zone', None)
+    return getter() if getter is not None else ''
+
+
+def compare(actual: Any, lookup: str, value: Any) -> bool:
+    if lookup == 'exact':
+        return actual == value
+    if lookup == 'in':
+        return actual in value
+    if actual is None:
+        return False
+    if lookup == 'contains':
+        return value in str(actual).lower()
+    try:
+        if lookup == 'gt':
+            return actual > value
+        if lookup == 'gte':
+            return actual >= value
+        if lookup == 'lt':
+            return actual < value
+        return actual <= value
+    except TypeError:
+        return False
+
+
+class SnapshotFilterBackend(BaseFilterBackend):
+    """
+    Отбор снимков по параметрам вида поле или поле__условие. Прочие параметры запроса не учитываются
+    """
+
+    def get_conditions(self, request, view) -> List[Tuple[str, str, Any]]:
+        """
+        :return: условия в виде (атрибут снимка, условие, значение)
+        """
+        fields = view.get_filterable_fields()
+        conditions = []
+        time_zone = None
+        for param, raw in request.query_params.items():
+            name, _, lookup = param.partition('__')
+            if name not in fields:
+                continue
+            lookup = lookup or 'exact'
+            if lookup not in LOOKUPS:
+                raise ValidationError({param: f'Unsupported lookup "{lookup}", expected one of {", ".join(LOOKUPS)}'})
+            field = fields[name]
+            if time_zone is None:
+                time_zone = get_server_time_zone(view)
+            try:
+                if lookup == 'in':
+                    value = [normalize(field.to_internal_value(item), time_zone) for item in raw.split(',')]
+                elif lookup == 'contains':
+                    value = raw.lower()
+                else:
+                    value = normalize(field.to_internal_value(raw), time_zone)
+            except ValidationError as e:
+                raise ValidationError({param: e.detail})
+            conditions.append((field.source, lookup, value))
+        return conditions
+
+    def validate_query(self, request, view):
+        self.get_conditions(request, view)
+
+    def get_required_fields(self, request, view) -> List[str]:
+        fields = view.get_filterable_fields()
+        return [name for name in fields if any(param.partition('__')[0] == name for param in request.query_params)]
+
+    def filter_queryset(self, request, queryset, view):
+        conditions = self.get_conditions(request, view)
+        if not conditions:
+            return queryset
+        return [snapshot for snapshot in queryset
+                if all(compare(normalize(getattr(snapshot, source, None)), lookup, value)
+                       for source, lookup, value in conditions)]
+
+
+class SnapshotOrderingFilter(BaseFilterBackend):
+    """
+    Сортировка снимков по полям из параметра ?ordering=, "-" перед именем поля - по убыванию.
+    Сортировка устойчива: без параметра и при равных значениях сохраняется порядок, в котором объекты вернул агент
+    """
+    ordering_param = 'ordering'
+
+    def get_ordering(self, request, view) -> List[Tuple[str, str, bool]]:
+        """
+        :return: поля сортировки в виде (имя поля, атрибут снимка, по убыванию)
+        """
+        fields = view.get_filterable_fields()
+        ordering = []
+        for term in request.query_params.get(self.ordering_param, '').split(','):
+            term = term.strip()
+            if not term:
+                continue
+            name = term.lstrip('-')
+            if name not in fields:
+                raise ValidationError({self.ordering_param: f'Unknown field "{name}"'})
+            ordering.append((name, fields[name].source, term.startswith('-')))
+        return ordering
+
+    def validate_query(self, request, view):
+        self.get_ordering(request, view)
+
+    def get_required_fields(self, request, view) -> List[str]:
+        return [name for name, _, _ in self.get_ordering(request, view)]
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, view)
+        if not ordering:
+            return queryset
+        result = list(queryset)
+        for _, source, descending in reversed(ordering):
+            def sort_key(snapshot, source=source, descending=descending):
+                value = normalize(getattr(snapshot, source, None))
+                # Пустые значения в конце списка при любом направлении сортировки
+                return (value is not None, value) if descending else (value is None, value)
+            result.sort(key=sort_key, reverse=descending)
+        return result
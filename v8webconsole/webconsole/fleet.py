@@ -0,0 +1,268 @@
+"""
+Операции над всеми зарегистрированными серверами 1С одновременно.
+
+Обращения к каждому серверу выполняются в закрепленном за ним COM-апартаменте, поэтому разные серверы
+опрашиваются параллельно. Учетные данные читаются из базы заранее, в потоке обработки запроса,
+и передаются заданиям в виде обычных данных. Сервер, не уложившийся в отведенное время,
+попадает в список ошибок и не задерживает ответ по остальным серверам. Время каждого сервера отсчитывается
+с начала его опроса, а не с начала запроса: ожидание свободного апартамента в него не входит.
+"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from rest_framework.utils.encoders import JSONEncoder
+from v8webconsole.clusterconfig.credentials import resolve_cluster
+from v8webconsole.clusterconfig.models import Host
+from v8webconsole.core.cluster import ClusterControlInterface, ServerAgentControlInterface
+from v8webconsole.core.snapshots import take_snapshots
+from .resources import (
+    agent_connection_pool,
+    com_executor,
+    host_apartment_key,
+    inventory_cache,
+    working_process_connection_pool,
+)
+from .serializers import SessionSerializer
+
+
+log = logging.getLogger(__name__)
+
+
+class ClusterTarget(NamedTuple):
+    name: str
+    login: str
+    pwd: str
+
+
+class HostTarget(NamedTuple):
+    id: int
+    address: str
+    port: int
+    login: str
+    pwd: str
+    clusters: List[ClusterTarget]
+    time_zone: str = ''
+
+
+def first_credentials(credentials) -> Tuple[str, str]:
+    for creds in credentials:
+        return creds.login, creds.pwd
+    return '', ''
+
+
+def get_host_targets(hosts: Optional[Iterable['Host']] = None) -> List['HostTarget']:
+    """
+    Собирает серверы, их кластеры и учетные данные администраторов за несколько запросов к базе
+    """
+    if hosts is None:
+        hosts = Host.objects.prefetch_related('host_credentials', 'clusters__cluster_credentials')
+    return [
+        HostTarget(
+            host.id, host.address, host.port,
+            *first_credentials(host.host_credentials.all()),
+            [ClusterTarget(cluster.name, *first_credentials(cluster.cluster_credentials.all()))
+             for cluster in host.clusters.all()],
+            host.time_zone,
+        )
+        for host in hosts
+    ]
+
+
+def filter_targets(targets: List['HostTarget'], host_ids: Optional[Iterable[int]] = None,
+                   cluster_names: Optional[Iterable[str]] = None) -> List['HostTarget']:
+    """
+    Оставляет указанные серверы и кластеры с указанными именами (без учета регистра).
+    Незаданный фильтр не применяется, серверы без подходящих кластеров исключаются
+    """
+    host_ids = set(host_ids) if host_ids else None
+    names = {name.lower() for name in cluster_names} if cluster_names else None
+    filtered = []
+    for target in targets:
+        if host_ids is not None and target.id not in host_ids:
+            continue
+        if names is not None:
+            target = target._replace(clusters=[c for c in target.clusters if c.name.lower() in names])
+        if target.clusters:
+            filtered.append(target)
+    return filtered
+
+
+def get_cluster_target(host_id, cluster_name: str) -> Tuple['HostTarget', 'ClusterTarget']:
+    """
+    Сервер и один его кластер вместе с учетными данными администраторов
+    """
+    cluster = resolve_cluster(host_id, cluster_name)
+    cluster_target = ClusterTarget(cluster.name, *cluster.cluster_admin)
+    host_target = HostTarget(cluster.host.id, cluster.host.address, cluster.host.port,
+                             *cluster.host.agent_admin, [cluster_target], cluster.host.time_zone)
+    return host_target, cluster_target
+
+
+@contextmanager
+def agent_interface(target: 'HostTarget') -> Iterator['ServerAgentControlInterface']:
+    """
+    Интерфейс аутентифицированного агента сервера на соединении из пула
+    """
+    lease = agent_connection_pool.acquire((target.address, target.port))
+    broken = False
+    try:
+        ragent_interface = ServerAgentControlInterface(
+            host=target.address,
+            port=target.port,
+            v8comconnector=lease.connector,
+            agent_connection=lease.connection,
+            inventory_cache=inventory_cache,
+            working_process_pool=working_process_connection_pool,
+        )
+        ragent_interface.authenticate_agent(target.login, target.pwd)
+        yield ragent_interface
+    except Exception:
+        broken = True
+        raise
+    finally:
+        agent_connection_pool.release(lease, discard=broken)
+
+
+@contextmanager
+def cluster_admin_interface(host_target: 'HostTarget',
+                            cluster_target: 'ClusterTarget') -> Iterator['ClusterControlInterface']:
+    """
+    Интерфейс кластера с аутентифицированным администратором. По выходе соединение с рабочим процессом
+    возвращается в пул
+    """
+    with agent_interface(host_target) as ragent_interface:
+        interface = ragent_interface.get_cluster_interface(cluster_target.name)
+        broken = False
+        try:
+            interface.authenticate_cluster_admin(cluster_target.login, cluster_target.pwd)
+            yield interface
+        except Exception:
+            broken = True
+            raise
+        finally:
+            interface.close(discard=broken)
+
+
+def get_infobase_credentials(host_id, cluster_name: str, infobase_name: str) -> List[Tuple[str, str]]:
+    """
+    Учетные данные администратора информационной базы, либо, если они не заданы,
+    все учетные данные по умолчанию кластера
+    """
+    return resolve_cluster(host_id, cluster_name).get_infobase_credentials(infobase_name)
+
+
+def get_infobases_credentials(host_id, cluster_name: str,
+                              infobase_names: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    То же, что get_infobase_credentials, для нескольких информационных баз
+    """
+    cluster = resolve_cluster(host_id, cluster_name)
+    return {name: cluster.get_infobase_credentials(name) for name in infobase_names}
+
+
+def error_data(target: 'HostTarget', code: str, detail, cluster: Optional[str] = None) -> dict:
+    return {'host_id': target.id, 'host': f'{target.address}:{target.port}', 'cluster': cluster,
+            'code': code, 'detail': str(detail)}
+
+
+def collect_host_sessions(target: 'HostTarget') -> Tuple[List[dict], List[dict]]:
+    """
+    Получает сеансы всех зарегистрированных кластеров сервера. Выполняется в COM-апартаменте сервера.
+    Ошибка в одном кластере не мешает получить сеансы остальных.
+    :return: сериализованные сеансы и ошибки по кластерам
+    """
+    sessions, errors = [], []
+    with agent_interface(target) as ragent_interface:
+        for cluster in target.clusters:
+            try:
+                cluster_interface = ragent_interface.get_cluster_interface(cluster.name)
+                cluster_interface.authenticate_cluster_admin(cluster.login, cluster.pwd)
+                snapshots = take_snapshots(cluster_interface.get_sessions())
+            except StopIteration:
+                errors.append(error_data(target, 'not_found', f'Cluster [{cluster.name}] does not exists',
+                                         cluster.name))
+                continue
+            except Exception as e:
+                log.debug(f'[{target.address}] Unable to get sessions of cluster {cluster.name}: {e}')
+                errors.append(error_data(target, 'error', e, cluster.name))
+                continue
+            for data in SessionSerializer(snapshots, many=True).data:
+                sessions.append({'host_id': target.id, 'cluster': cluster.name, **data})
+    return sessions, errors
+
+
+def iter_host_results(targets: List['HostTarget'], timeout: float, fn: Callable,
+                      *args) -> Iterator[Tuple['HostTarget', Optional[Future]]]:
+    """
+    Выполняет fn(target, *args) для всех серверов параллельно, каждый - в апартаменте своего сервера,
+    и выдает пары (сервер, завершенное задание) по мере готовности.
+    Каждому серверу отводится timeout секунд с момента начала его опроса, столько же задание может ожидать
+    начала в очереди апартамента. Для серверов, не уложившихся в отведенное время, выдается задание None
+    """
+    submitted = time.monotonic()
+    started: Dict[int, float] = {}
+
+    def run(index: int, target: 'HostTarget'):
+        started[index] = time.monotonic()
+        return fn(target, *args)
+
+    futures = {com_executor.submit(host_apartment_key(target.id), run, index, target): index
+               for index, target in enumerate(targets)}
+    pending = set(futures)
+    while pending:
+        deadlines = {future: started.get(futures[future], submitted) + timeout for future in pending}
+        now = time.monotonic()
+        for future, deadline in deadlines.items():
+            if deadline <= now and not future.done():
+                # Еще не начатое задание отменяется, начатое завершится в своем апартаменте без ожидания результата
+                future.cancel()
+                pending.discard(future)
+                yield targets[futures[future]], None
+        if not pending:
+            break
+        done, _ = wait(pending, timeout=max(min(deadlines[f] for f in pending) - now, 0),
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            yield targets[futures[future]], future
+
+
+def iter_fleet_sessions(targets: List['HostTarget'], timeout: float) -> Iterator[Tuple[str, dict]]:
+    """
+    Опрашивает серверы параллельно и выдает результаты по мере готовности в виде пар ('session', данные сеанса)
+    и ('error', данные ошибки). Каждому серверу отводится timeout секунд с момента начала его опроса.
+    """
+    for target, future in iter_host_results(targets, timeout, collect_host_sessions):
+        if future is None:
+            yield 'error', error_data(target, 'timeout', f'No response within {timeout} seconds')
+            continue
+        try:
+            sessions, errors = future.result()
+        except Exception as e:
+            log.debug(f'[{target.address}] Unable to get sessions: {e}')
+            yield 'error', error_data(target, 'error', e)
+            continue
+        for session in sessions:
+            yield 'session', session
+        for error in errors:
+            yield 'error', error
+
+
+def stream_json(events: Iterable[Tuple[str, dict]]) -> Iterator[str]:
+    """
+    Выдает документ {"results": [...], "errors": [...]} по частям: результаты передаются клиенту
+    по мере получения, ошибки - в конце документа
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    errors = []
+    yield '{"results": ['
+    separator = ''
+    for kind, data in events:
+        if kind == 'error':
+            errors.append(data)
+            continue
+        yield separator + encoder.encode(data)
+        separator = ', '
+    yield '], "errors": ' + encoder.encode(errors) + '}'
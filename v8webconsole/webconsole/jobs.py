@@ -0,0 +1,388 @@
+"""
+Фоновое выполнение длительных операций над кластерами.
+
+Операция ставится в очередь в виде записи Job в базе данных и выполняется в отдельном пуле
+потоков-апартаментов, не занимая поток обработки HTTP-запроса. Поток-диспетчер выбирает ожидающие задания
+в порядке поступления с учетом ограничений на число одновременно выполняемых заданий одного сервера 1С
+и одного сервера СУБД. Задание захватывается условным обновлением статуса, поэтому одно задание
+не будет выполнено дважды, даже если очередь разбирают несколько процессов. После захвата ограничения
+проверяются повторно по зафиксированным в базе данным, и при их превышении задание возвращается в очередь:
+процессы, одновременно захватившие задания одного сервера, не превысят ограничение.
+
+Диспетчер запускается при загрузке приложения веб-сервером (V8_JOB_AUTOSTART, см. wsgi.py), либо отдельным
+процессом командой manage.py run_jobs. Задания, оставшиеся в очереди после перезапуска, выполняются сразу.
+Параметры из Job.SECRET_PARAMS удаляются из задания при любом его завершении, в том числе при отмене.
+
+Выполняющиеся задания периодически отмечаются диспетчером. Задание, отметка которого не обновлялась
+дольше heartbeat_timeout секунд, считается прерванным (например, вместе с процессом) и завершается с ошибкой.
+
+Обработчик задания получает JobContext, через который сообщает о ходе выполнения
+и проверяет, не запрошена ли отмена. Отмена выполняется между шагами обработчика:
+начатый вызов агента сервера прервать невозможно.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from v8webconsole.core.apartment import COMApartmentExecutor
+from v8webconsole.core.snapshots import take_snapshot
+from . import maintenance
+from .fleet import (
+    cluster_admin_interface,
+    get_cluster_target,
+    get_infobase_credentials,
+    get_infobases_credentials,
+)
+from .models import Job
+from .serializers import (
+    CreateInfobaseSerializer,
+    DetailInfobaseSerializer,
+    InfobaseLockSerializer,
+    InfobaseUnlockSerializer,
+)
+from .sessions import terminate_matching_sessions
+
+
+log = logging.getLogger(__name__)
+
+
+JobHandler = Callable[['Job', 'JobContext'], Optional[dict]]
+
+
+class JobCancelled(Exception):
+    """
+    :param result: результат, полученный обработчиком до отмены
+    """
+
+    def __init__(self, result: Optional[dict] = None):
+        super().__init__()
+        self.result = result
+
+
+class JobContext:
+    """
+    Связь обработчика с записью задания. Обновления хода выполнения записываются в базу
+    не чаще одного раза в progress_interval секунд
+    """
+
+    def __init__(self, job: 'Job', progress_interval: float = 0.5):
+        self.job = job
+        self.progress_interval = progress_interval
+        self._progress_saved_at = 0.0
+
+    def progress(self, fraction: float, message: str = ''):
+        now = time.monotonic()
+        if fraction < 1 and now - self._progress_saved_at < self.progress_interval:
+            return
+        self._progress_saved_at = now
+        self.job.progress = max(0.0, min(1.0, fraction))
+        self.job.progress_message = message[:200]
+        Job.objects.filter(id=self.job.id).update(progress=self.job.progress,
+                                                  progress_message=self.job.progress_message)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return Job.objects.filter(id=self.job.id, cancel_requested=True).exists()
+
+    def check_cancelled(self):
+        """
+        Прерывает выполнение обработчика, если запрошена отмена задания
+        """
+        if self.cancel_requested:
+            raise JobCancelled()
+
+
+_handlers: Dict[str, 'JobHandler'] = {}
+
+
+def job_handler(kind: str):
+    """
+    Регистрирует обработчик заданий вида kind
+    """
+    def register(handler: 'JobHandler') -> 'JobHandler':
+        _handlers[kind] = handler
+        return handler
+    return register
+
+
+def dump_json(data) -> str:
+    return JSONEncoder(ensure_ascii=False).encode(data)
+
+
+class JobRunner:
+
+    def __init__(self, workers: int = 4, host_concurrency: int = 2, dbms_concurrency: int = 1,
+                 poll_interval: float = 2, heartbeat_timeout: float = 60):
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.dbms_concurrency = dbms_concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+        self.executor = COMApartmentExecutor(workers=workers, name='job')
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='job-dispatcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def enqueue(self, kind: str, host_id, cluster_name: str, params: dict, dbms_server: str = '',
+                created_by=None) -> 'Job':
+        if kind not in _handlers:
+            raise ValueError(f'Unknown job kind {kind}')
+        job = Job.objects.create(
+            kind=kind,
+            host_id=host_id,
+            cluster_name=cluster_name,
+            dbms_server=(dbms_server or '').lower(),
+            params_json=dump_json(params),
+            created_by=created_by if created_by is not None and created_by.is_authenticated else None,
+        )
+        self.ensure_started()
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job: 'Job') -> 'Job':
+        """
+        Ожидающее задание отменяется сразу, выполняющемуся передается запрос на отмену
+        """
+        cancelled = Job.objects.filter(id=job.id, status=Job.PENDING).update(
+            status=Job.CANCELLED, cancel_requested=True, params_json=dump_json(job.public_params),
+            finished_at=timezone.now())
+        if not cancelled:
+            Job.objects.filter(id=job.id, status=Job.RUNNING).update(cancel_requested=True)
+        job.refresh_from_db()
+        return job
+
+    def _run(self):
+        while not self._stopped.is_set():
+            close_old_connections()
+            try:
+                self.heartbeat()
+                self.fail_abandoned()
+                self.dispatch()
+            except Exception as e:
+                log.exception(f'Job dispatching failed: {e}')
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def heartbeat(self):
+        with self._lock:
+            running = list(self._running)
+        if running:
+            Job.objects.filter(id__in=running).update(heartbeat_at=timezone.now())
+
+    def fail_abandoned(self):
+        deadline = timezone.now() - datetime.timedelta(seconds=self.heartbeat_timeout)
+        with self._lock:
+            running = list(self._running)
+        abandoned = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=deadline).exclude(id__in=running)
+        for job in abandoned:
+            failed = Job.objects.filter(id=job.id, status=Job.RUNNING, heartbeat_at__lt=deadline).update(
+                status=Job.FAILED, error='Job was interrupted', params_json=dump_json(job.public_params),
+                finished_at=timezone.now())
+            if failed:
+                log.warning(f'Job {job} was interrupted on {job.worker}')
+
+    def dispatch(self):
+        """
+        Запускает ожидающие задания, пока есть свободные потоки и не превышены ограничения
+        """
+        with self._lock:
+            free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        # Выполняющиеся задания учитываются по всем процессам, разбирающим очередь
+        running = Job.objects.filter(status=Job.RUNNING).order_by()
+        by_host = dict(running.values_list('host_id').annotate(n=Count('id')))
+        by_dbms = dict(running.exclude(dbms_server='').values_list('dbms_server').annotate(n=Count('id')))
+        busy_hosts = [host for host, n in by_host.items() if n >= self.host_concurrency]
+        busy_dbms = [dbms for dbms, n in by_dbms.items() if n >= self.dbms_concurrency]
+        pending = Job.objects.filter(status=Job.PENDING).exclude(host_id__in=busy_hosts) \
+            .exclude(dbms_server__in=busy_dbms).order_by('id')
+        for job in pending.iterator():
+            if free <= 0:
+                break
+            if by_host.get(job.host_id, 0) >= self.host_concurrency:
+                continue
+            if job.dbms_server and by_dbms.get(job.dbms_server, 0) >= self.dbms_concurrency:
+                continue
+            if not self.claim(job):
+                continue
+            by_host[job.host_id] = by_host.get(job.host_id, 0) + 1
+            if job.dbms_server:
+                by_dbms[job.dbms_server] = by_dbms.get(job.dbms_server, 0) + 1
+            free -= 1
+            with self._lock:
+                self._running.add(job.id)
+            self.executor.submit(None, self.execute, job.id)
+
+    def claim(self, job: 'Job') -> bool:
+        """
+        Захватывает ожидающее задание. Если с учетом заданий, захваченных другими процессами,
+        ограничения сервера 1С или сервера СУБД превышены, задание возвращается в очередь
+        """
+        now = timezone.now()
+        claimed = Job.objects.filter(id=job.id, status=Job.PENDING).update(
+            status=Job.RUNNING, worker=self.worker_name, started_at=now, heartbeat_at=now)
+        if not claimed:
+            return False
+        running = Job.objects.filter(status=Job.RUNNING)
+        if running.filter(host_id=job.host_id).count() <= self.host_concurrency \
+                and (not job.dbms_server
+                     or running.filter(dbms_server=job.dbms_server).count() <= self.dbms_concurrency):
+            return True
+        # Процесс, проверивший ограничения последним, видит все захваченные задания и уступает.
+        # Если уступят оба, задания будут захвачены при следующих проходах диспетчера
+        Job.objects.filter(id=job.id, status=Job.RUNNING, worker=self.worker_name).update(
+            status=Job.PENDING, worker='', started_at=None, heartbeat_at=None)
+        return False
+
+    def execute(self, job_id: int):
+        close_old_connections()
+        try:
+            job = Job.objects.get(id=job_id)
+            handler = _handlers[job.kind]
+            context = JobContext(job)
+            status, result, error = Job.SUCCEEDED, None, ''
+            try:
+                context.check_cancelled()
+                result = handler(job, context)
+            except JobCancelled as e:
+                status, result = Job.CANCELLED, e.result
+            except Exception as e:
+                log.exception(f'Job {job} failed: {e}')
+                status, error = Job.FAILED, str(e) or type(e).__name__
+            Job.objects.filter(id=job.id).update(
+                status=status,
+                result_json=dump_json(result) if result is not None else '',
+                error=error,
+                progress=1 if status == Job.SUCCEEDED else job.progress,
+                params_json=dump_json(job.public_params),
+                finished_at=timezone.now(),
+            )
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            close_old_connections()
+            self._wakeup.set()
+
+
+job_runner = JobRunner(
+    workers=settings.V8_JOB_WORKERS,
+    host_concurrency=settings.V8_JOB_HOST_CONCURRENCY,
+    dbms_concurrency=settings.V8_JOB_DBMS_CONCURRENCY,
+    poll_interval=settings.V8_JOB_POLL_INTERVAL,
+    heartbeat_timeout=settings.V8_JOB_HEARTBEAT_TIMEOUT,
+)
+
+
+@job_handler('create_infobase')
+def create_infobase(job: 'Job', context: 'JobContext') -> dict:
+    """
+    Параметры - данные CreateInfobaseSerializer
+    """
+    serializer = CreateInfobaseSerializer(data=job.params)
+    serializer.is_valid(raise_exception=True)
+    host_target, cluster_target = get_cluster_target(job.host_id, job.cluster_name)
+    with cluster_admin_interface(host_target, cluster_target) as cluster_interface:
+        context.progress(0.1, f'Creating infobase {serializer.validated_data["name"]}')
+        infobase = serializer.save(cluster_interface=cluster_interface)
+        return DetailInfobaseSerializer(take_snapshot(infobase)).data
+
+
+@job_handler('drop_infobase')
+def drop_infobase(job: 'Job', context: 'JobContext') -> dict:
+    """
+    Параметры: name - имя информационной базы, mode - режим удаления (см. InfobaseViewSet.destroy_mode_map)
+    """
+    params = job.params
+    name = params['name']
+    host_target, cluster_target = get_cluster_target(job.host_id, job.cluster_name)
+    credentials = get_infobase_credentials(job.host_id, job.cluster_name, name)
+    with cluster_admin_interface(host_target, cluster_target) as cluster_interface:
+        cluster_interface.add_infobase_auths(credentials)
+        try:
+            infobase = cluster_interface.get_infobase(name)
+        except StopIteration:
+            raise ValueError(f'Infobase with name [{name}] does not exists')
+        context.check_cancelled()
+        context.progress(0.1, f'Dropping infobase {name}')
+        cluster_interface.drop_infobase(infobase, params['mode'])
+    return {'name': name, 'mode': params['mode']}
+
+
+@job_handler('terminate_sessions')
+def terminate_sessions(job: 'Job', context: 'JobContext') -> dict:
+    """
+    Параметры - данные SessionTerminationSerializer
+    """
+    host_target, cluster_target = get_cluster_target(job.host_id, job.cluster_name)
+
+    def progress(done, total):
+        context.progress(done / total if total else 1, f'{done} of {total} sessions processed')
+
+    with cluster_admin_interface(host_target, cluster_target) as cluster_interface:
+        return terminate_matching_sessions(cluster_interface, host_target, cluster_target,
+                                           progress=progress, **job.params)
+
+
+def run_maintenance(job: 'Job', context: 'JobContext', serializer_class, operation) -> dict:
+    serializer = serializer_class(data=job.params)
+    serializer.is_valid(raise_exception=True)
+    options = dict(serializer.validated_data)
+    names = options.pop('infobases')
+    host_target, cluster_target = get_cluster_target(job.host_id, job.cluster_name)
+    credentials = get_infobases_credentials(job.host_id, job.cluster_name, names)
+
+    def progress(done, total):
+        context.progress(done / total if total else 1, f'{done} of {total} infobases processed')
+
+    report = operation(host_target, cluster_target, credentials, progress=progress,
+                       is_cancelled=lambda: context.cancel_requested, **options)
+    if report['cancelled']:
+        raise JobCancelled(report)
+    return report
+
+
+@job_handler('lock_infobases')
+def lock_infobases(job: 'Job', context: 'JobContext') -> dict:
+    """
+    Параметры - данные InfobaseLockSerializer
+    """
+    return run_maintenance(job, context, InfobaseLockSerializer, maintenance.lock_infobases)
+
+
+@job_handler('unlock_infobases')
+def unlock_infobases(job: 'Job', context: 'JobContext') -> dict:
+    """
+    Параметры - данные InfobaseUnlockSerializer
+    """
+    return run_maintenance(job, context, InfobaseUnlockSerializer, maintenance.unlock_infobases)
@@ -0,0 +1,188 @@
+"""
+Массовая блокировка и разблокировка информационных баз кластера на время регламентных работ.
+
+Изменение информационной базы - отдельный вызов рабочего процесса, поэтому сотни баз блокируются
+заметное время. Базы делятся на части, которые обрабатываются параллельно в апартаментах пула
+массовых операций (V8_MAINTENANCE_WORKERS), каждая через собственное соединение с агентом и рабочим процессом.
+Апартаменты запросов и фоновых заданий при этом не занимаются. Список информационных баз
+загружается в апартаменте один раз, а не перед изменением каждой базы.
+
+Блокировка может сразу завершить сеансы заблокированной базы. Если задано начало блокировки
+(denied_from), кластер сам начнет отказывать в новых сеансах в указанное время.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from django.conf import settings
+from v8webconsole.clusterconfig.models import to_server_time
+from v8webconsole.core.cluster import ClusterControlInterface
+from v8webconsole.core.comcntr import Infobase
+from .fleet import (
+    ClusterTarget,
+    HostTarget,
+    cluster_admin_interface,
+)
+from .resources import maintenance_executor
+
+
+log = logging.getLogger(__name__)
+
+
+LOCK_MESSAGE = 'Выполняется обслуживание ИБ'
+
+
+class MaintenanceTracker:
+    """
+    Общий для всех апартаментов операции счетчик обработанных баз и признак отмены
+    """
+
+    def __init__(self):
+        self.done = 0
+        self._lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def processed(self):
+        with self._lock:
+            self.done += 1
+
+
+def infobase_report(name: str, status: str, detail: str = '', duration: float = 0, terminated: int = 0) -> dict:
+    return {'infobase': name, 'status': status, 'detail': detail, 'duration': round(duration, 3),
+            'terminated_sessions': terminated}
+
+
+def terminate_infobase_sessions(cluster_interface: 'ClusterControlInterface', infobase_short,
+                                message: str) -> Tuple[int, List[str]]:
+    """
+    Завершает сеансы информационной базы
+    :return: количество завершенных сеансов и ошибки завершения
+    """
+    terminated, errors = 0, []
+    for session in cluster_interface.get_infobase_sessions(infobase_short):
+        try:
+            cluster_interface.terminate_session(session, message)
+        except Exception as e:
+            errors.append(str(e))
+        else:
+            terminated += 1
+    return terminated, errors
+
+
+def change_infobases(host_target: 'HostTarget', cluster_target: 'ClusterTarget', names: List[str],
+                     credentials: Set[Tuple[str, str]], change: Callable[['ClusterControlInterface', 'Infobase'], None],
+                     terminate_message: Optional[str], tracker: 'MaintenanceTracker') -> List[dict]:
+    """
+    Применяет change к каждой из информационных баз names и, если задано terminate_message,
+    завершает их сеансы. Выполняется в рабочем потоке-апартаменте
+    """
+    results = []
+    with cluster_admin_interface(host_target, cluster_target) as cluster_interface:
+        cluster_interface.add_infobase_auths(credentials)
+        infobases: Dict[str, 'Infobase'] = {infobase.name.lower(): infobase
+                                            for infobase in cluster_interface.get_infobases()}
+        shorts = {}
+        if terminate_message is not None:
+            shorts = {short.name.lower(): short for short in cluster_interface.get_infobases_short()}
+        for name in names:
+            if tracker.cancelled.is_set():
+                results.append(infobase_report(name, 'cancelled'))
+                continue
+            started = time.monotonic()
+            infobase = infobases.get(name.lower())
+            if infobase is None:
+                results.append(infobase_report(name, 'not_found', 'Infobase does not exists'))
+                tracker.processed()
+                continue
+            try:
+                change(cluster_interface, infobase)
+            except Exception as e:
+                log.debug(f'[{host_target.address}] Unable to change infobase {name}: {e}')
+                results.append(infobase_report(name, 'error', str(e), time.monotonic() - started))
+                tracker.processed()
+                continue
+            terminated, errors = 0, []
+            if name.lower() in shorts:
+                terminated, errors = terminate_infobase_sessions(cluster_interface, shorts[name.lower()],
+                                                                 terminate_message)
+            results.append(infobase_report(name, 'done', '; '.join(errors), time.monotonic() - started, terminated))
+            tracker.processed()
+    return results
+
+
+def run_in_apartments(host_target: 'HostTarget', cluster_target: 'ClusterTarget',
+                      credentials: Dict[str, List[Tuple[str, str]]],
+                      change: Callable[['ClusterControlInterface', 'Infobase'], None],
+                      terminate_message: Optional[str] = None, concurrency: Optional[int] = None,
+                      progress: Optional[Callable[[int, int], None]] = None,
+                      is_cancelled: Optional[Callable[[], bool]] = None, poll_interval: float = 0.5) -> dict:
+    """
+    Делит информационные базы на части и обрабатывает их не более чем в concurrency апартаментах одновременно.
+    Пока части обрабатываются, вызывающий поток сообщает о ходе выполнения и проверяет, не запрошена ли отмена.
+    После отмены необработанные базы не изменяются
+    :param credentials: учетные данные администраторов по именам информационных баз
+    :return: сводка и результаты по каждой информационной базе
+    """
+    started = time.monotonic()
+    names = list(credentials)
+    limit = settings.V8_MAINTENANCE_CONCURRENCY
+    concurrency = max(1, min(concurrency or limit, limit, len(names)))
+    tracker = MaintenanceTracker()
+    futures = []
+    for i in range(concurrency):
+        shard = names[i::concurrency]
+        shard_credentials = {pair for name in shard for pair in credentials[name]}
+        futures.append(maintenance_executor.submit(None, change_infobases, host_target, cluster_target, shard,
+                                                   shard_credentials, change, terminate_message, tracker))
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=poll_interval)
+        if is_cancelled is not None and not tracker.cancelled.is_set() and is_cancelled():
+            tracker.cancelled.set()
+        if progress is not None:
+            progress(tracker.done, len(names))
+    results = []
+    for i, future in enumerate(futures):
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            results.extend(infobase_report(name, 'error', str(e)) for name in names[i::concurrency])
+    return {
+        'infobases': len(names),
+        'done': sum(1 for r in results if r['status'] == 'done'),
+        'failed': sum(1 for r in results if r['status'] in ('error', 'not_found')),
+        'cancelled': sum(1 for r in results if r['status'] == 'cancelled'),
+        'terminated_sessions': sum(r['terminated_sessions'] for r in results),
+        'concurrency': concurrency,
+        'elapsed': round(time.monotonic() - started, 3),
+        'results': results,
+    }
+
+
+def lock_infobases(host_target: 'HostTarget', cluster_target: 'ClusterTarget',
+                   credentials: Dict[str, List[Tuple[str, str]]], message: str = LOCK_MESSAGE,
+                   permission_code: str = '0000', denied_from: Optional[datetime] = None,
+                   denied_to: Optional[datetime] = None, terminate_sessions: bool = False, **kwargs) -> dict:
+    """
+    Блокирует фоновые задания и новые сеансы информационных баз, при необходимости завершая текущие сеансы
+    """
+    denied_from, denied_to = (to_server_time(value, host_target.time_zone) for value in (denied_from, denied_to))
+
+    def lock(cluster_interface: 'ClusterControlInterface', infobase: 'Infobase'):
+        cluster_interface.lock_infobase(infobase, permission_code, message, denied_from, denied_to)
+
+    return run_in_apartments(host_target, cluster_target, credentials, lock,
+                             terminate_message=message if terminate_sessions else None, **kwargs)
+
+
+def unlock_infobases(host_target: 'HostTarget', cluster_target: 'ClusterTarget',
+                     credentials: Dict[str, List[Tuple[str, str]]], **kwargs) -> dict:
+    """
+    Снимает блокировку фоновых заданий и сеансов информационных баз
+    """
+    def unlock(cluster_interface: 'ClusterControlInterface', infobase: 'Infobase'):
+        cluster_interface.unlock_infobase(infobase)
+
+    return run_in_apartments(host_target, cluster_target, credentials, unlock, **kwargs)
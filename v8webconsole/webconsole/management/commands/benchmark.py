@@ -0,0 +1,221 @@
+"""
+Замер времени ответа эндпоинтов API на имитации серверов 1С.
+
+Для каждого сочетания размера набора данных и задержки вызовов создается новая имитация серверов,
+в тестовой базе данных регистрируется сервер с кластером, и каждый эндпоинт вызывается заданное число раз
+через полный стек DRF. По каждому эндпоинту фиксируются перцентили времени ответа
+и количество обращений к объектам агента сервера на один запрос.
+Результат можно сохранить как эталон и сравнивать с ним последующие запуски.
+
+Эталон webconsole/benchmark_baseline.json снят с параметрами по умолчанию и используется при --baseline
+без пути. С ним сравнивается только количество обращений к агенту сервера, которое не зависит от оборудования.
+Время ответа сравнивается с эталоном, сохраненным с --save-baseline на той же машине.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+from v8webconsole.clusterconfig.models import (
+    Cluster,
+    ClusterCredentials,
+    Host,
+    HostCredentials,
+)
+from v8webconsole.core.comcntr import set_connector_factory
+from v8webconsole.core.simulator import Simulator, SimulatorConfig
+from v8webconsole.webconsole.resources import (
+    agent_connection_pool,
+    inventory_cache,
+    working_process_connection_pool,
+)
+
+
+CLUSTER_NAME = 'Локальный кластер'
+
+ENDPOINTS = (
+    ('hosts', '/api/v1/webconsole/hosts/'),
+    ('host', '/api/v1/webconsole/hosts/{host}/'),
+    ('admins', '/api/v1/webconsole/hosts/{host}/admins/'),
+    ('clusters', '/api/v1/webconsole/hosts/{host}/clusters/'),
+    ('cluster', '/api/v1/webconsole/hosts/{host}/clusters/{cluster}/'),
+    ('infobases', '/api/v1/webconsole/hosts/{host}/clusters/{cluster}/infobases/'),
+    ('infobase', '/api/v1/webconsole/hosts/{host}/clusters/{cluster}/infobases/ib0001/'),
+    ('top', '/api/v1/webconsole/hosts/{host}/clusters/{cluster}/sessions/top/?metric=cpu_time_last_5min'),
+)
+
+PERCENTILES = (50, 95, 99)
+
+# p99 нескольких десятков запросов - время самого медленного из них, оно слишком случайно для сравнения с эталоном
+COMPARED_PERCENTILES = (50, 95)
+
+# Закэшированные списки, устаревшие во время долгого сценария, добавляют несколько обращений к агенту
+COUNT_TOLERANCE = 0.05
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'benchmark_baseline.json')
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """
+    Перцентиль методом ближайшего ранга по отсортированной выборке
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for item in value.split(','):
+        infobases, _, sessions = item.partition(':')
+        sizes.append((int(infobases), int(sessions or 0)))
+    return sizes
+
+
+def scenario_name(infobases: int, sessions: int, latency: float) -> str:
+    return f'ib={infobases} sessions={sessions} latency={latency * 1000:g}ms'
+
+
+class Command(BaseCommand):
+    help = 'Measures API endpoint latency against simulated 1C servers and compares it with a stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10:100,100:1000,1000:10000',
+                            help='Comma separated dataset sizes as infobases:sessions per cluster.')
+        parser.add_argument('--latency', default='0,0.001',
+                            help='Comma separated simulated latency of every COM call, in seconds.')
+        parser.add_argument('--property-latency', type=float, default=0,
+                            help='Simulated latency of every COM property access, in seconds.')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per endpoint.')
+        parser.add_argument('--endpoints', default='', help='Comma separated endpoint names, all by default.')
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--save-baseline', help='Write results as the new baseline to this file.')
+        parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                            help='Fail if results regress past this baseline file. Without a path only COM calls '
+                                 'are compared with the reference baseline recorded with the default options.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative latency growth over the baseline.')
+        parser.add_argument('--min-slack', type=float, default=0.002,
+                            help='Allowed absolute latency growth over the baseline, in seconds.')
+
+    def handle(self, *args, **options):
+        endpoints = ENDPOINTS
+        if options['endpoints']:
+            names = set(options['endpoints'].split(','))
+            endpoints = tuple(e for e in ENDPOINTS if e[0] in names)
+        scenarios = [(infobases, sessions, float(latency))
+                     for infobases, sessions in parse_sizes(options['sizes'])
+                     for latency in options['latency'].split(',')]
+        old_name = connection.settings_dict['NAME']
+        # Пользователь, сервер и кластер замера не должны попасть в рабочую базу, а сама команда не должна
+        # зависеть от ее содержимого. Поэтому замер выполняется на отдельной тестовой базе, как в manage.py test,
+        # которая удаляется вместе с этими данными по завершении
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            client, host = self.prepare_database()
+            results = {}
+            for infobases, sessions, latency in scenarios:
+                name = scenario_name(infobases, sessions, latency)
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                config = SimulatorConfig(infobases=infobases, sessions=sessions, call_latency=latency,
+                                         property_latency=options['property_latency'])
+                results[name] = self.run_scenario(client, host, config, endpoints,
+                                                  options['requests'], options['warmup'])
+        finally:
+            self.reset_backend()
+            set_connector_factory(None)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        for path in (options['output'], options['save_baseline']):
+            if path:
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'], options['min_slack'],
+                         compare_latency=options['baseline'] != DEFAULT_BASELINE)
+
+    def prepare_database(self) -> Tuple['APIClient', 'Host']:
+        user = get_user_model().objects.create_user('benchmark', password='benchmark')
+        host = Host.objects.create(address='benchmark-host', port=1540)
+        HostCredentials.objects.create(host=host, login='admin', pwd='')
+        cluster = Cluster.objects.create(host=host, name=CLUSTER_NAME)
+        ClusterCredentials.objects.create(cluster=cluster, login='admin', pwd='')
+        client = APIClient()
+        client.force_authenticate(user)
+        return client, host
+
+    def reset_backend(self):
+        """
+        Соединения и закэшированные объекты предыдущей имитации не должны использоваться в следующей
+        """
+        agent_connection_pool.clear()
+        working_process_connection_pool.clear()
+        inventory_cache.clear()
+
+    def run_scenario(self, client: 'APIClient', host: 'Host', config: 'SimulatorConfig',
+                     endpoints, requests: int, warmup: int) -> Dict[str, dict]:
+        self.reset_backend()
+        simulator = Simulator(config).install()
+        results = {}
+        for name, url in endpoints:
+            url = url.format(host=host.id, cluster=CLUSTER_NAME)
+            for _ in range(warmup):
+                self.request(client, url)
+            simulator.stats.reset()
+            timings = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                self.request(client, url)
+                timings.append(time.perf_counter() - started)
+            stats = simulator.stats.as_dict()
+            timings.sort()
+            result = {f'p{p}': round(percentile(timings, p), 6) for p in PERCENTILES}
+            result['com_calls'] = round(stats['calls'] / requests, 2)
+            result['com_property_accesses'] = round(stats['property_accesses'] / requests, 2)
+            results[name] = result
+            self.stdout.write(
+                f'  {name:<10} ' + ' '.join(f'p{p}={result[f"p{p}"] * 1000:8.2f}ms' for p in PERCENTILES)
+                + f'  com calls/req={result["com_calls"]:g} properties/req={result["com_property_accesses"]:g}'
+            )
+        return results
+
+    def request(self, client: 'APIClient', url: str):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}: {response.content[:500]!r}')
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+
+    def compare(self, results: Dict[str, dict], baseline_path: str, tolerance: float, min_slack: float,
+                compare_latency: bool = True):
+        """
+        Время ответа не должно вырасти больше допустимого, количество обращений к агенту сервера - не должно расти
+        """
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = []
+        for scenario, endpoints in results.items():
+            for endpoint, current in endpoints.items():
+                expected = baseline.get(scenario, {}).get(endpoint)
+                if expected is None:
+                    continue
+                for p in COMPARED_PERCENTILES if compare_latency else ():
+                    key = f'p{p}'
+                    limit = expected[key] * (1 + tolerance) + min_slack
+                    if current[key] > limit:
+                        regressions.append(f'{scenario} {endpoint} {key}: '
+                                           f'{current[key] * 1000:.2f}ms > {limit * 1000:.2f}ms')
+                for key in ('com_calls', 'com_property_accesses'):
+                    if current[key] > expected[key] * (1 + COUNT_TOLERANCE):
+                        regressions.append(f'{scenario} {endpoint} {key}: {current[key]:g} > {expected[key]:g}')
+        if regressions:
+            raise CommandError('Benchmark regressed past the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
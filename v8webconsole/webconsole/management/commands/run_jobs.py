@@ -0,0 +1,22 @@
+"""
+Выполнение фоновых заданий отдельным процессом, без веб-сервера.
+"""
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from v8webconsole.webconsole.jobs import job_runner
+
+
+class Command(BaseCommand):
+    help = 'Runs the background job dispatcher until interrupted'
+
+    def handle(self, *args, **options):
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopped.set())
+        job_runner.ensure_started()
+        self.stdout.write(f'Job dispatcher {job_runner.worker_name} started')
+        stopped.wait()
+        # Выполняющиеся задания не прерываются: после остановки процесса они будут завершены с ошибкой
+        # по истечении V8_JOB_HEARTBEAT_TIMEOUT
+        job_runner.stop()
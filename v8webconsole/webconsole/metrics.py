@@ -0,0 +1,246 @@
+"""
+Показатели рабочих процессов и лицензий всех зарегистрированных кластеров в текстовом формате Prometheus.
+
+Сбор выполняется не чаще одного раза за cache_ttl секунд: пока результат не устарел, все запросы получают его
+без обращений к серверам. Если результат устарел, сбор выполняет только один запрос, остальные ожидают
+его завершения и получают тот же результат, поэтому несколько одновременных сборщиков Prometheus
+не увеличивают нагрузку на агенты серверов. Серверы опрашиваются параллельно, каждый в своем COM-апартаменте.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import wait
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from v8webconsole.core.snapshots import WorkingProcessSnapshot
+from .fleet import (
+    HostTarget,
+    agent_interface,
+    get_host_targets,
+)
+from .resources import (
+    com_executor,
+    host_apartment_key,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Свойства рабочих процессов, которые читаются при сборе
+WORKING_PROCESS_FIELDS = (
+    'available_performance',
+    'avg_call_time',
+    'avg_db_call_time',
+    'avg_lock_call_time',
+    'connections',
+    'hostname',
+    'license',
+    'main_port',
+    'memory_size',
+    'pid',
+)
+
+# Имя показателя, описание, функция получения значения из снимка рабочего процесса
+WORKING_PROCESS_METRICS = (
+    ('v8_working_process_avg_call_time_seconds',
+     'Average time of serving one client call.',
+     lambda wp: wp.avg_call_time),
+    ('v8_working_process_avg_db_call_time_seconds',
+     'Average time spent in database calls per client call.',
+     lambda wp: wp.avg_db_call_time),
+    ('v8_working_process_avg_lock_call_time_seconds',
+     'Average time spent in lock manager calls per client call.',
+     lambda wp: wp.avg_lock_call_time),
+    # MemorySize передается в килобайтах
+    ('v8_working_process_memory_bytes',
+     'Memory used by the working process.',
+     lambda wp: wp.memory_size * 1024),
+    ('v8_working_process_available_performance',
+     'Average available performance over the last 5 minutes.',
+     lambda wp: wp.available_performance),
+    ('v8_working_process_connections',
+     'Number of connections to the working process.',
+     lambda wp: wp.connections),
+)
+
+LICENSE_METRICS = (
+    ('v8_working_process_license_max_users_all',
+     'Maximum number of users of the license obtained by the working process.',
+     lambda lic: lic.max_users_all),
+    ('v8_working_process_license_max_users_cur',
+     'Maximum number of users of the current license obtained by the working process.',
+     lambda lic: lic.max_users_cur),
+)
+
+
+class ClusterMetrics(NamedTuple):
+    cluster: str
+    working_processes: List['WorkingProcessSnapshot']
+
+
+class HostMetrics(NamedTuple):
+    target: 'HostTarget'
+    clusters: List['ClusterMetrics']
+    failed_clusters: List[str]
+    duration: float
+
+
+def collect_host_metrics(target: 'HostTarget') -> 'HostMetrics':
+    """
+    Получает рабочие процессы всех зарегистрированных кластеров сервера. Выполняется в COM-апартаменте сервера
+    """
+    started = time.perf_counter()
+    clusters, failed = [], []
+    with agent_interface(target) as ragent_interface:
+        for cluster in target.clusters:
+            try:
+                cluster_interface = ragent_interface.get_cluster_interface(cluster.name)
+                cluster_interface.authenticate_cluster_admin(cluster.login, cluster.pwd)
+                working_processes = [WorkingProcessSnapshot.from_com(wp, WORKING_PROCESS_FIELDS)
+                                     for wp in cluster_interface.get_working_processes()]
+            except Exception as e:
+                log.warning(f'[{target.address}] Unable to collect metrics of cluster {cluster.name}: {e}')
+                failed.append(cluster.name)
+                continue
+            clusters.append(ClusterMetrics(cluster.name, working_processes))
+    return HostMetrics(target, clusters, failed, time.perf_counter() - started)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels: Dict[str, object]) -> str:
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value))
+
+
+class MetricsRenderer:
+    """
+    Накапливает значения по показателям и выводит их в текстовом формате Prometheus,
+    в котором все значения одного показателя должны следовать подряд
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, List[str]]] = {}
+
+    def add(self, name: str, help_text: str, labels: Dict[str, object], value):
+        if value is None:
+            return
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (help_text, [])
+        family[1].append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+    def render(self) -> str:
+        lines = []
+        for name, (help_text, samples) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def render_metrics(results: List['HostMetrics'], failed_targets: List['HostTarget']) -> str:
+    renderer = MetricsRenderer()
+    for target in failed_targets:
+        renderer.add('v8_up', 'Whether the server agent was scraped successfully.',
+                     {'host': f'{target.address}:{target.port}'}, 0)
+    for result in results:
+        host = f'{result.target.address}:{result.target.port}'
+        renderer.add('v8_up', 'Whether the server agent was scraped successfully.', {'host': host}, 1)
+        renderer.add('v8_scrape_duration_seconds', 'Duration of the server agent scrape.',
+                     {'host': host}, result.duration)
+        for cluster in result.failed_clusters:
+            renderer.add('v8_cluster_up', 'Whether the cluster was scraped successfully.',
+                         {'host': host, 'cluster': cluster}, 0)
+        for cluster in result.clusters:
+            renderer.add('v8_cluster_up', 'Whether the cluster was scraped successfully.',
+                         {'host': host, 'cluster': cluster.cluster}, 1)
+            for wp in cluster.working_processes:
+                labels = {'host': host, 'cluster': cluster.cluster, 'hostname': wp.hostname,
+                          'port': wp.main_port, 'pid': wp.pid}
+                for name, help_text, getter in WORKING_PROCESS_METRICS:
+                    renderer.add(name, help_text, labels, getter(wp))
+                lic = wp.license
+                renderer.add('v8_working_process_license_info',
+                             'License obtained by the working process, 1 if any.',
+                             {**labels,
+                              'series': lic.series if lic else '',
+                              'license_type': lic.license_type if lic else '',
+                              'issued_by_server': format_value(lic.issued_by_server) if lic else '',
+                              'presentation': lic.short_presentation if lic else ''},
+                             lic is not None)
+                if lic is not None:
+                    for name, help_text, getter in LICENSE_METRICS:
+                        renderer.add(name, help_text, labels, getter(lic))
+    return renderer.render()
+
+
+class MetricsCollector:
+    """
+    Собирает показатели всех зарегистрированных серверов и хранит результат cache_ttl секунд
+    """
+
+    def __init__(self, cache_ttl: float = 10, host_timeout: float = 10):
+        self.cache_ttl = cache_ttl
+        self.host_timeout = host_timeout
+        self._lock = threading.Lock()
+        self._text: Optional[str] = None
+        self._collected_at = 0.0
+
+    def _fresh(self) -> Optional[str]:
+        if self._text is not None and time.monotonic() - self._collected_at < self.cache_ttl:
+            return self._text
+        return None
+
+    def get(self) -> str:
+        text = self._fresh()
+        if text is not None:
+            return text
+        with self._lock:
+            # Пока ожидали блокировку, сбор мог выполнить другой запрос
+            text = self._fresh()
+            if text is None:
+                text = self._text = self.collect()
+                self._collected_at = time.monotonic()
+            return text
+
+    def invalidate(self):
+        with self._lock:
+            self._text = None
+
+    def collect(self) -> str:
+        targets = get_host_targets()
+        futures = {com_executor.submit(host_apartment_key(target.id), collect_host_metrics, target): target
+                   for target in targets}
+        done, not_done = wait(futures, timeout=self.host_timeout)
+        results, failed = [], []
+        for future in not_done:
+            future.cancel()
+            log.warning(f'[{futures[future].address}] No metrics within {self.host_timeout} seconds')
+            failed.append(futures[future])
+        for future in done:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                log.warning(f'[{futures[future].address}] Unable to collect metrics: {e}')
+                failed.append(futures[future])
+        order = {target.id: index for index, target in enumerate(targets)}
+        results.sort(key=lambda result: order[result.target.id])
+        failed.sort(key=lambda target: order[target.id])
+        return render_metrics(results, failed)
+
+
+metrics_collector = MetricsCollector(
+    cache_ttl=settings.V8_METRICS_CACHE_TTL,
+    host_timeout=settings.V8_FLEET_HOST_TIMEOUT,
+)
@@ -0,0 +1,90 @@
+"""
+Учет времени обработки запроса: обращения к COM-объектам, запросы к базе данных и общее время.
+
+Итоги передаются клиенту в заголовке Server-Timing и записываются в журнал одной строкой в формате JSON.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from django.db import connection
+from v8webconsole.core.instrumentation import collect_com_stats
+
+
+log = logging.getLogger(__name__)
+
+
+class DatabaseStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.duration = 0.0
+
+    def add(self, duration: float):
+        with self._lock:
+            self.queries += 1
+            self.duration += duration
+
+
+current_db_stats: 'contextvars.ContextVar[Optional[DatabaseStats]]' = contextvars.ContextVar(
+    'db_stats', default=None)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = current_db_stats.get()
+        if stats is not None:
+            stats.add(time.perf_counter() - started)
+
+
+@contextmanager
+def database_timing():
+    """
+    Учитывает запросы к базе данных, выполняемые в текущем потоке.
+    Соединения с базой данных у каждого потока свои, поэтому учет включается и в потоках-апартаментах.
+    Повторное включение в том же потоке учитывало бы каждый запрос дважды
+    """
+    with connection.execute_wrapper(_execute_wrapper):
+        yield
+
+
+class ServerTimingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db_stats = DatabaseStats()
+        token = current_db_stats.set(db_stats)
+        started = time.perf_counter()
+        try:
+            with collect_com_stats() as com_stats, database_timing():
+                response = self.get_response(request)
+        finally:
+            current_db_stats.reset(token)
+        total = time.perf_counter() - started
+        response['Server-Timing'] = ', '.join((
+            f'com;dur={com_stats.duration * 1000:.1f};desc="{com_stats.calls} calls, '
+            f'{com_stats.property_accesses} properties"',
+            f'db;dur={db_stats.duration * 1000:.1f};desc="{db_stats.queries} queries"',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        log.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'com_ms': round(com_stats.duration * 1000, 1),
+            'com_calls': com_stats.calls,
+            'com_property_accesses': com_stats.property_accesses,
+            'db_ms': round(db_stats.duration * 1000, 1),
+            'db_queries': db_stats.queries,
+        }, ensure_ascii=False))
+        return response
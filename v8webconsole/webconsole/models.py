@@ -1,3 +1,72 @@
+import json
+from django.conf import settings
 from django.db import models
+from v8webconsole.clusterconfig.models import Host
 
-# Create your models here.
+
+class Job(models.Model):
+    """
+    Длительная операция над кластером, выполняемая в фоне (см. jobs.py).
+    Параметры и результат хранятся в виде JSON
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+
+    FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+    # Параметры, которые не выдаются через API и удаляются из задания после его завершения
+    SECRET_PARAMS = ('db_password', )
+
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    host = models.ForeignKey(to=Host, on_delete=models.CASCADE, related_name='jobs')
+    cluster_name = models.CharField(max_length=100)
+    # Сервер СУБД, на который операция дает нагрузку. Пустая строка - не нагружает СУБД
+    dbms_server = models.CharField(max_length=100, blank=True)
+    params_json = models.TextField(default='{}')
+    result_json = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    progress = models.FloatField(default=0)
+    progress_message = models.CharField(max_length=200, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    # Процесс, выполняющий задание, и время его последнего подтверждения, что выполнение продолжается
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                   null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-id', )
+
+    @property
+    def params(self) -> dict:
+        return json.loads(self.params_json or '{}')
+
+    @property
+    def public_params(self) -> dict:
+        return {name: value for name, value in self.params.items() if name not in self.SECRET_PARAMS}
+
+    @property
+    def result(self):
+        return json.loads(self.result_json) if self.result_json else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in self.FINISHED_STATUSES
+
+    def __str__(self):
+        return f'{self.kind} #{self.id} ({self.status})'
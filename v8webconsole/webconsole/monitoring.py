@@ -0,0 +1,209 @@
+"""
+Фоновый сбор показателей сеансов и рабочих процессов кластеров.
+
+Вместо того чтобы каждое обновление панели мониторинга обращалось к агенту сервера,
+фоновый поток с заданным интервалом опрашивает все зарегистрированные кластеры и хранит
+последние N снимков каждого кластера в кольцевом буфере. Эндпоинты чтения отдают последний снимок
+вместе с его возрастом. Снимки кластеров, удаленных из настроек, отбрасываются при следующем опросе.
+
+Каждый процесс опрашивает кластеры сам и хранит свои снимки. Опрос запускается при загрузке приложения,
+если включен V8_MONITORING_AUTOSTART (wsgi.py включает его для процессов веб-сервера),
+иначе - при первом обращении процесса к данным.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import wait
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from v8webconsole.core.snapshots import (
+    SessionSnapshot,
+    WorkingProcessSnapshot,
+)
+from .fleet import (
+    HostTarget,
+    agent_interface,
+    get_host_targets,
+)
+from .resources import (
+    com_executor,
+    host_apartment_key,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class ClusterSample:
+    """
+    Снимок сеансов и рабочих процессов одного кластера на момент taken_at
+    """
+    __slots__ = ('host_id', 'cluster', 'taken_at', 'monotonic', 'sessions', 'working_processes')
+
+    def __init__(self, host_id: int, cluster: str,
+                 sessions: List['SessionSnapshot'], working_processes: List['WorkingProcessSnapshot']):
+        self.host_id = host_id
+        self.cluster = cluster
+        self.taken_at = timezone.now()
+        self.monotonic = time.monotonic()
+        self.sessions = sessions
+        self.working_processes = working_processes
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return cluster_key(self.host_id, self.cluster)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.monotonic
+
+
+def cluster_key(host_id, cluster_name: str) -> Tuple[str, str]:
+    # Идентификатор сервера из URL может быть любой строкой, снимки хранятся с числовым
+    return str(host_id), cluster_name.lower()
+
+
+def sample_host(target: 'HostTarget') -> List['ClusterSample']:
+    """
+    Снимает показатели всех зарегистрированных кластеров сервера. Выполняется в COM-апартаменте сервера
+    """
+    samples = []
+    with agent_interface(target) as ragent_interface:
+        for cluster in target.clusters:
+            try:
+                cluster_interface = ragent_interface.get_cluster_interface(cluster.name)
+                cluster_interface.authenticate_cluster_admin(cluster.login, cluster.pwd)
+                sessions = [SessionSnapshot.from_com(s) for s in cluster_interface.get_sessions()]
+                working_processes = [WorkingProcessSnapshot.from_com(wp)
+                                     for wp in cluster_interface.get_working_processes()]
+            except Exception as e:
+                log.warning(f'[{target.address}] Unable to sample cluster {cluster.name}: {e}')
+                continue
+            samples.append(ClusterSample(target.id, cluster.name, sessions, working_processes))
+    return samples
+
+
+class ClusterPoller:
+    """
+    Фоновый опрос кластеров. Каждому серверу на опрос отводится не более одного интервала,
+    не ответивший сервер пропускается до следующего опроса, а его последний снимок продолжает стареть
+    """
+
+    def __init__(self, interval: float = 15, history: int = 20):
+        self.interval = interval
+        self.history = history
+        self._buffers: Dict[Hashable, deque] = {}
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[List['ClusterSample']], None]] = []
+
+    def add_listener(self, listener: Callable[[List['ClusterSample']], None]):
+        """
+        Регистрирует функцию, которая вызывается в потоке опроса с новыми снимками каждого сервера
+        """
+        self._listeners.append(listener)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='cluster-poller', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                log.exception(f'Cluster polling failed: {e}')
+            self._stopped.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def poll(self):
+        """
+        Однократно опрашивает все зарегистрированные кластеры
+        """
+        close_old_connections()
+        try:
+            targets = get_host_targets()
+        finally:
+            close_old_connections()
+        self.retain({cluster_key(target.id, cluster.name) for target in targets for cluster in target.clusters})
+        futures = {com_executor.submit(host_apartment_key(target.id), sample_host, target): target
+                   for target in targets}
+        done, not_done = wait(futures, timeout=self.interval)
+        for future in not_done:
+            future.cancel()
+            log.warning(f'[{futures[future].address}] No samples within {self.interval} seconds')
+        for future in done:
+            try:
+                samples = future.result()
+            except Exception as e:
+                log.warning(f'[{futures[future].address}] Unable to sample host: {e}')
+                continue
+            self.store(samples)
+
+    def retain(self, keys: Set[Hashable]):
+        """
+        Отбрасывает снимки кластеров, которых нет среди keys
+        """
+        with self._lock:
+            for key in set(self._buffers) - keys:
+                del self._buffers[key]
+
+    def store(self, samples: List['ClusterSample']):
+        with self._updated:
+            for sample in samples:
+                buffer = self._buffers.get(sample.key)
+                if buffer is None:
+                    buffer = self._buffers[sample.key] = deque(maxlen=self.history)
+                buffer.append(sample)
+            self._updated.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(samples)
+            except Exception as e:
+                log.exception(f'Cluster sample listener failed: {e}')
+
+    def latest(self, host_id, cluster_name: str) -> Optional['ClusterSample']:
+        with self._lock:
+            buffer = self._buffers.get(cluster_key(host_id, cluster_name))
+            return buffer[-1] if buffer else None
+
+    def history_of(self, host_id, cluster_name: str) -> List['ClusterSample']:
+        """
+        Сохраненные снимки кластера от старых к новым
+        """
+        with self._lock:
+            return list(self._buffers.get(cluster_key(host_id, cluster_name), ()))
+
+    def wait_latest(self, host_id, cluster_name: str, timeout: float) -> Optional['ClusterSample']:
+        """
+        Последний снимок кластера. Если снимков еще нет, запускает опрос и ожидает первый снимок не дольше timeout
+        """
+        self.ensure_started()
+        key = cluster_key(host_id, cluster_name)
+        with self._updated:
+            self._updated.wait_for(lambda: self._buffers.get(key), timeout)
+            buffer = self._buffers.get(key)
+            return buffer[-1] if buffer else None
+
+
+cluster_poller = ClusterPoller(
+    interval=settings.V8_MONITORING_INTERVAL,
+    history=settings.V8_MONITORING_HISTORY,
+)
@@ -0,0 +1,106 @@
+"""
+Курсорная пагинация списков снимков COM-объектов.
+
+Список объектов каждый раз заново получается у агента сервера, поэтому между запросами страниц объекты
+могут появляться и исчезать. Курсор хранит ключ последнего (для предыдущей страницы - первого) объекта страницы,
+и следующая страница начинается сразу за этим объектом в новом списке, а не с номера позиции.
+Если объект с ключом курсора исчез, используется сохраненная в курсоре позиция.
+
+Пагинация включается параметром ?page_size= или ?cursor=. Без них список возвращается целиком, как прежде.
+"""
+import base64
+import json
+from collections import OrderedDict
+from typing import Any, List, Optional
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SnapshotCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def is_requested(self, request) -> bool:
+        return self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params
+
+    def get_page_size(self, request) -> int:
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return settings.V8_PAGE_SIZE
+        try:
+            page_size = int(value)
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'A positive integer is required'})
+        return min(page_size, settings.V8_PAGE_MAX_SIZE)
+
+    def decode_cursor(self, request) -> Optional[dict]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return {'previous': bool(cursor['p']), 'key': cursor['k'], 'offset': int(cursor['o'])}
+        except (ValueError, TypeError, KeyError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+    def encode_cursor(self, previous: bool, key: Optional[List[Any]], offset: int) -> str:
+        data = json.dumps({'p': int(previous), 'k': key, 'o': offset}, ensure_ascii=False, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode('ascii')
+
+    def get_key(self, snapshot) -> Optional[List[Any]]:
+        if not self.key_fields:
+            return None
+        return [getattr(snapshot, name, None) for name in self.key_fields]
+
+    def validate_query(self, request, view):
+        if self.is_requested(request):
+            self.get_page_size(request)
+            self.decode_cursor(request)
+
+    def get_required_fields(self, request, view) -> List[str]:
+        return list(view.snapshot_key_fields) if self.is_requested(request) else []
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        self.key_fields = tuple(getattr(view, 'snapshot_key_fields', ()))
+        page_size = self.get_page_size(request)
+        items = list(queryset)
+        cursor = self.decode_cursor(request)
+        start = 0
+        if cursor is not None:
+            position = None
+            if cursor['key'] is not None:
+                position = next((i for i, item in enumerate(items) if self.get_key(item) == cursor['key']), None)
+            if cursor['previous']:
+                end = position if position is not None else min(cursor['offset'], len(items))
+                start = max(end - page_size, 0)
+            else:
+                start = position + 1 if position is not None else min(cursor['offset'], len(items))
+        page = items[start:start + page_size]
+        self.count = len(items)
+        self.next_cursor = self.previous_cursor = None
+        if page and start + len(page) < len(items):
+            self.next_cursor = self.encode_cursor(False, self.get_key(page[-1]), start + len(page))
+        if page and start > 0:
+            self.previous_cursor = self.encode_cursor(True, self.get_key(page[0]), start)
+        return page
+
+    def get_link(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_link(self.next_cursor)),
+            ('previous', self.get_link(self.previous_cursor)),
+            ('results', data),
+        ]))
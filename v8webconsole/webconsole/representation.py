@@ -0,0 +1,98 @@
+"""
+Быстрое получение данных снимков для ответов на чтение.
+
+Serializer.to_representation для каждого атрибута каждого объекта перебирает поля, вызывает
+Field.get_attribute с разбором пути source и Field.to_representation через несколько уровней вызовов.
+На списках из тысяч сеансов по три десятка полей эти накладные расходы сравнимы со всей остальной обработкой.
+
+compile_representation один раз на запрос составляет для сериализатора список пар "получение атрибута -
+преобразование значения": атрибут с простым source читается напрямую, значения полей CharField, IntegerField,
+FloatField, BooleanField и ChoiceField преобразуются так же, как это делают сами поля, но без лишних вызовов.
+Остальные поля и особые случаи (отсутствующий атрибут, словарь вместо объекта) обрабатываются
+средствами DRF, поэтому результат совпадает с результатом сериализатора.
+"""
+from operator import attrgetter
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+from rest_framework import fields
+from rest_framework.fields import SkipField
+from rest_framework.relations import RelatedField
+from rest_framework.serializers import Serializer
+
+
+Representation = Callable[[Any], Dict[str, Any]]
+
+
+def boolean_converter(field: 'fields.BooleanField') -> Callable[[Any], Any]:
+    to_representation = field.to_representation
+
+    def convert(value):
+        if value is True or value is False:
+            return value
+        return to_representation(value)
+    return convert
+
+
+def choice_converter(field: 'fields.ChoiceField') -> Callable[[Any], Any]:
+    choices = field.choice_strings_to_values
+
+    def convert(value):
+        if value == '':
+            return value
+        return choices.get(str(value), value)
+    return convert
+
+
+def value_converter(field: 'fields.Field') -> Callable[[Any], Any]:
+    """
+    Преобразование непустого значения атрибута в данные поля, равносильное field.to_representation
+    """
+    field_class = type(field)
+    if field_class is fields.CharField:
+        return str
+    if field_class is fields.IntegerField:
+        return int
+    if field_class is fields.FloatField:
+        return float
+    if field_class is fields.BooleanField:
+        return boolean_converter(field)
+    if field_class is fields.ChoiceField:
+        return choice_converter(field)
+    return field.to_representation
+
+
+def compile_representation(serializer: 'Serializer') -> Representation:
+    """
+    Функция получения данных объекта, совпадающих с serializer.to_representation.
+    Сериализатор должен быть уже настроен: поля, удаленные из него после создания, не выдаются
+    """
+    if type(serializer).to_representation is not Serializer.to_representation \
+            or any(isinstance(field, RelatedField) for field in serializer._readable_fields):
+        return serializer.to_representation
+    compiled: List[Tuple[str, 'fields.Field', Callable[[Any], Any], Callable[[Any], Any]]] = []
+    for field in serializer._readable_fields:
+        if len(field.source_attrs) == 1 and field.source != '*':
+            getter = attrgetter(field.source)
+        else:
+            getter = field.get_attribute
+        compiled.append((field.field_name, field, getter, value_converter(field)))
+
+    def represent(instance) -> Dict[str, Any]:
+        if isinstance(instance, Mapping):
+            return serializer.to_representation(instance)
+        result = {}
+        for name, field, getter, convert in compiled:
+            try:
+                value = getter(instance)
+                if callable(value):
+                    value = field.get_attribute(instance)
+            except AttributeError:
+                # Отсутствующий атрибут: значение по умолчанию, None, пропуск поля или ошибка - как в DRF
+                try:
+                    value = field.get_attribute(instance)
+                except SkipField:
+                    continue
+            except SkipField:
+                continue
+            result[name] = None if value is None else convert(value)
+        return result
+    return represent
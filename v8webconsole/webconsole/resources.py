@@ -0,0 +1,62 @@
+"""
+Общие для всего процесса ресурсы взаимодействия с серверами 1С, настраиваемые через settings.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from v8webconsole.core.apartment import COMApartmentExecutor
+from v8webconsole.core.instrumentation import configure_instrumentation
+from v8webconsole.core.inventory import InventoryCache
+from v8webconsole.core.pool import (
+    ServerAgentConnectionPool,
+    WorkingProcessConnectionPool,
+)
+from v8webconsole.core.simulator import (
+    SimulatorConfig,
+    install_simulator,
+)
+
+
+configure_instrumentation(settings.V8_COM_INSTRUMENTATION, settings.V8_COM_SLOW_CALL_THRESHOLD)
+
+if settings.V8_BACKEND == 'simulator':
+    simulator = install_simulator(SimulatorConfig(
+        clusters=settings.V8_SIMULATOR_CLUSTERS,
+        infobases=settings.V8_SIMULATOR_INFOBASES,
+        sessions=settings.V8_SIMULATOR_SESSIONS,
+        working_processes=settings.V8_SIMULATOR_WORKING_PROCESSES,
+        call_latency=settings.V8_SIMULATOR_CALL_LATENCY,
+        property_latency=settings.V8_SIMULATOR_PROPERTY_LATENCY,
+        seed=settings.V8_SIMULATOR_SEED,
+    ))
+elif settings.V8_BACKEND == 'com':
+    simulator = None
+else:
+    raise ImproperlyConfigured(f'Unknown V8_BACKEND "{settings.V8_BACKEND}", expected "com" or "simulator"')
+
+
+agent_connection_pool = ServerAgentConnectionPool(
+    max_size=settings.V8_AGENT_POOL_MAX_SIZE,
+    idle_timeout=settings.V8_AGENT_POOL_IDLE_TIMEOUT,
+    health_check_interval=settings.V8_AGENT_POOL_HEALTH_CHECK_INTERVAL,
+)
+
+working_process_connection_pool = WorkingProcessConnectionPool(
+    max_size=settings.V8_WORKING_PROCESS_POOL_MAX_SIZE,
+    idle_timeout=settings.V8_WORKING_PROCESS_POOL_IDLE_TIMEOUT,
+)
+
+com_executor = COMApartmentExecutor(workers=settings.V8_COM_WORKERS, key_workers=settings.V8_COM_WORKERS_PER_HOST)
+
+# Части массовых операций сами не ожидают других заданий, поэтому их пул не может заблокироваться,
+# даже если операцию выполняет поток-апартамент запроса или фонового задания
+maintenance_executor = COMApartmentExecutor(workers=settings.V8_MAINTENANCE_WORKERS, name='maintenance')
+
+inventory_cache = InventoryCache(ttl=settings.V8_INVENTORY_TTL)
+
+
+def host_apartment_key(host_id) -> tuple:
+    """
+    Ключ привязки заданий к COM-апартаментам: обращения к одному серверу выполняются
+    набором из V8_COM_WORKERS_PER_HOST рабочих потоков
+    """
+    return 'host', str(host_id)
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 
 
@@ -66,7 +68,7 @@ class DetailClusterSerializer(ShortClusterSerializer):
         for key, value in validated_data.items():
             setattr(cluster, key, value)
         ragent_interface.reg_cluster(cluster)
-        return ragent_interface.get_cluster(cluster.name)
+        return ragent_interface.get_cluster(cluster.cluster_name)
 
     def update(self, instance, validated_data):
         ragent_interface = validated_data.pop('ragent_interface')
@@ -110,7 +112,7 @@ class DetailClusterSerializer(ShortClusterSerializer):
                 cluster_interface.set_security_level(
                     security_level
                 )
-        return ragent_interface.get_cluster(cluster.name)
+        return ragent_interface.get_cluster(cluster.cluster_name)
 
 
 class ShortInfobaseSerializer(serializers.Serializer):
@@ -186,7 +188,7 @@ class UpdateInfobaseSerializer(serializers.Serializer):
         infobase = self.instance
         for key, value in self.validated_data.items():
             setattr(infobase, key, value)
-        cluster_interface.working_process_connection.update_infobase(infobase)
+        cluster_interface.update_infobase(infobase)
         infobase = cluster_interface.get_infobase(infobase.name)
         return infobase
 
@@ -218,7 +220,7 @@ class CreateInfobaseSerializer(ShortInfobaseSerializer):
         infobase = cluster_interface.working_process_connection.create_infobase_info()
         for key, value in self.validated_data.items():
             setattr(infobase, key, value)
-        cluster_interface.working_process_connection.create_infobase(infobase, create_db)
+        cluster_interface.create_infobase(infobase, create_db)
         infobase = cluster_interface.get_infobase(self.validated_data['name'])
         return infobase
 
@@ -252,3 +254,198 @@ class DetailInfobaseSerializer(ShortInfobaseSerializer):
     )
     security_profile_name = serializers.CharField()
     sessions_denied = serializers.BooleanField()
+
+
+class SessionSerializer(serializers.Serializer):
+    session_id = serializers.IntegerField()
+    app_id = serializers.CharField()
+    user_name = serializers.CharField()
+    host = serializers.CharField()
+    infobase = serializers.CharField()
+    started_at = serializers.DateTimeField()
+    last_active_at = serializers.DateTimeField()
+    hibernate = serializers.BooleanField()
+    hibernate_session_terminate_time = serializers.IntegerField()
+    current_service_name = serializers.CharField()
+    blocked_by_dbms = serializers.IntegerField()
+    blocked_by_ls = serializers.IntegerField()
+    bytes_all = serializers.IntegerField()
+    bytes_last_5min = serializers.IntegerField()
+    calls_all = serializers.IntegerField()
+    calls_last_5min = serializers.IntegerField()
+    cpu_time_all = serializers.FloatField()
+    cpu_time_current = serializers.FloatField()
+    cpu_time_last_5min = serializers.FloatField()
+    dbms_bytes_all = serializers.IntegerField()
+    dbms_bytes_last_5min = serializers.IntegerField()
+    db_proc_info = serializers.CharField()
+    db_proc_took = serializers.FloatField()
+    db_proc_took_at = serializers.DateTimeField()
+    duration_all = serializers.FloatField()
+    duration_all_dbms = serializers.FloatField()
+    duration_all_service = serializers.FloatField()
+    duration_current = serializers.FloatField()
+    duration_current_dbms = serializers.FloatField()
+    duration_current_service = serializers.FloatField()
+    duration_last_5min = serializers.FloatField()
+    duration_last_5min_dbms = serializers.FloatField()
+    duration_last_5min_service = serializers.FloatField()
+    memory_all = serializers.IntegerField()
+    memory_current = serializers.IntegerField()
+    memory_last_5min = serializers.IntegerField()
+
+
+class SessionTerminationSerializer(serializers.Serializer):
+    app_id = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+    user = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+    host = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+    infobase = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+    idle_seconds = serializers.IntegerField(
+        min_value=0,
+        required=False,
+    )
+    hibernate = serializers.BooleanField(
+        required=False,
+    )
+    message = serializers.CharField(
+        allow_blank=True,
+        default='',
+    )
+    concurrency = serializers.IntegerField(
+        min_value=1,
+        required=False,
+    )
+    dry_run = serializers.BooleanField(
+        default=False,
+    )
+
+    filter_fields = ('app_id', 'user', 'host', 'infobase', 'idle_seconds', 'hibernate')
+
+    def validate(self, attrs):
+        filters = {key: attrs.pop(key) for key in self.filter_fields if key in attrs}
+        if not filters:
+            raise serializers.ValidationError(
+                f'At least one filter is required: {", ".join(self.filter_fields)}'
+            )
+        attrs['filters'] = filters
+        return attrs
+
+
+class InfobaseUnlockSerializer(serializers.Serializer):
+    infobases = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+    )
+    concurrency = serializers.IntegerField(
+        min_value=1,
+        required=False,
+    )
+
+
+class InfobaseLockSerializer(InfobaseUnlockSerializer):
+    """
+    denied_from и denied_to без смещения относительно UTC считаются заданными в TIME_ZONE.
+    Агенту сервера они передаются в часовом поясе сервера (Host.time_zone, по умолчанию V8_SERVER_TIME_ZONE)
+    """
+    message = serializers.CharField(
+        allow_blank=True,
+        default='Выполняется обслуживание ИБ',
+    )
+    permission_code = serializers.CharField(
+        allow_blank=True,
+        default='0000',
+    )
+    denied_from = serializers.DateTimeField(
+        required=False,
+    )
+    denied_to = serializers.DateTimeField(
+        required=False,
+    )
+    terminate_sessions = serializers.BooleanField(
+        default=False,
+    )
+
+    def validate(self, attrs):
+        denied_from, denied_to = attrs.get('denied_from'), attrs.get('denied_to')
+        if denied_from and denied_to and denied_to <= denied_from:
+            raise serializers.ValidationError('denied_to must be later than denied_from')
+        if attrs['terminate_sessions'] and denied_from and denied_from > timezone.now():
+            raise serializers.ValidationError('Sessions can not be terminated before the lock begins')
+        return attrs
+
+
+class WorkingProcessSerializer(serializers.Serializer):
+    pid = serializers.IntegerField()
+    hostname = serializers.CharField()
+    main_port = serializers.IntegerField()
+    started_at = serializers.DateTimeField()
+    running = serializers.IntegerField()
+    is_enable = serializers.BooleanField()
+    use = serializers.IntegerField()
+    available_performance = serializers.IntegerField()
+    capacity = serializers.IntegerField()
+    connections = serializers.IntegerField()
+    memory_size = serializers.IntegerField()
+    memory_excess_time = serializers.IntegerField()
+    selection_size = serializers.IntegerField()
+    avg_call_time = serializers.FloatField()
+    avg_db_call_time = serializers.FloatField()
+    avg_lock_call_time = serializers.FloatField()
+    avg_server_call_time = serializers.FloatField()
+    avg_threads = serializers.FloatField()
+
+
+class JobSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    kind = serializers.CharField()
+    status = serializers.CharField()
+    host_id = serializers.IntegerField()
+    cluster = serializers.CharField(source='cluster_name')
+    dbms_server = serializers.CharField()
+    params = serializers.ReadOnlyField(source='public_params')
+    result = serializers.ReadOnlyField()
+    error = serializers.CharField()
+    progress = serializers.FloatField()
+    progress_message = serializers.CharField()
+    cancel_requested = serializers.BooleanField()
+    created_at = serializers.DateTimeField()
+    started_at = serializers.DateTimeField()
+    finished_at = serializers.DateTimeField()
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'),
+    )
+    path = serializers.RegexField(
+        r'^/api/v1/',
+    )
+    body = serializers.JSONField(
+        required=False,
+    )
+
+
+class BatchSerializer(serializers.Serializer):
+    operations = BatchOperationSerializer(
+        many=True,
+        allow_empty=False,
+    )
+
+    def validate_operations(self, value):
+        if len(value) > settings.V8_BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {settings.V8_BATCH_MAX_OPERATIONS} elements.'
+            )
+        return value
@@ -0,0 +1,75 @@
+"""
+История показателей сеансов по информационным базам и пользователям.
+
+Каждый снимок фонового опроса кластеров суммируется по информационным базам и по пользователям,
+и суммы записываются в хранилище временных рядов. Ключ ряда - (сервер, кластер, разрез, имя),
+где разрез - 'infobase' или 'user'.
+"""
+from collections import defaultdict
+from typing import Dict, Hashable, List, Tuple
+from django.conf import settings
+from v8webconsole.core.timeseries import TimeSeriesStore, parse_tiers
+from .monitoring import (
+    ClusterSample,
+    cluster_key,
+    cluster_poller,
+)
+
+
+SESSION_METRICS = (
+    'cpu_time_last_5min',
+    'calls_last_5min',
+    'duration_last_5min',
+    'duration_last_5min_dbms',
+    'bytes_last_5min',
+    'dbms_bytes_last_5min',
+    'memory_current',
+)
+
+# Количество сеансов хранится как еще один показатель ряда
+METRICS = ('sessions', ) + SESSION_METRICS
+
+DIMENSIONS = {
+    'infobase': lambda session: (session.infobase or '').lower(),
+    'user': lambda session: session.user_name or '',
+}
+
+
+def series_key(host_id, cluster_name: str, dimension: str, name: str) -> Tuple[Hashable, ...]:
+    return cluster_key(host_id, cluster_name) + (dimension, name)
+
+
+def aggregate(sample: 'ClusterSample') -> List[Tuple[Hashable, List[float]]]:
+    """
+    Суммы показателей сеансов снимка по каждой информационной базе и каждому пользователю
+    """
+    totals: Dict[Hashable, List[float]] = defaultdict(lambda: [0.0] * len(METRICS))
+    for session in sample.sessions:
+        values = [1] + [getattr(session, name) or 0 for name in SESSION_METRICS]
+        for dimension, name_of in DIMENSIONS.items():
+            row = totals[series_key(sample.host_id, sample.cluster, dimension, name_of(session))]
+            for i, value in enumerate(values):
+                row[i] += value
+    return list(totals.items())
+
+
+class SessionMetricsRecorder:
+
+    def __init__(self, store: 'TimeSeriesStore'):
+        self.store = store
+
+    def __call__(self, samples: List['ClusterSample']):
+        for sample in samples:
+            self.store.add(sample.taken_at.timestamp(), aggregate(sample))
+        self.store.prune()
+
+    def names(self, host_id, cluster_name: str, dimension: str) -> List[str]:
+        prefix = cluster_key(host_id, cluster_name) + (dimension, )
+        return sorted(key[-1] for key in self.store.keys() if key[:-1] == prefix)
+
+
+session_metrics = TimeSeriesStore(METRICS, parse_tiers(settings.V8_SERIES_TIERS))
+
+session_metrics_recorder = SessionMetricsRecorder(session_metrics)
+
+cluster_poller.add_listener(session_metrics_recorder)
@@ -0,0 +1,315 @@
+"""
+Отбор сеансов кластера по условиям, выбор самых нагруженных сеансов и массовое завершение сеансов.
+
+Завершение сеанса - отдельный вызов агента сервера, поэтому сотни сеансов завершаются заметное время.
+Отобранные сеансы делятся на части, которые завершаются параллельно в разных COM-апартаментах:
+первая часть - в апартаменте, обрабатывающем запрос или задание, остальные - в апартаментах пула
+массовых операций, каждый через собственное соединение с агентом. COM-объекты сеансов нельзя передать
+в другой апартамент, поэтому там сеансы получаются заново и сопоставляются по информационной базе и номеру сеанса.
+"""
+import heapq
+import logging
+import time
+from concurrent.futures import TimeoutError
+from typing import Callable, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.utils import timezone
+from v8webconsole.clusterconfig.models import to_server_time
+from v8webconsole.core.cluster import ClusterControlInterface
+from v8webconsole.core.comcntr import Session
+from v8webconsole.core.snapshots import SessionSnapshot
+from .fleet import (
+    ClusterTarget,
+    HostTarget,
+    agent_interface,
+    error_data,
+    iter_host_results,
+)
+from .resources import maintenance_executor
+
+
+log = logging.getLogger(__name__)
+
+
+SESSION_KEY_FIELDS = ('infobase', 'session_id')
+
+SESSION_REPORT_FIELDS = ('infobase', 'session_id', 'user_name', 'app_id', 'host')
+
+# Поля снимка, которые необходимы для проверки условий session_matcher
+SESSION_MATCHER_FIELDS = {
+    'app_id': 'app_id',
+    'user': 'user_name',
+    'host': 'host',
+    'infobase': 'infobase',
+    'idle_seconds': 'last_active_at',
+    'hibernate': 'hibernate',
+}
+
+# Числовые показатели сеанса, по которым можно выбрать самые нагруженные сеансы
+RANKING_METRICS = (
+    'blocked_by_dbms',
+    'blocked_by_ls',
+    'bytes_all',
+    'bytes_last_5min',
+    'calls_all',
+    'calls_last_5min',
+    'cpu_time_all',
+    'cpu_time_current',
+    'cpu_time_last_5min',
+    'dbms_bytes_all',
+    'dbms_bytes_last_5min',
+    'db_proc_took',
+    'duration_all',
+    'duration_all_dbms',
+    'duration_all_service',
+    'duration_current',
+    'duration_current_dbms',
+    'duration_current_service',
+    'duration_last_5min',
+    'duration_last_5min_dbms',
+    'duration_last_5min_service',
+    'memory_all',
+    'memory_current',
+    'memory_last_5min',
+)
+
+
+def session_key(snapshot: 'SessionSnapshot') -> Tuple[str, int]:
+    """
+    Номер сеанса уникален только в пределах информационной базы
+    """
+    return (snapshot.infobase or '').lower(), snapshot.session_id
+
+
+def _lower_set(values: Optional[Iterable[str]]):
+    return {value.lower() for value in values} if values else None
+
+
+def session_matcher(app_id: Optional[Iterable[str]] = None,
+                    user: Optional[Iterable[str]] = None,
+                    host: Optional[Iterable[str]] = None,
+                    infobase: Optional[Iterable[str]] = None,
+                    idle_seconds: Optional[int] = None,
+                    hibernate: Optional[bool] = None,
+                    time_zone: str = '') -> Callable[['SessionSnapshot'], bool]:
+    """
+    Условие отбора сеансов. Незаданные условия не проверяются, строки сравниваются без учета регистра.
+    :param idle_seconds: сеанс неактивен не менее указанного числа секунд
+    :param time_zone: часовой пояс сервера, в котором агент возвращает время последней активности
+    """
+    app_ids, users, hosts, infobases = map(_lower_set, (app_id, user, host, infobase))
+    # Время последней активности - местное время сервера без часового пояса
+    now = to_server_time(timezone.now(), time_zone)
+
+    def match(snapshot: 'SessionSnapshot') -> bool:
+        if app_ids is not None and (snapshot.app_id or '').lower() not in app_ids:
+            return False
+        if users is not None and (snapshot.user_name or '').lower() not in users:
+            return False
+        if hosts is not None and (snapshot.host or '').lower() not in hosts:
+            return False
+        if infobases is not None and (snapshot.infobase or '').lower() not in infobases:
+            return False
+        if hibernate is not None and bool(snapshot.hibernate) != hibernate:
+            return False
+        if idle_seconds is not None:
+            if (now - snapshot.last_active_at).total_seconds() < idle_seconds:
+                return False
+        return True
+
+    return match
+
+
+def session_report(snapshot: 'SessionSnapshot', status: str, detail: str = '', duration: float = 0) -> dict:
+    report = {name: getattr(snapshot, name) for name in SESSION_REPORT_FIELDS}
+    report.update(status=status, detail=detail, duration=round(duration, 3))
+    return report
+
+
+def top_sessions(sessions: Iterable['Session'], metric: str, limit: int) -> List['SessionSnapshot']:
+    """
+    Выбирает limit сеансов с наибольшим значением показателя metric. У каждого сеанса читается
+    только этот показатель, лучшие сеансы хранятся в куче размером не более limit,
+    остальные свойства отчета (SESSION_REPORT_FIELDS) читаются только у выбранных сеансов.
+    :return: снимки выбранных сеансов по убыванию показателя
+    """
+    property_name = SessionSnapshot.properties[metric]
+    heap = []
+    # Номер сеанса в списке делает элементы кучи различимыми без сравнения COM-объектов,
+    # при равных значениях выше оказывается сеанс, полученный раньше
+    for position, session in enumerate(sessions):
+        iv8obj = session.get_underlying_com_object()
+        item = (getattr(iv8obj, property_name) or 0, -position, iv8obj)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    snapshots = []
+    for value, _, iv8obj in sorted(heap, reverse=True):
+        snapshot = SessionSnapshot.from_raw(iv8obj, SESSION_REPORT_FIELDS)
+        setattr(snapshot, metric, value)
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def top_session_data(snapshot: 'SessionSnapshot', metric: str, **extra) -> dict:
+    data = {name: getattr(snapshot, name) for name in SESSION_REPORT_FIELDS}
+    data[metric] = getattr(snapshot, metric)
+    return {**extra, **data}
+
+
+def collect_host_top_sessions(target: 'HostTarget', metric: str, limit: int) -> Tuple[List[dict], List[dict]]:
+    """
+    Выбирает самые нагруженные сеансы в каждом зарегистрированном кластере сервера.
+    Выполняется в COM-апартаменте сервера
+    :return: по limit сеансов каждого кластера и ошибки по кластерам
+    """
+    sessions, errors = [], []
+    with agent_interface(target) as ragent_interface:
+        for cluster in target.clusters:
+            try:
+                cluster_interface = ragent_interface.get_cluster_interface(cluster.name)
+                cluster_interface.authenticate_cluster_admin(cluster.login, cluster.pwd)
+                snapshots = top_sessions(cluster_interface.get_sessions(), metric, limit)
+            except StopIteration:
+                errors.append(error_data(target, 'not_found', f'Cluster [{cluster.name}] does not exists',
+                                         cluster.name))
+                continue
+            except Exception as e:
+                log.debug(f'[{target.address}] Unable to rank sessions of cluster {cluster.name}: {e}')
+                errors.append(error_data(target, 'error', e, cluster.name))
+                continue
+            sessions.extend(top_session_data(snapshot, metric, host_id=target.id, cluster=cluster.name)
+                            for snapshot in snapshots)
+    return sessions, errors
+
+
+def fleet_top_sessions(targets: List['HostTarget'], metric: str, limit: int,
+                       timeout: float) -> Tuple[List[dict], List[dict]]:
+    """
+    Выбирает limit самых нагруженных сеансов среди всех кластеров серверов targets.
+    Серверы опрашиваются параллельно, каждому отводится не более timeout секунд с момента начала его опроса
+    :return: сеансы по убыванию показателя и ошибки по серверам и кластерам
+    """
+    candidates, errors = [], []
+    for target, future in iter_host_results(targets, timeout, collect_host_top_sessions, metric, limit):
+        if future is None:
+            errors.append(error_data(target, 'timeout', f'No response within {timeout} seconds'))
+            continue
+        try:
+            sessions, host_errors = future.result()
+        except Exception as e:
+            log.debug(f'[{target.address}] Unable to rank sessions: {e}')
+            errors.append(error_data(target, 'error', e))
+            continue
+        candidates.extend(sessions)
+        errors.extend(host_errors)
+    return heapq.nlargest(limit, candidates, key=lambda data: data[metric]), errors
+
+
+def terminate_sessions(cluster_interface: 'ClusterControlInterface',
+                       sessions: List[Tuple[Optional['Session'], 'SessionSnapshot']],
+                       message: str = '', on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Завершает сеансы по одному и возвращает результат по каждому сеансу.
+    Сеанс, для которого не найден COM-объект, считается уже завершенным
+    :param on_result: вызывается с результатом по каждому сеансу
+    """
+    results = []
+    for session, snapshot in sessions:
+        started = time.monotonic()
+        if session is None:
+            results.append(session_report(snapshot, 'not_found', 'Session does not exists'))
+        else:
+            try:
+                cluster_interface.terminate_session(session, message)
+            except Exception as e:
+                log.debug(f'[{cluster_interface.host}] Unable to terminate session {session_key(snapshot)}: {e}')
+                results.append(session_report(snapshot, 'error', str(e), time.monotonic() - started))
+            else:
+                results.append(session_report(snapshot, 'terminated', '', time.monotonic() - started))
+        if on_result is not None:
+            on_result(results[-1])
+    return results
+
+
+def terminate_sessions_in_apartment(host_target: 'HostTarget', cluster_target: 'ClusterTarget',
+                                    snapshots: List['SessionSnapshot'], message: str = '') -> List[dict]:
+    """
+    Завершает сеансы через собственное соединение с агентом. Выполняется в рабочем потоке-апартаменте
+    """
+    with agent_interface(host_target) as ragent_interface:
+        cluster_interface = ragent_interface.get_cluster_interface(cluster_target.name)
+        cluster_interface.authenticate_cluster_admin(cluster_target.login, cluster_target.pwd)
+        wanted = {session_key(snapshot) for snapshot in snapshots}
+        found = {}
+        for session in cluster_interface.get_sessions():
+            key = session_key(SessionSnapshot.from_com(session, SESSION_KEY_FIELDS))
+            if key in wanted:
+                found[key] = session
+        return terminate_sessions(
+            cluster_interface, [(found.get(session_key(snapshot)), snapshot) for snapshot in snapshots], message
+        )
+
+
+def terminate_matching_sessions(cluster_interface: 'ClusterControlInterface',
+                                host_target: 'HostTarget', cluster_target: 'ClusterTarget',
+                                filters: dict, message: str = '', concurrency: Optional[int] = None,
+                                dry_run: bool = False, progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """
+    Отбирает сеансы кластера по условиям filters (см. session_matcher) и завершает их
+    не более чем в concurrency апартаментах одновременно.
+    У сеансов читаются только поля условий отбора и отчета.
+    :param progress: вызывается с количеством обработанных и отобранных сеансов по мере завершения
+    :return: сводка и результаты по каждому отобранному сеансу
+    """
+    started = time.monotonic()
+    match = session_matcher(time_zone=host_target.time_zone, **filters)
+    fields = {*SESSION_KEY_FIELDS, *SESSION_REPORT_FIELDS, *(SESSION_MATCHER_FIELDS[name] for name in filters)}
+    matched = []
+    for session in cluster_interface.get_sessions():
+        snapshot = SessionSnapshot.from_com(session, fields)
+        if match(snapshot):
+            matched.append((session, snapshot))
+    limit = settings.V8_SESSION_TERMINATION_CONCURRENCY
+    concurrency = max(1, min(concurrency or limit, limit, len(matched)))
+    if dry_run:
+        results = [session_report(snapshot, 'matched') for _, snapshot in matched]
+    else:
+        shards = [matched[i::concurrency] for i in range(concurrency)]
+        futures = [
+            (maintenance_executor.submit(None, terminate_sessions_in_apartment,
+                                         host_target, cluster_target, [snapshot for _, snapshot in shard], message),
+             shard)
+            for shard in shards[1:]
+        ]
+        done = 0
+
+        def report(_):
+            nonlocal done
+            done += 1
+            progress(done, len(matched))
+
+        results = terminate_sessions(cluster_interface, shards[0], message,
+                                     on_result=report if progress is not None else None)
+        deadline = started + settings.V8_SESSION_TERMINATION_TIMEOUT
+        for future, shard in futures:
+            try:
+                results.extend(future.result(max(0, deadline - time.monotonic())))
+            except TimeoutError:
+                future.cancel()
+                results.extend(session_report(snapshot, 'timeout', 'Termination result is unknown')
+                               for _, snapshot in shard)
+            except Exception as e:
+                results.extend(session_report(snapshot, 'error', str(e)) for _, snapshot in shard)
+            if progress is not None:
+                done += len(shard)
+                progress(done, len(matched))
+    return {
+        'matched': len(matched),
+        'terminated': sum(1 for r in results if r['status'] == 'terminated'),
+        'failed': sum(1 for r in results if r['status'] in ('error', 'timeout')),
+        'concurrency': concurrency,
+        'elapsed': round(time.monotonic() - started, 3),
+        'results': results,
+    }
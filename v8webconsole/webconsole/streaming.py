@@ -0,0 +1,55 @@
+"""
+Потоковая выдача больших списков в формате JSON.
+
+Обычный ответ DRF сначала строит список данных всех объектов, затем целиком преобразует его в JSON.
+Потоковый ответ сериализует и кодирует объекты частями по мере отправки клиенту, поэтому
+одновременно в памяти находятся только данные одной части, а первые байты отправляются сразу.
+
+Объекты COM нельзя использовать вне их апартамента, поэтому источником потока служат снимки
+(обычные данные), полученные в апартаменте при обработке запроса. Текст JSON совпадает с выдачей JSONRenderer.
+"""
+from typing import Any, Iterable, Iterator
+from django.http import StreamingHttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def json_encoder() -> JSONEncoder:
+    """
+    Кодировщик с теми же настройками, что и у JSONRenderer
+    """
+    return JSONEncoder(
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+    )
+
+
+def iter_json_list(items: Iterable[Any], chunk_size: int = 100) -> Iterator[bytes]:
+    """
+    Выдает JSON-массив items частями по chunk_size элементов
+    """
+    encoder = json_encoder()
+    separator = encoder.item_separator
+    chunk = ['[']
+    count = 0
+    for item in items:
+        if count:
+            chunk.append(separator)
+        chunk.append(encoder.encode(item))
+        count += 1
+        if count % chunk_size == 0:
+            yield ''.join(chunk).encode()
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk).encode()
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Ответ со списком, который сериализуется и кодируется по мере отправки
+    """
+
+    def __init__(self, items: Iterable[Any], chunk_size: int = 100, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(iter_json_list(items, chunk_size), **kwargs)
@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import datetime
+from concurrent.futures import TimeoutError
+import json
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+import re
+import pytz
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from v8webconsole.clusterconfig.models import (
+    Cluster,
+    ClusterCredentials,
+    Host,
+    HostCredentials,
+    InfobaseCredentials,
+    InfobaseDefaultCredentials,
+)
+from v8webconsole.core.apartment import COMApartmentExecutor
+from v8webconsole.core.blocking import analyze_blocking
+from v8webconsole.core.cluster import ClusterControlInterface, select_working_process
+from v8webconsole.core.comcntr import set_connector_factory
+from v8webconsole.core.inventory import InventoryCache
+from v8webconsole.core.pool import ServerAgentConnectionPool
+from v8webconsole.core.snapshots import SessionSnapshot, take_snapshots
+from v8webconsole.core.timeseries import TimeSeriesStore
+from v8webconsole.core.simulator import Simulator, SimulatorConfig, SimulatedWorkingProcessConnection
+from . import batch, fleet, maintenance, views, views_mixins
+from .batch import ConnectionScope
+from .fleet import HostTarget, agent_interface, get_cluster_target, iter_host_results
+from .jobs import (
+    JobCancelled,
+    JobRunner,
+    job_handler,
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, format_labels, metrics_collector
+from .models import Job
+from .monitoring import ClusterSample, cluster_poller, sample_host
+from .representation import compile_representation
+from .serializers import (
+    DetailClusterSerializer,
+    DetailInfobaseSerializer,
+    SessionSerializer,
+    ShortClusterSerializer,
+    ShortInfobaseSerializer,
+    WorkingProcessSerializer,
+)
+from .session_metrics import METRICS, SessionMetricsRecorder, series_key
+from .sessions import session_matcher, top_sessions
+from .resources import (
+    agent_connection_pool,
+    com_executor,
+    host_apartment_key,
+    inventory_cache,
+    working_process_connection_pool,
+)
+from .streaming import StreamingJSONResponse, iter_json_list
 
-# Create your tests here.
+
+CLUSTER_NAME = 'Локальный кластер'
+
+
+class SimulatorTestMixin:
+    """
+    Регистрирует сервер с кластером и подменяет COMConnector новой имитацией серверов 1С.
+    Запросы к API обрабатываются в вызывающем потоке: в потоках-апартаментах данные теста,
+    не зафиксированные в базе, были бы не видны
+    """
+    simulator_config = SimulatorConfig(infobases=10, sessions=50)
+
+    def setUp(self):
+        super().setUp()
+        self.reset_backend()
+        com_executor.shutdown()
+        inline = mock.patch.object(com_executor, 'workers', 0)
+        inline.start()
+        self.addCleanup(inline.stop)
+        self.simulator = Simulator(self.simulator_config).install()
+        self.addCleanup(set_connector_factory, None)
+        self.addCleanup(self.reset_backend)
+        self.host = Host.objects.create(address='srv1', port=1540)
+        HostCredentials.objects.create(host=self.host, login='admin', pwd='')
+        self.cluster = Cluster.objects.create(host=self.host, name=CLUSTER_NAME)
+        ClusterCredentials.objects.create(cluster=self.cluster, login='admin', pwd='')
+        self.api = APIClient()
+        self.api.force_authenticate(get_user_model().objects.create_user('tester'))
+
+    def cluster_url(self, path: str = '') -> str:
+        return f'/api/v1/webconsole/hosts/{self.host.id}/clusters/{CLUSTER_NAME}/{path}'
+
+    @staticmethod
+    def reset_backend():
+        agent_connection_pool.clear()
+        working_process_connection_pool.clear()
+        inventory_cache.clear()
+
+    def simulated_cluster(self):
+        return self.simulator.agent(self.host.address, self.host.port).clusters[CLUSTER_NAME.lower()]
+
+
+@job_handler('test_succeed')
+def succeed(job, context):
+    return {'answer': job.params['answer']}
+
+
+@job_handler('test_cancel')
+def cancel_itself(job, context):
+    Job.objects.filter(id=job.id).update(cancel_requested=True)
+    context.check_cancelled()
+
+
+class JobRunnerTest(TestCase):
+
+    def setUp(self):
+        self.host = Host.objects.create(address='srv1', port=1540)
+        self.runner = JobRunner(workers=2, host_concurrency=1, dbms_concurrency=1)
+
+    def create_job(self, status=Job.PENDING, dbms_server='', **params) -> 'Job':
+        return Job.objects.create(kind='test_succeed', host=self.host, cluster_name='main', status=status,
+                                  dbms_server=dbms_server, params_json=json.dumps(params),
+                                  heartbeat_at=timezone.now() if status == Job.RUNNING else None)
+
+    def test_cancel_pending_job_removes_secrets(self):
+        job = self.create_job(name='ib', db_password='S3cret')
+        job = self.runner.cancel(job)
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.params, {'name': 'ib'})
+
+    def test_cancel_running_job_requests_cancellation(self):
+        job = self.create_job(status=Job.RUNNING, db_password='S3cret')
+        job = self.runner.cancel(job)
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertTrue(job.cancel_requested)
+        # Параметры нужны обработчику до его завершения
+        self.assertEqual(job.params, {'db_password': 'S3cret'})
+
+    def test_abandoned_job_fails_and_removes_secrets(self):
+        job = self.create_job(status=Job.RUNNING, db_password='S3cret')
+        Job.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - datetime.timedelta(minutes=10))
+        alive = self.create_job(status=Job.RUNNING, db_password='S3cret')
+        self.runner.fail_abandoned()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, 'Job was interrupted')
+        self.assertEqual(job.params, {})
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, Job.RUNNING)
+
+    def test_claim_is_exclusive(self):
+        job = self.create_job()
+        self.assertTrue(self.runner.claim(job))
+        other = JobRunner(workers=2, host_concurrency=2)
+        other.worker_name = 'other:1'
+        self.assertFalse(other.claim(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (Job.RUNNING, self.runner.worker_name))
+
+    def test_claim_rechecks_host_concurrency(self):
+        # Задание того же сервера, захваченное другим процессом после подсчета выполняющихся заданий
+        running = self.create_job(status=Job.RUNNING)
+        Job.objects.filter(id=running.id).update(worker='other:1')
+        job = self.create_job()
+        self.assertFalse(self.runner.claim(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.worker, '')
+        self.assertIsNone(job.started_at)
+
+    def test_claim_rechecks_dbms_concurrency(self):
+        other_host = Host.objects.create(address='srv2', port=1540)
+        Job.objects.create(kind='test_succeed', host=other_host, cluster_name='main', status=Job.RUNNING,
+                           dbms_server='sql1', heartbeat_at=timezone.now())
+        job = self.create_job(dbms_server='sql1')
+        self.assertFalse(self.runner.claim(job))
+        unrelated = self.create_job(dbms_server='sql2')
+        self.assertTrue(self.runner.claim(unrelated))
+
+
+class JobExecutionTest(TransactionTestCase):
+
+    def setUp(self):
+        self.host = Host.objects.create(address='srv1', port=1540)
+        self.runner = JobRunner(workers=1)
+
+    def run_job(self, kind: str, **params) -> 'Job':
+        job = Job.objects.create(kind=kind, host=self.host, cluster_name='main', params_json=json.dumps(params))
+        self.assertTrue(self.runner.claim(job))
+        self.runner.execute(job.id)
+        job.refresh_from_db()
+        return job
+
+    def test_succeeded_job_removes_secrets(self):
+        job = self.run_job('test_succeed', answer=42, db_password='S3cret')
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'answer': 42})
+        self.assertEqual(job.params, {'answer': 42})
+        self.assertEqual(job.progress, 1)
+
+    def test_failed_job_removes_secrets(self):
+        with self.assertLogs('v8webconsole.webconsole.jobs', 'ERROR'):
+            job = self.run_job('test_succeed', db_password='S3cret')
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, "'answer'")
+        self.assertEqual(job.params, {})
+
+    def test_cancelled_job(self):
+        job = self.run_job('test_cancel', db_password='S3cret')
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual(job.params, {})
+        self.assertIsNotNone(job.finished_at)
+        self.assertNotIn(job.id, self.runner._running)
+
+    def test_cancelled_exception_keeps_partial_result(self):
+        @job_handler('test_partial')
+        def partial(job, context):
+            raise JobCancelled({'done': 3})
+
+        job = self.run_job('test_partial')
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual(job.result, {'done': 3})
+
+
+class MaintenanceTest(SimulatorTestMixin, TestCase):
+
+    def lock(self, **options) -> dict:
+        host_target, cluster_target = get_cluster_target(self.host.id, CLUSTER_NAME)
+        credentials = {name: [('', '')] for name in ('ib0001', 'ib0002', 'ib0003', 'missing')}
+        return maintenance.lock_infobases(host_target, cluster_target, credentials, concurrency=2, **options)
+
+    def test_lock_runs_in_maintenance_apartments(self):
+        threads = []
+        change_infobases = maintenance.change_infobases
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return change_infobases(*args, **kwargs)
+
+        with mock.patch.object(maintenance, 'change_infobases', record_thread):
+            report = self.lock()
+        self.assertEqual((report['done'], report['failed']), (3, 1))
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('maintenance-') for name in threads), threads)
+        infobases = self.simulated_cluster().infobases
+        self.assertTrue(all(infobases[name]._properties['SessionsDenied'] for name in ('ib0001', 'ib0002', 'ib0003')))
+        self.assertFalse(infobases['ib0004']._properties['SessionsDenied'])
+
+    def test_lock_times_are_passed_in_server_time_zone(self):
+        self.host.time_zone = 'Europe/Moscow'
+        self.host.save()
+        moscow = pytz.timezone('Europe/Moscow')
+        denied_from = moscow.localize(datetime.datetime(2026, 10, 20, 22, 0))
+        self.lock(denied_from=denied_from.astimezone(pytz.utc),
+                  denied_to=denied_from + datetime.timedelta(hours=2))
+        infobase = self.simulated_cluster().infobases['ib0001']._properties
+        self.assertEqual(infobase['DeniedFrom'], datetime.datetime(2026, 10, 20, 22, 0))
+        self.assertEqual(infobase['DeniedTo'], datetime.datetime(2026, 10, 21, 0, 0))
+
+    def test_lock_times_default_to_configured_time_zone(self):
+        denied_from = pytz.utc.localize(datetime.datetime(2026, 10, 20, 19, 0))
+        with self.settings(V8_SERVER_TIME_ZONE='Asia/Yekaterinburg'):
+            self.lock(denied_from=denied_from)
+        infobase = self.simulated_cluster().infobases['ib0001']._properties
+        self.assertEqual(infobase['DeniedFrom'], datetime.datetime(2026, 10, 21, 0, 0))
+
+
+class SnapshotListTest(SimulatorTestMixin, TestCase):
+    simulator_config = SimulatorConfig(infobases=5, sessions=40)
+
+    def sessions(self):
+        return self.simulated_cluster().sessions
+
+    def session_keys(self, data) -> list:
+        return [(item['infobase'], item['session_id']) for item in data]
+
+    def test_invalid_query_is_rejected_before_reading_sessions(self):
+        for query in ('app_id__foo=1', 'ordering=unknown', 'page_size=0', 'cursor=garbage',
+                      'started_at__gte=yesterday'):
+            self.simulator.stats.reset()
+            response = self.api.get(self.cluster_url(f'sessions/?{query}'))
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(self.simulator.stats.as_dict(), {'calls': 0, 'property_accesses': 0}, query)
+
+    def test_cursor_pages_cover_list(self):
+        keys, url = [], self.cluster_url('sessions/?page_size=15&fields=infobase,session_id')
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], 40)
+            keys.extend(self.session_keys(response.data['results']))
+            url = response.data['next']
+        expected = self.session_keys(self.api.get(self.cluster_url('sessions/?fields=infobase,session_id')).data)
+        self.assertEqual(keys, expected)
+
+    def test_next_page_continues_after_last_item_when_items_disappear(self):
+        first = self.api.get(self.cluster_url('sessions/?page_size=10&fields=infobase,session_id')).data
+        page = self.session_keys(first['results'])
+        # Сеансы первой страницы завершились, номер позиции продолжения списка сместился
+        del self.sessions()[2:5]
+        second = self.api.get(first['next']).data
+        remaining = self.session_keys(self.api.get(self.cluster_url('sessions/?fields=infobase,session_id')).data)
+        start = remaining.index(page[-1]) + 1
+        self.assertEqual(self.session_keys(second['results']), remaining[start:start + 10])
+        self.assertEqual(second['count'], 37)
+
+    def test_next_page_uses_position_when_cursor_item_disappears(self):
+        first = self.api.get(self.cluster_url('sessions/?page_size=10&fields=infobase,session_id')).data
+        del self.sessions()[9]
+        second = self.api.get(first['next']).data
+        remaining = self.session_keys(self.api.get(self.cluster_url('sessions/?fields=infobase,session_id')).data)
+        self.assertEqual(self.session_keys(second['results']), remaining[10:20])
+
+    def test_previous_page_returns_same_items(self):
+        first = self.api.get(self.cluster_url('sessions/?page_size=10&fields=infobase,session_id')).data
+        second = self.api.get(first['next']).data
+        back = self.api.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_datetime_filter_uses_server_time_zone(self):
+        self.host.time_zone = 'Europe/Moscow'
+        self.host.save()
+        started = sorted(session._properties['StartedAt'] for session in self.sessions())
+        boundary = started[len(started) // 2]
+        moscow = pytz.timezone('Europe/Moscow')
+        value = moscow.localize(boundary).astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        response = self.api.get(self.cluster_url('sessions/'), {'started_at__gte': value, 'fields': 'started_at'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), sum(1 for value in started if value >= boundary))
+
+
+class FieldsQueryTest(SimulatorTestMixin, TestCase):
+
+    def get(self, path: str, **params) -> 'Response':
+        return self.api.get(self.cluster_url(path), params)
+
+    def test_unknown_field_is_rejected(self):
+        response = self.get('sessions/', fields='session_id,unknown,other')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [{'code': 'fields', 'detail': 'Unknown fields: other, unknown'}])
+        self.assertEqual(self.get('infobases/', fields='db_password').status_code, 400)
+
+    def test_only_requested_fields_are_read(self):
+        # Первый запрос загружает в кэш список кластеров
+        self.get('sessions/', fields='session_id')
+        self.simulator.stats.reset()
+        response = self.get('sessions/', fields=' user_name , infobase ')
+        self.assertEqual(response.status_code, 200)
+        sessions = self.simulated_cluster().sessions
+        self.assertEqual(response.data, [
+            {'user_name': session._properties['userName'],
+             'infobase': session._properties['infoBase']._properties['Name']} for session in sessions
+        ])
+        # Имя информационной базы читается у вложенного объекта: два обращения на сеанс
+        self.assertEqual(self.simulator.stats.as_dict()['property_accesses'], len(sessions) * 3)
+
+    def test_key_fields_are_read_for_pagination(self):
+        names, url = [], self.cluster_url('sessions/?fields=user_name&page_size=20')
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(all(set(item) == {'user_name'} for item in response.data['results']))
+            names.extend(item['user_name'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(names, [session._properties['userName'] for session in self.simulated_cluster().sessions])
+
+    def test_ordering_by_field_that_is_not_requested(self):
+        response = self.get('sessions/', fields='session_id,infobase', ordering='-memory_current')
+        self.assertEqual(set(response.data[0]), {'session_id', 'infobase'})
+        sessions = sorted(self.simulated_cluster().sessions, key=lambda session: -session._properties['MemoryCurrent'])
+        self.assertEqual([(item['infobase'], item['session_id']) for item in response.data],
+                         [(session._properties['infoBase']._properties['Name'], session._properties['SessionID'])
+                          for session in sessions])
+
+    def test_fields_of_detail_list(self):
+        response = self.get('infobases/', detail='true', fields='name,db_name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0], {'name': 'ib0001', 'db_name': 'ib0001'})
+        # Без ?detail=true выдается краткое описание, в котором нет полей полного
+        self.assertEqual(self.get('infobases/', fields='name,db_name').status_code, 400)
+        self.assertEqual(self.get('infobases/ib0002/', fields='db_server_name').data, {'db_server_name': 'srv1'})
+
+
+class SessionTerminationTest(SimulatorTestMixin, TestCase):
+
+    def sessions(self):
+        return self.simulated_cluster().sessions
+
+    def terminate(self, **data):
+        response = self.api.post(self.cluster_url('sessions/terminate/'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def infobase_sessions(self, name: str) -> list:
+        return [session for session in self.sessions() if session._properties['infoBase']._properties['Name'] == name]
+
+    @contextmanager
+    def cluster_interface(self):
+        target = HostTarget(id=self.host.id, address=self.host.address, port=self.host.port,
+                            login='admin', pwd='', clusters=[])
+        with agent_interface(target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            try:
+                yield cluster_interface
+            finally:
+                cluster_interface.close()
+
+    def test_idle_time_is_compared_in_server_time_zone(self):
+        time_zone = 'Asia/Vladivostok'
+        last_active_at = timezone.now().astimezone(pytz.timezone(time_zone)).replace(tzinfo=None)
+        snapshot = mock.Mock(last_active_at=last_active_at - datetime.timedelta(seconds=600))
+        self.assertTrue(session_matcher(idle_seconds=300, time_zone=time_zone)(snapshot))
+        self.assertFalse(session_matcher(idle_seconds=900, time_zone=time_zone)(snapshot))
+
+    def test_dry_run_reports_matched_sessions(self):
+        expected = len(self.infobase_sessions('ib0001'))
+        report = self.terminate(infobase=['IB0001'], dry_run=True)
+        self.assertEqual(report['matched'], expected)
+        self.assertEqual(report['terminated'], 0)
+        self.assertEqual({result['status'] for result in report['results']}, {'matched'})
+        self.assertEqual(len(self.sessions()), 50)
+
+    def test_filters_are_combined(self):
+        for session in self.infobase_sessions('ib0002')[:2]:
+            session._properties['Hibernate'] = True
+        for session in self.infobase_sessions('ib0003')[:1]:
+            session._properties['Hibernate'] = True
+        hibernated = [session for session in self.infobase_sessions('ib0002') if session._properties['Hibernate']]
+        report = self.terminate(infobase=['ib0002'], hibernate=True, concurrency=1)
+        self.assertEqual(report['matched'], len(hibernated))
+        self.assertEqual(report['terminated'], len(hibernated))
+        self.assertTrue(all(session not in self.sessions() for session in hibernated))
+        self.assertTrue(any(session._properties['Hibernate'] for session in self.infobase_sessions('ib0003')))
+
+    def test_idle_filter_terminates_inactive_sessions(self):
+        now = timezone.now().astimezone(pytz.utc).replace(tzinfo=None)
+        for position, session in enumerate(self.sessions()):
+            session._properties['LastActiveAt'] = now - datetime.timedelta(hours=2 if position % 5 == 0 else 0)
+        report = self.terminate(idle_seconds=3600, concurrency=1)
+        self.assertEqual(report['terminated'], 10)
+        self.assertEqual(len(self.sessions()), 40)
+
+    def test_only_filter_and_report_fields_are_read(self):
+        self.simulator.stats.reset()
+        self.terminate(infobase=['ib0001'], dry_run=True)
+        accesses = self.simulator.stats.as_dict()['property_accesses']
+        self.simulator.stats.reset()
+        with self.cluster_interface() as cluster_interface:
+            take_snapshots(cluster_interface.get_sessions())
+        self.assertLess(accesses * 4, self.simulator.stats.as_dict()['property_accesses'])
+
+    def test_failed_session_does_not_stop_termination(self):
+        terminate_session = ClusterControlInterface.terminate_session
+        failed = []
+
+        def fail_first(cluster_interface, session, message=''):
+            if not failed:
+                failed.append(session)
+                raise RuntimeError('Session is busy')
+            terminate_session(cluster_interface, session, message)
+
+        expected = len(self.infobase_sessions('ib0001'))
+        with mock.patch.object(ClusterControlInterface, 'terminate_session', autospec=True, side_effect=fail_first):
+            report = self.terminate(infobase=['ib0001'], concurrency=1)
+        self.assertEqual(report['matched'], expected)
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(report['terminated'], expected - 1)
+        errors = [result for result in report['results'] if result['status'] == 'error']
+        self.assertEqual([error['detail'] for error in errors], ['Session is busy'])
+        self.assertEqual(len(self.infobase_sessions('ib0001')), 1)
+
+
+class InfobaseDetailListTest(SimulatorTestMixin, TestCase):
+    simulator_config = SimulatorConfig(infobases=4, sessions=0)
+
+    def setUp(self):
+        super().setUp()
+        self.authentications = []
+        get_infobases = SimulatedWorkingProcessConnection.GetInfoBases
+
+        def add_authentication(connection, login, password):
+            self.authentications.append(login)
+
+        def get_infobases_as_admin(connection):
+            # Свойства базы, кроме имени, доступны только ее администратору
+            infobases = get_infobases(connection)
+            for infobase in infobases:
+                name = infobase._properties['Name']
+                if f'{name}-admin' not in self.authentications and 'default' not in self.authentications:
+                    del infobase._properties['dbName']
+            return infobases
+
+        for patcher in (
+                mock.patch.object(SimulatedWorkingProcessConnection, 'AddAuthentication', add_authentication),
+                mock.patch.object(SimulatedWorkingProcessConnection, 'GetInfoBases', get_infobases_as_admin)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('ib0001', 'ib0002'):
+            InfobaseCredentials.objects.create(cluster=self.cluster, name=name, login=f'{name}-admin', pwd='')
+
+    def list(self, **params) -> 'Response':
+        response = self.api.get(self.cluster_url('infobases/'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_detail_list_is_read_after_all_infobase_authentications(self):
+        InfobaseDefaultCredentials.objects.create(cluster=self.cluster, login='default', pwd='')
+        data = self.list(detail='true').data
+        self.assertEqual(sorted(self.authentications), ['default', 'ib0001-admin', 'ib0002-admin'])
+        self.assertEqual([item['name'] for item in data], ['ib0001', 'ib0002', 'ib0003', 'ib0004'])
+        self.assertEqual([item['db_name'] for item in data], ['ib0001', 'ib0002', 'ib0003', 'ib0004'])
+
+    def test_infobases_without_credentials_are_reported_with_error(self):
+        data = self.list(detail='true').data
+        self.assertEqual([item['db_name'] for item in data[:2]], ['ib0001', 'ib0002'])
+        for item in data[2:]:
+            self.assertEqual(set(item), {'name', 'error'})
+            self.assertIn('dbName', item['error'])
+        self.assertEqual([item['name'] for item in data[2:]], ['ib0003', 'ib0004'])
+
+    def test_short_list_does_not_authenticate_infobase_admins(self):
+        data = self.list().data
+        self.assertEqual(set(data[0]), {'name', 'descr'})
+        self.assertEqual(self.authentications, [])
+
+
+class TopSessionsTest(SimulatorTestMixin, TestCase):
+
+    def top(self, **params) -> 'Response':
+        return self.api.get(self.cluster_url('sessions/top/'), params)
+
+    def test_sessions_are_ordered_by_metric(self):
+        response = self.top(metric='memory_current', limit=5)
+        self.assertEqual(response.status_code, 200)
+        expected = sorted((session._properties['MemoryCurrent'] for session in self.simulated_cluster().sessions),
+                          reverse=True)[:5]
+        self.assertEqual([item['memory_current'] for item in response.data], expected)
+        self.assertEqual(set(response.data[0]),
+                         {'infobase', 'session_id', 'user_name', 'app_id', 'host', 'memory_current'})
+
+    def test_equal_values_keep_list_order(self):
+        sessions = self.simulated_cluster().sessions
+        for session in sessions:
+            session._properties['cpuTimeCurrent'] = 7
+        response = self.top(metric='cpu_time_current', limit=3)
+        self.assertEqual([(item['infobase'], item['session_id']) for item in response.data],
+                         [(session._properties['infoBase']._properties['Name'], session._properties['SessionID'])
+                          for session in sessions[:3]])
+
+    def test_limit_larger_than_list_returns_all_sessions(self):
+        response = self.top(metric='calls_all', limit=1000)
+        values = [item['calls_all'] for item in response.data]
+        self.assertEqual(len(values), len(self.simulated_cluster().sessions))
+        self.assertEqual(values, sorted(values, reverse=True))
+
+    def test_limit_is_bounded(self):
+        self.assertEqual(len(self.top(metric='calls_all').data), 20)
+        for limit in (0, 1001, 'many'):
+            self.assertEqual(self.top(metric='calls_all', limit=limit).status_code, 400, limit)
+
+    def test_invalid_metric_is_rejected_before_reading_sessions(self):
+        for params in ({}, {'metric': 'unknown'}, {'metric': 'user_name'}):
+            self.simulator.stats.reset()
+            response = self.top(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertEqual(self.simulator.stats.as_dict(), {'calls': 0, 'property_accesses': 0}, params)
+
+    def test_report_fields_are_read_only_for_selected_sessions(self):
+        sessions = [mock.Mock(**{'get_underlying_com_object.return_value': mock.Mock(MemoryCurrent=value)})
+                    for value in (5, None, 9, 1)]
+        with mock.patch.object(SessionSnapshot, 'from_raw', wraps=SessionSnapshot.from_raw) as from_raw:
+            snapshots = top_sessions(sessions, 'memory_current', 2)
+        self.assertEqual([snapshot.memory_current for snapshot in snapshots], [9, 5])
+        self.assertEqual(from_raw.call_count, 2)
+
+
+class StreamingListTest(SimulatorTestMixin, TestCase):
+    items = [{'name': 'ИБ "1"', 'started_at': datetime.datetime(2026, 10, 20, 19, 0), 'value': 1.5, 'empty': None},
+             {'name': 'ib2', 'started_at': None, 'value': 2 ** 40, 'empty': []}]
+
+    def assertSameAsRenderer(self, items, chunk_size: int) -> list:
+        chunks = list(iter_json_list(items, chunk_size))
+        self.assertEqual(b''.join(chunks), JSONRenderer().render(items))
+        return chunks
+
+    def test_empty_list(self):
+        self.assertEqual(self.assertSameAsRenderer([], 3), [b'[]'])
+
+    def test_list_of_exact_multiple_of_chunk_size(self):
+        chunks = self.assertSameAsRenderer(self.items * 3, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[-1], b']')
+
+    def test_list_split_into_partial_chunks(self):
+        self.assertEqual(len(self.assertSameAsRenderer(self.items * 2 + self.items[:1], 2)), 3)
+        self.assertEqual(len(self.assertSameAsRenderer(self.items[:1], 100)), 1)
+
+    def test_items_are_encoded_while_streaming(self):
+        consumed = []
+
+        def items():
+            for item in self.items * 2:
+                consumed.append(item)
+                yield item
+
+        chunks = iter_json_list(items(), 2)
+        next(chunks)
+        self.assertEqual(len(consumed), 2)
+
+    def test_response_matches_regular_response(self):
+        url = self.cluster_url('sessions/')
+        with self.settings(V8_STREAMING_LIST_THRESHOLD=10 ** 6):
+            regular = self.api.get(url)
+        with self.settings(V8_STREAMING_LIST_THRESHOLD=1):
+            streamed = self.api.get(url)
+        self.assertFalse(regular.streaming)
+        self.assertIsInstance(streamed, StreamingJSONResponse)
+        self.assertEqual(streamed['Content-Type'], 'application/json')
+        self.assertEqual(b''.join(streamed.streaming_content), regular.content)
+
+
+class ServerTimingTest(SimulatorTestMixin, TestCase):
+
+    def test_database_queries_are_counted_once_in_request_thread(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(self.cluster_url('infobases/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(queries), 0)
+        timing = re.search(r'db;dur=[\d.]+;desc="(\d+) queries"', response['Server-Timing'])
+        self.assertEqual(int(timing.group(1)), len(queries))
+        com = re.search(r'com;dur=[\d.]+;desc="(\d+) calls', response['Server-Timing'])
+        self.assertGreater(int(com.group(1)), 0)
+
+
+class ApartmentTest(SimulatorTestMixin, TestCase):
+
+    def make_executor(self, workers: int, key_workers: int) -> 'COMApartmentExecutor':
+        executor = COMApartmentExecutor(workers=workers, name='test-apartment', key_workers=key_workers)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def block(self, executor: 'COMApartmentExecutor', key) -> threading.Event:
+        release, started = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def wait():
+            started.set()
+            release.wait(10)
+
+        executor.submit(key, wait)
+        self.assertTrue(started.wait(10))
+        return release
+
+    def test_slow_call_does_not_hold_other_calls_to_same_host(self):
+        executor = self.make_executor(workers=4, key_workers=2)
+        key = host_apartment_key(self.host.id)
+        self.block(executor, key)
+        self.assertTrue(executor.call(key, executor.in_worker, timeout=5))
+
+    def test_calls_to_same_host_use_limited_set_of_workers(self):
+        executor = self.make_executor(workers=4, key_workers=2)
+        key = host_apartment_key(self.host.id)
+        release = [self.block(executor, key), self.block(executor, key)]
+        future = executor.submit(key, threading.current_thread)
+        with self.assertRaises(TimeoutError):
+            future.result(0.2)
+        release[0].set()
+        self.assertTrue(future.result(5).name.startswith('test-apartment-'))
+
+    def test_submit_to_thread_runs_in_that_worker(self):
+        executor = self.make_executor(workers=4, key_workers=2)
+        thread_id = executor.call(host_apartment_key(self.host.id), threading.get_ident)
+        self.assertEqual(executor.submit_to_thread(thread_id, threading.get_ident).result(5), thread_id)
+
+    def test_queued_request_times_out_with_503(self):
+        executor = self.make_executor(workers=1, key_workers=1)
+        self.block(executor, host_apartment_key(self.host.id))
+        with mock.patch.object(views_mixins, 'com_executor', executor), self.settings(V8_COM_CALL_TIMEOUT=0.2):
+            response = self.api.get(self.cluster_url('infobases/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['errors'][0]['code'], 'apartment_busy')
+
+    def test_running_request_times_out_with_504(self):
+        executor = self.make_executor(workers=1, key_workers=1)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(views_mixins, 'com_executor', executor), self.settings(V8_COM_CALL_TIMEOUT=0.2), \
+                mock.patch.object(views_mixins.RAgentInterfaceViewMixin, 'dispatch_in_apartment',
+                                  lambda *args, **kwargs: release.wait(10)):
+            response = self.api.get(self.cluster_url('infobases/'))
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json()['errors'][0]['code'], 'agent_timeout')
+
+
+class BatchTest(SimulatorTestMixin, TestCase):
+
+    def batch(self, *operations, client=None) -> 'Response':
+        return (client or self.api).post('/api/v1/batch', {'operations': [
+            {'method': method, 'path': path, **({'body': body} if body is not None else {})}
+            for method, path, body in operations
+        ]}, format='json')
+
+    def get(self, path: str) -> tuple:
+        return 'GET', self.cluster_url(path), None
+
+    def test_subrequests_share_host_connections(self):
+        with mock.patch.object(agent_connection_pool, 'acquire', wraps=agent_connection_pool.acquire) as acquire:
+            response = self.batch(self.get('infobases/'), self.get('sessions/?fields=session_id'),
+                                  ('GET', f'/api/v1/webconsole/hosts/{self.host.id}/clusters/', None))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 200])
+        self.assertEqual(acquire.call_count, 1)
+        self.assertEqual(agent_connection_pool.idle_count(), 1)
+
+    def test_failed_subrequest_does_not_affect_others(self):
+        response = self.batch(self.get('infobases/unknown/'), ('GET', '/api/v1/unknown/', None),
+                              self.get('infobases/?fields=name'))
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [404, 404, 200])
+        self.assertEqual(len(results[2]['body']), 10)
+
+    def test_unexpected_error_is_reported_for_its_subrequest(self):
+        with mock.patch.object(ClusterControlInterface, 'get_infobases_short', side_effect=RuntimeError('Broken')):
+            response = self.batch(self.get('infobases/'), self.get('sessions/?fields=session_id'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [500, 200])
+
+    def test_subrequests_are_authenticated_as_batch_user(self):
+        users = []
+
+        def get_queryset(view):
+            users.append(view.request.user)
+            return Host.objects.all()
+
+        with mock.patch.object(views.HostViewSet, 'get_queryset', autospec=True, side_effect=get_queryset):
+            response = self.batch(('GET', '/api/v1/webconsole/hosts/', None))
+            self.assertEqual(response.data['results'][0]['status'], 200)
+            self.assertEqual(self.batch(('GET', '/api/v1/webconsole/hosts/', None), client=APIClient()).status_code,
+                             401)
+        self.assertEqual([user.username for user in users], ['tester'])
+
+    def test_scope_connections_are_released_in_owning_apartment(self):
+        executor = COMApartmentExecutor(workers=2, name='test-batch', key_workers=1)
+        self.addCleanup(executor.shutdown)
+        scope, connections, released_in = ConnectionScope(), mock.Mock(), []
+        connections.release.side_effect = lambda discard: released_in.append(threading.get_ident())
+
+        def add_connections():
+            scope.add_connections(self.host.id, connections)
+            return threading.get_ident()
+
+        thread_id = executor.call(host_apartment_key(self.host.id), add_connections, timeout=5)
+        self.assertIsNone(scope.get_connections(self.host.id))
+        with mock.patch.object(batch, 'com_executor', executor):
+            scope.close()
+        self.assertEqual(released_in, [thread_id])
+
+
+class FleetTimeoutTest(TestCase):
+
+    def setUp(self):
+        executor = COMApartmentExecutor(workers=1, name='test-fleet')
+        self.addCleanup(executor.shutdown)
+        patcher = mock.patch.object(fleet, 'com_executor', executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.targets = [HostTarget(id=i, address=f'srv{i}', port=1540, login='', pwd='', clusters=[])
+                        for i in range(2)]
+
+    def test_host_budget_starts_with_its_poll(self):
+        # Оба сервера опрашиваются одним апартаментом, второй начинается после завершения первого
+        results = {target.id: future.result() for target, future in
+                   iter_host_results(self.targets, 0.5, lambda target: time.sleep(0.3) or target.id)}
+        self.assertEqual(results, {0: 0, 1: 1})
+
+    def test_hung_host_and_queued_host_time_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = time.monotonic()
+        results = {target.id: future for target, future in
+                   iter_host_results(self.targets, 0.2, lambda target: release.wait(10))}
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(results, {0: None, 1: None})
+
+
+class MetricsTest(SimulatorTestMixin, TestCase):
+    sample_re = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+    def setUp(self):
+        super().setUp()
+        metrics_collector.invalidate()
+        self.addCleanup(metrics_collector.invalidate)
+
+    def scrape(self, client=None, **headers) -> 'HttpResponse':
+        return (client or self.api).get('/metrics', **headers)
+
+    def test_exposition_format(self):
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], METRICS_CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertTrue(text.endswith('\n'))
+        families, samples = [], {}
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                families.append(line.split()[2])
+            elif line.startswith('# TYPE '):
+                self.assertEqual(line, f'# TYPE {families[-1]} gauge')
+            else:
+                name, labels, value = self.sample_re.match(line).groups()
+                # Все значения показателя следуют подряд после его описания
+                self.assertEqual(name, families[-1])
+                samples.setdefault(name, []).append((labels, float(value)))
+        self.assertEqual(len(families), len(set(families)))
+        self.assertEqual(samples['v8_up'], [('host="srv1:1540"', 1.0)])
+        self.assertEqual(samples['v8_cluster_up'], [(f'host="srv1:1540",cluster="{CLUSTER_NAME}"', 1.0)])
+        self.assertEqual(len(samples['v8_working_process_connections']),
+                         len(self.simulated_cluster().working_processes))
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(format_labels({'cluster': 'a"b\\c\nd', 'port': 1541}),
+                         '{cluster="a\\"b\\\\c\\nd",port="1541"}')
+        Cluster.objects.create(host=self.host, name='Missing "main"\\')
+        text = self.scrape().content.decode()
+        self.assertIn('v8_cluster_up{host="srv1:1540",cluster="Missing \\"main\\"\\\\"} 0.0', text.splitlines())
+
+    def test_token_grants_access(self):
+        with self.settings(V8_METRICS_TOKEN='S3cret'):
+            response = self.scrape(APIClient(), HTTP_AUTHORIZATION='Bearer S3cret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_or_wrong_token_is_rejected(self):
+        with self.settings(V8_METRICS_TOKEN='S3cret'):
+            for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}, {'HTTP_AUTHORIZATION': 'Basic S3cret'}):
+                response = self.scrape(APIClient(), **headers)
+                self.assertEqual(response.status_code, 401, headers)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="metrics"')
+
+    def test_token_is_not_accepted_when_not_configured(self):
+        with self.settings(V8_METRICS_TOKEN=''):
+            self.assertEqual(self.scrape(APIClient(), HTTP_AUTHORIZATION='Bearer ').status_code, 401)
+
+
+class FleetSessionsTest(SimulatorTestMixin, TestCase):
+
+    def test_sessions_are_streamed_with_errors_at_the_end(self):
+        Cluster.objects.create(host=self.host, name='Missing')
+        down = Host.objects.create(address='srv2', port=1540)
+        collect_host_sessions = fleet.collect_host_sessions
+
+        def collect(target):
+            if target.id == down.id:
+                raise RuntimeError('Agent is not available')
+            return collect_host_sessions(target)
+
+        with mock.patch.object(fleet, 'collect_host_sessions', collect):
+            response = self.api.get('/api/v1/webconsole/sessions/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            body = b''.join(response.streaming_content).decode()
+        data = json.loads(body)
+        self.assertEqual(len(data['results']), len(self.simulated_cluster().sessions))
+        self.assertEqual({(item['host_id'], item['cluster']) for item in data['results']},
+                         {(self.host.id, CLUSTER_NAME)})
+        self.assertEqual(sorted((error['host_id'], error['cluster'], error['code']) for error in data['errors']),
+                         sorted([(self.host.id, 'Missing', 'not_found'), (down.id, None, 'error')]))
+        self.assertTrue(body.endswith('"errors": ' + json.dumps(data['errors'], ensure_ascii=False) + '}'))
+
+
+class BlockingGraphTest(TestCase):
+
+    @staticmethod
+    def snapshot(session_id: int, blocked_by_dbms: int = 0, blocked_by_ls: int = 0,
+                 infobase: str = 'ib1') -> 'SessionSnapshot':
+        snapshot = SessionSnapshot.__new__(SessionSnapshot)
+        snapshot.infobase, snapshot.session_id = infobase, session_id
+        snapshot.blocked_by_dbms, snapshot.blocked_by_ls = blocked_by_dbms, blocked_by_ls
+        return snapshot
+
+    @staticmethod
+    def keys(items) -> list:
+        return [(item['infobase'], item['session_id']) for item in items]
+
+    def blocked(self, report: dict, session_id: int, infobase: str = 'ib1') -> dict:
+        for item in report['blocked_sessions']:
+            if (item['infobase'], item['session_id']) == (infobase, session_id):
+                return item
+        self.fail(f'Session {infobase}:{session_id} is not blocked')
+
+    def test_chain_depth_and_root(self):
+        report = analyze_blocking([self.snapshot(1), self.snapshot(2, 1), self.snapshot(3, 2), self.snapshot(4)])
+        self.assertEqual((report['sessions'], report['blocked'], report['max_depth']), (4, 2, 2))
+        self.assertEqual(self.keys(report['roots']), [('ib1', 1)])
+        self.assertEqual((report['roots'][0]['blocked'], report['roots'][0]['depth']), (2, 2))
+        self.assertEqual(self.keys(report['blocked_sessions']), [('ib1', 3), ('ib1', 2)])
+        self.assertEqual(self.keys(self.blocked(report, 3)['roots']), [('ib1', 1)])
+        self.assertEqual(report['cycles'], [])
+
+    def test_session_waiting_for_several_roots(self):
+        report = analyze_blocking([self.snapshot(1), self.snapshot(2), self.snapshot(3, 1, 2)])
+        self.assertEqual(self.keys(report['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertEqual(self.keys(self.blocked(report, 3)['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertEqual(self.blocked(report, 3)['blocked_by'],
+                         [{'kind': 'dbms', 'session_id': 1}, {'kind': 'ls', 'session_id': 2}])
+
+    def test_roots_are_qualified_by_infobase(self):
+        report = analyze_blocking([self.snapshot(1, infobase='ib1'), self.snapshot(2, 1, infobase='ib1'),
+                                   self.snapshot(1, infobase='ib2'), self.snapshot(2, 1, infobase='ib2')])
+        self.assertEqual(self.keys(report['roots']), [('ib1', 1), ('ib2', 1)])
+        self.assertEqual(self.keys(self.blocked(report, 2, 'ib2')['roots']), [('ib2', 1)])
+
+    def test_deadlock_members_are_roots(self):
+        report = analyze_blocking([self.snapshot(1, 2), self.snapshot(2, 1)])
+        self.assertEqual(self.keys(report['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertTrue(all(root['deadlock'] and root['blocked'] == 2 for root in report['roots']))
+        self.assertEqual(self.keys(self.blocked(report, 1)['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertEqual([self.keys(cycle) for cycle in report['cycles']], [[('ib1', 1), ('ib1', 2)]])
+        self.assertEqual(report['max_depth'], 0)
+
+    def test_sessions_waiting_for_deadlock(self):
+        report = analyze_blocking([self.snapshot(1, 2), self.snapshot(2, 0, 1), self.snapshot(3, 1),
+                                   self.snapshot(4, 3)])
+        self.assertEqual(self.keys(report['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertEqual((report['roots'][0]['blocked'], report['roots'][0]['depth']), (4, 2))
+        self.assertEqual(self.keys(self.blocked(report, 4)['roots']), [('ib1', 1), ('ib1', 2)])
+        self.assertEqual(self.blocked(report, 4)['depth'], 2)
+
+    def test_finished_blocker_is_root(self):
+        report = analyze_blocking([self.snapshot(2, 5)])
+        self.assertEqual(self.keys(report['roots']), [('ib1', 5)])
+        self.assertFalse(report['roots'][0]['exists'])
+
+
+class BlockingSampleTest(SimulatorTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch.object(cluster_poller, 'ensure_started'),
+                        mock.patch.object(cluster_poller, '_buffers', {}),
+                        mock.patch.object(cluster_poller, '_listeners', [])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cluster_poller.store([ClusterSample(self.host.id, CLUSTER_NAME, [], [])])
+
+    def test_sample_is_used_for_registered_cluster(self):
+        self.simulator.stats.reset()
+        response = self.api.get(self.cluster_url('sessions/blocking/'), {'max_age': 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['source'], 'sample')
+        self.assertEqual(self.simulator.stats.as_dict()['calls'], 0)
+
+    def test_non_numeric_host_is_not_found(self):
+        response = self.api.get(f'/api/v1/webconsole/hosts/abc/clusters/{CLUSTER_NAME}/sessions/blocking/',
+                                {'max_age': 60})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unregistered_cluster_is_not_found(self):
+        response = self.api.get(f'/api/v1/webconsole/hosts/{self.host.id}/clusters/unknown/sessions/blocking/',
+                                {'max_age': 60})
+        self.assertEqual(response.status_code, 404)
+
+
+class ClusterPollerTest(SimulatorTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch.object(cluster_poller, '_buffers', {}),
+                        mock.patch.object(cluster_poller, '_listeners', [])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_poll_drops_samples_of_removed_clusters(self):
+        cluster_poller.store([ClusterSample(self.host.id, 'Removed', [], []),
+                              ClusterSample(self.host.id + 1, CLUSTER_NAME, [], [])])
+        cluster_poller.poll()
+        self.assertIsNone(cluster_poller.latest(self.host.id, 'Removed'))
+        self.assertIsNone(cluster_poller.latest(self.host.id + 1, CLUSTER_NAME))
+        sample = cluster_poller.latest(self.host.id, CLUSTER_NAME)
+        self.assertEqual(len(sample.sessions), len(self.simulated_cluster().sessions))
+
+    def test_poll_keeps_history_of_registered_clusters(self):
+        cluster_poller.poll()
+        cluster_poller.poll()
+        self.assertEqual(len(cluster_poller.history_of(self.host.id, CLUSTER_NAME)), 2)
+
+
+class WorkingProcessLeaseTest(SimulatorTestMixin, TestCase):
+
+    def working_process_connection(self, *infobase_auth):
+        target = HostTarget(id=self.host.id, address=self.host.address, port=self.host.port,
+                            login='admin', pwd='', clusters=[])
+        with agent_interface(target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            try:
+                cluster_interface.add_infobase_auths(infobase_auth)
+                return cluster_interface.working_process_connection
+            finally:
+                cluster_interface.close()
+
+    def test_connection_with_other_infobase_credentials_is_not_reused(self):
+        first = self.working_process_connection(('user1', 'pwd'))
+        second = self.working_process_connection()
+        self.assertIsNot(second, first)
+        self.assertEqual(working_process_connection_pool.idle_count(), 2)
+
+    def test_connection_with_subset_of_credentials_is_reused(self):
+        first = self.working_process_connection(('user1', 'pwd'))
+        self.assertIs(self.working_process_connection(('user1', 'pwd'), ('user2', 'pwd')), first)
+        self.assertIsNot(self.working_process_connection(('user1', 'pwd')), first)
+
+    def test_connection_with_several_credentials_is_reused(self):
+        first = self.working_process_connection(('user1', 'pwd'), ('user2', 'pwd'))
+        self.assertIs(self.working_process_connection(('user2', 'pwd'), ('user1', 'pwd')), first)
+        self.assertEqual(working_process_connection_pool.idle_count(), 1)
+
+
+class WorkingProcessSelectionTest(SimulatorTestMixin, TestCase):
+    simulator_config = SimulatorConfig(infobases=1, sessions=0, working_processes=3)
+
+    def select(self, *states) -> int:
+        """
+        Задает рабочим процессам (доступная производительность, соединения, память, включен, активен)
+        и возвращает номер выбранного процесса
+        """
+        processes = self.simulated_cluster().working_processes
+        for process, (performance, connections, memory, enabled, running) in zip(processes, states):
+            process._properties.update(AvailablePerfomance=performance, Connections=connections, MemorySize=memory,
+                                       IsEnable=enabled, Running=running)
+        target = HostTarget(id=self.host.id, address=self.host.address, port=self.host.port,
+                            login='admin', pwd='', clusters=[])
+        with agent_interface(target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            selected = select_working_process(cluster_interface.get_working_processes())
+        return [process._properties['MainPort'] for process in processes].index(selected.main_port)
+
+    def test_highest_available_performance_is_selected(self):
+        self.assertEqual(self.select((100, 0, 0, True, 1), (200, 50, 900, True, 1), (150, 0, 0, True, 1)), 1)
+
+    def test_fewest_connections_break_performance_tie(self):
+        self.assertEqual(self.select((200, 30, 0, True, 1), (200, 10, 900, True, 1), (200, 20, 0, True, 1)), 1)
+
+    def test_least_memory_breaks_connections_tie(self):
+        self.assertEqual(self.select((200, 10, 500, True, 1), (200, 10, 700, True, 1), (200, 10, 300, True, 1)), 2)
+
+    def test_inactive_process_is_not_selected(self):
+        self.assertEqual(self.select((300, 0, 0, True, 0), (200, 0, 0, True, 1), (100, 0, 0, True, 1)), 1)
+
+    def test_disabled_process_is_selected_only_without_enabled_ones(self):
+        self.assertEqual(self.select((300, 0, 0, False, 1), (100, 0, 0, True, 1), (200, 0, 0, False, 1)), 1)
+        self.assertEqual(self.select((300, 0, 0, False, 1), (100, 0, 0, False, 1), (200, 0, 0, False, 1)), 0)
+
+    def test_no_running_processes(self):
+        with self.assertRaises(StopIteration):
+            self.select((300, 0, 0, True, 0), (100, 0, 0, True, 0), (200, 0, 0, True, 0))
+
+
+class ConnectionPoolTest(SimulatorTestMixin, TestCase):
+
+    def make_pool(self, **kwargs) -> 'ServerAgentConnectionPool':
+        pool = ServerAgentConnectionPool(**kwargs)
+        self.addCleanup(pool.clear)
+        return pool
+
+    @property
+    def key(self) -> tuple:
+        return self.host.address, self.host.port
+
+    def test_released_connection_is_reused(self):
+        pool = self.make_pool()
+        lease = pool.acquire(self.key)
+        pool.release(lease)
+        self.assertIs(pool.acquire(self.key), lease)
+        self.assertEqual(pool.idle_count(), 0)
+
+    def test_idle_connection_expires(self):
+        pool = self.make_pool(idle_timeout=0.05)
+        lease = pool.acquire(self.key)
+        pool.release(lease)
+        time.sleep(0.1)
+        self.assertIsNot(pool.acquire(self.key), lease)
+        self.assertIsNone(lease.connection)
+
+    def test_overflow_closes_oldest_connection(self):
+        pool = self.make_pool(max_size=2)
+        leases = [pool.acquire(self.key) for _ in range(3)]
+        for lease in leases:
+            pool.release(lease)
+        self.assertEqual(pool.idle_count(), 2)
+        self.assertIsNone(leases[0].connection)
+
+    def test_discarded_connection_is_closed(self):
+        pool = self.make_pool()
+        lease = pool.acquire(self.key)
+        pool.release(lease, discard=True)
+        self.assertEqual(pool.idle_count(), 0)
+        self.assertIsNone(lease.connection)
+
+    def test_health_check_runs_only_after_interval(self):
+        pool = self.make_pool(health_check_interval=60)
+        pool.release(pool.acquire(self.key))
+        self.simulator.stats.reset()
+        pool.release(pool.acquire(self.key))
+        self.assertEqual(self.simulator.stats.as_dict()['calls'], 0)
+        pool.health_check_interval = 0
+        pool.release(pool.acquire(self.key))
+        self.assertEqual(self.simulator.stats.as_dict()['calls'], 1)
+
+    def test_unhealthy_connection_is_replaced(self):
+        pool = self.make_pool(health_check_interval=0)
+        lease = pool.acquire(self.key)
+        pool.release(lease)
+        with mock.patch.object(lease.connection, 'get_clusters', side_effect=Exception('Connection lost')):
+            replacement = pool.acquire(self.key)
+        self.assertIsNot(replacement, lease)
+        self.assertIsNone(lease.connection)
+
+    def test_connection_is_not_reused_by_other_thread(self):
+        pool = self.make_pool()
+        lease = pool.acquire(self.key)
+        pool.release(lease)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.acquire(self.key)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], lease)
+        self.assertIs(pool.acquire(self.key), lease)
+
+
+class InventoryCacheTest(SimulatorTestMixin, TestCase):
+
+    @property
+    def target(self) -> 'HostTarget':
+        return HostTarget(id=self.host.id, address=self.host.address, port=self.host.port,
+                          login='admin', pwd='', clusters=[])
+
+    @contextmanager
+    def cluster_interface(self):
+        with agent_interface(self.target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            try:
+                yield cluster_interface
+            finally:
+                cluster_interface.close()
+
+    def calls(self, fn, *args) -> int:
+        self.simulator.stats.reset()
+        fn(*args)
+        return self.simulator.stats.as_dict()['calls']
+
+    def test_entry_expires_after_ttl(self):
+        cache = InventoryCache(ttl=0.05)
+        loader = mock.Mock(return_value=['ib1'])
+        cache.get(('srv1', '1540', 'clusters'), loader, str)
+        cache.get(('srv1', '1540', 'clusters'), loader, str)
+        self.assertEqual(loader.call_count, 1)
+        time.sleep(0.1)
+        cache.get(('srv1', '1540', 'clusters'), loader, str)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_entry_is_not_shared_between_threads(self):
+        cache = InventoryCache(ttl=60)
+        loader = mock.Mock(return_value=['ib1'])
+        cache.get(('srv1', '1540', 'clusters'), loader, str)
+        thread = threading.Thread(target=cache.get, args=(('srv1', '1540', 'clusters'), loader, str))
+        thread.start()
+        thread.join()
+        self.assertEqual(loader.call_count, 2)
+
+    def test_threads_keep_own_entries(self):
+        cache = InventoryCache(ttl=60)
+        loader = mock.Mock(side_effect=lambda: [threading.get_ident()])
+        key = ('srv1', '1540', 'clusters')
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def load_twice(name):
+            # Оба потока загружают запись до повторного чтения, чтобы проверить, что записи не вытесняют друг друга
+            first = cache.get(key, loader, str)
+            barrier.wait()
+            results[name] = first, cache.get(key, loader, str)
+
+        threads = [threading.Thread(target=load_twice, args=(name,)) for name in ('first', 'second')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(loader.call_count, 2)
+        for first, second in results.values():
+            self.assertIs(second, first)
+        self.assertIsNot(results['first'][0], results['second'][0])
+
+    def test_invalidate_by_key_prefix(self):
+        cache = InventoryCache(ttl=60)
+        loader = mock.Mock(return_value=['ib1'])
+        keys = [('srv1', '1540', 'clusters'), ('srv1', '1540', 'cluster', 'c1'), ('srv2', '1540', 'clusters')]
+        for key in keys:
+            cache.get(key, loader, str)
+        cache.invalidate('srv1', '1540')
+        for key in keys:
+            cache.get(key, loader, str)
+        self.assertEqual(loader.call_count, 5)
+
+    def test_find_is_case_insensitive(self):
+        entry = InventoryCache(ttl=0).get(('srv1', '1540', 'clusters'), lambda: ['IB1'], str)
+        self.assertEqual(entry.find('ib1'), 'IB1')
+        with self.assertRaises(StopIteration):
+            entry.find('ib2')
+
+    def test_infobase_list_is_cached(self):
+        with self.cluster_interface() as cluster_interface:
+            cluster_interface.get_infobases()
+            self.assertEqual(self.calls(cluster_interface.get_infobases), 0)
+            self.assertEqual(self.calls(cluster_interface.get_infobase, 'IB0001'), 0)
+
+    def test_infobase_update_resets_infobase_list(self):
+        with self.cluster_interface() as cluster_interface:
+            infobase = cluster_interface.get_infobase('ib0001')
+            infobase.descr = 'Updated'
+            cluster_interface.update_infobase(infobase)
+            self.assertGreater(self.calls(cluster_interface.get_infobases), 0)
+            self.assertEqual(cluster_interface.get_infobase('ib0001').descr, 'Updated')
+
+    def test_cluster_settings_change_resets_cluster_list(self):
+        with agent_interface(self.target) as ragent_interface:
+            ragent_interface.get_clusters()
+            self.assertEqual(self.calls(ragent_interface.get_clusters), 0)
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            cluster_interface.set_security_level(1)
+            self.assertEqual(self.calls(ragent_interface.get_clusters), 1)
+            self.assertEqual(ragent_interface.get_cluster(CLUSTER_NAME).security_level, 1)
+
+
+class TimeSeriesStoreTest(SimulatorTestMixin, TestCase):
+    start = 1700000400
+    key = ('1', 'cluster', 'infobase', 'ib0001')
+
+    def make_store(self) -> 'TimeSeriesStore':
+        # Минутные точки хранятся 5 минут, десятиминутные - час
+        store = TimeSeriesStore(['value'], [(600, 3600), (60, 300)])
+        for i in range(20):
+            store.add(self.start + 60 * i, [(self.key, [i])])
+        return store
+
+    def test_fine_tier_keeps_only_its_retention(self):
+        store = self.make_store()
+        tier = store._series[self.key].tiers[0]
+        self.assertEqual(len(tier), 5)
+        self.assertEqual(tier.oldest(), self.start + 60 * 14)
+        step, points = store.range(self.key, 'value', self.start + 1000, self.start + 1200, now=self.start + 1200)
+        self.assertEqual(step, 60)
+        self.assertEqual(points, [(self.start + 60 * i, i) for i in (17, 18, 19)])
+
+    def test_older_range_is_read_from_coarse_tier(self):
+        store = self.make_store()
+        step, points = store.range(self.key, 'value', self.start, self.start + 1200, now=self.start + 1200)
+        self.assertEqual(step, 600)
+        self.assertEqual(points, [(self.start, 4.5), (self.start + 600, 14.5)])
+
+    def test_late_point_is_ignored(self):
+        store = self.make_store()
+        store.add(self.start + 60 * 18, [(self.key, [1000])])
+        _, points = store.range(self.key, 'value', self.start + 1000, self.start + 1200, now=self.start + 1200)
+        self.assertEqual(points[-2:], [(self.start + 60 * 18, 18), (self.start + 60 * 19, 19)])
+
+    def test_prune_removes_series_older_than_coarsest_retention(self):
+        store = self.make_store()
+        latest = self.start + 60 * 19
+        self.assertEqual(store.prune(now=latest + 3600), 0)
+        self.assertEqual(store.prune(now=latest + 3601), 1)
+        self.assertEqual(store.keys(), [])
+
+    def test_percentiles(self):
+        store = self.make_store()
+        values = store.percentiles(self.key, 'value', self.start + 900, self.start + 1200, (50, 100),
+                                   now=self.start + 1200)
+        self.assertEqual(values, {50: 17, 100: 19})
+
+    def test_recorder_aggregates_simulated_sessions(self):
+        store = TimeSeriesStore(METRICS, [(60, 300)])
+        host_target, _ = get_cluster_target(self.host.id, CLUSTER_NAME)
+        samples = sample_host(host_target)
+        SessionMetricsRecorder(store)(samples)
+        timestamp = samples[0].taken_at.timestamp()
+        prefix = series_key(self.host.id, CLUSTER_NAME, 'infobase', '')[:-1]
+        total = sum(store.range(key, 'sessions', timestamp - 60, timestamp, now=timestamp)[1][0][1]
+                    for key in store.keys() if key[:-1] == prefix)
+        self.assertEqual(total, len(self.simulated_cluster().sessions))
+
+
+class CompiledRepresentationTest(SimulatorTestMixin, TestCase):
+    simulator_config = SimulatorConfig(infobases=10, sessions=50, seed=7)
+
+    def setUp(self):
+        super().setUp()
+        target = HostTarget(id=self.host.id, address=self.host.address, port=self.host.port,
+                            login='admin', pwd='', clusters=[])
+        with agent_interface(target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            try:
+                self.snapshots = {
+                    'clusters': take_snapshots(ragent_interface.get_clusters()),
+                    'infobases': take_snapshots(cluster_interface.get_infobases()),
+                    'sessions': take_snapshots(cluster_interface.get_sessions()),
+                    'working_processes': take_snapshots(cluster_interface.get_working_processes()),
+                }
+            finally:
+                cluster_interface.close()
+
+    def assertIdentical(self, serializer, snapshots):
+        self.assertTrue(snapshots)
+        represent = compile_representation(serializer)
+        renderer = JSONRenderer()
+        for snapshot in snapshots:
+            self.assertEqual(renderer.render(represent(snapshot)),
+                             renderer.render(serializer.to_representation(snapshot)))
+
+    def test_serializers_match_compiled_representation(self):
+        for serializer_class, kind in ((ShortClusterSerializer, 'clusters'),
+                                       (DetailClusterSerializer, 'clusters'),
+                                       (ShortInfobaseSerializer, 'infobases'),
+                                       (DetailInfobaseSerializer, 'infobases'),
+                                       (SessionSerializer, 'sessions'),
+                                       (WorkingProcessSerializer, 'working_processes')):
+            with self.subTest(serializer=serializer_class.__name__):
+                self.assertIdentical(serializer_class(), self.snapshots[kind])
+
+    def projected_session_serializer(self, *names) -> 'SessionSerializer':
+        serializer = SessionSerializer()
+        for name in [name for name in serializer.fields if name not in names]:
+            serializer.fields.pop(name)
+        return serializer
+
+    def test_projected_serializer_matches_compiled_representation(self):
+        serializer = self.projected_session_serializer('session_id', 'user_name', 'started_at')
+        self.assertIdentical(serializer, self.snapshots['sessions'])
+        self.assertEqual(set(compile_representation(serializer)(self.snapshots['sessions'][0])),
+                         {'session_id', 'user_name', 'started_at'})
+
+    def test_partial_snapshot_matches_compiled_representation(self):
+        target, _ = get_cluster_target(self.host.id, CLUSTER_NAME)
+        with agent_interface(target) as ragent_interface:
+            cluster_interface = ragent_interface.get_cluster_interface(CLUSTER_NAME)
+            cluster_interface.authenticate_cluster_admin('admin', '')
+            try:
+                snapshots = take_snapshots(cluster_interface.get_sessions(), ['session_id', 'user_name'])
+            finally:
+                cluster_interface.close()
+        self.assertIdentical(self.projected_session_serializer('session_id', 'user_name'), snapshots)
+        # Поле, свойство которого не прочитано в снимок, - ошибка, как и в DRF
+        serializer = SessionSerializer()
+        with self.assertRaises(AttributeError):
+            serializer.to_representation(snapshots[0])
+        with self.assertRaises(AttributeError):
+            compile_representation(serializer)(snapshots[0])
+
+    def test_dictionary_matches_serializer(self):
+        serializer = ShortInfobaseSerializer()
+        self.assertIdentical(serializer, [{'name': 'ib0001'}])
+
+    def test_api_list_matches_serializer(self):
+        response = self.api.get(self.cluster_url('sessions/'))
+        self.assertEqual(response.status_code, 200)
+        expected = JSONRenderer().render(SessionSerializer(self.snapshots['sessions'], many=True).data)
+        self.assertEqual(JSONRenderer().render(response.data), expected)
@@ -7,10 +7,16 @@ from .views import (
     HostAdminViewSet,
     ClusterViewSet,
     InfobaseViewSet,
+    SessionViewSet,
+    MonitoringViewSet,
+    FleetSessionView,
+    FleetTopSessionView,
+    JobViewSet,
 )
 
 host_router = SimpleRouter()
 host_router.register(r'hosts', HostViewSet, basename='host')
+host_router.register(r'jobs', JobViewSet, basename='job')
 
 host_admin_router = NestedSimpleRouter(host_router, r'hosts', lookup='host')
 host_admin_router.register(r'admins', HostAdminViewSet, basename='host-admin')
@@ -21,9 +27,19 @@ cluster_router.register(r'clusters', ClusterViewSet, basename='cluster')
 infobase_router = NestedSimpleRouter(cluster_router, r'clusters', lookup='cluster')
 infobase_router.register(r'infobases', InfobaseViewSet, basename='infobase')
 
+session_router = NestedSimpleRouter(cluster_router, r'clusters', lookup='cluster')
+session_router.register(r'sessions', SessionViewSet, basename='session')
+
+monitoring_router = NestedSimpleRouter(cluster_router, r'clusters', lookup='cluster')
+monitoring_router.register(r'monitoring', MonitoringViewSet, basename='monitoring')
+
 urlpatterns = [
     url(r'^', include(host_router.urls)),
     url(r'^', include(host_admin_router.urls)),
     url(r'^', include(cluster_router.urls)),
     url(r'^', include(infobase_router.urls)),
+    url(r'^', include(session_router.urls)),
+    url(r'^', include(monitoring_router.urls)),
+    url(r'^sessions/$', FleetSessionView.as_view(), name='fleet-sessions'),
+    url(r'^sessions/top/$', FleetTopSessionView.as_view(), name='fleet-sessions-top'),
 ]
@@ -1,17 +1,69 @@
+import datetime
+import hmac
+from typing import NamedTuple
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import (
+    serializers,
     status,
     permissions,
     viewsets,
     exceptions,
 )
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.views import APIView
 from rest_framework.mixins import (
     ListModelMixin,
     CreateModelMixin,
     RetrieveModelMixin,
 )
+from v8webconsole.clusterconfig.credentials import resolve_cluster
 from v8webconsole.clusterconfig.models import (
     Host,
+    Cluster,
+)
+from v8webconsole.core.blocking import (
+    analyze_blocking,
+    take_blocking_snapshots,
+)
+from v8webconsole.core.snapshots import (
+    take_snapshot,
+    take_snapshots,
+)
+from .batch import execute_batch
+from .fleet import (
+    filter_targets,
+    get_cluster_target,
+    get_host_targets,
+    iter_fleet_sessions,
+    stream_json,
+)
+from .jobs import job_runner
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    metrics_collector,
+)
+from .models import Job
+from .monitoring import cluster_poller
+from .session_metrics import (
+    DIMENSIONS,
+    METRICS,
+    series_key,
+    session_metrics,
+    session_metrics_recorder,
+)
+from .sessions import (
+    RANKING_METRICS,
+    fleet_top_sessions,
+    terminate_matching_sessions,
+    top_session_data,
+    top_sessions,
 )
 from .views_mixins import (
     RAgentInterfaceViewMixin,
@@ -27,9 +79,42 @@ from .serializers import (
     CreateInfobaseSerializer,
     UpdateInfobaseSerializer,
     DetailInfobaseSerializer,
+    InfobaseLockSerializer,
+    InfobaseUnlockSerializer,
+    SessionSerializer,
+    SessionTerminationSerializer,
+    WorkingProcessSerializer,
+    JobSerializer,
+    BatchSerializer,
 )
 
 
+def is_flag_set(request, name: str) -> bool:
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def is_async_request(request) -> bool:
+    return is_flag_set(request, 'async')
+
+
+def check_cluster_registered(host_pk, cluster_pk):
+    try:
+        resolve_cluster(host_pk, cluster_pk)
+    except Cluster.DoesNotExist:
+        raise exceptions.NotFound(f'Cluster with name [{cluster_pk}] does not exists')
+
+
+def enqueue_cluster_job(view, kind: str, params: dict, dbms_server: str = '') -> Response:
+    """
+    Ставит в очередь задание над кластером из URL представления и отвечает 202 со ссылкой на задание
+    """
+    host_pk, cluster_pk = view.kwargs['host_pk'], view.kwargs['cluster_pk']
+    check_cluster_registered(host_pk, cluster_pk)
+    job = job_runner.enqueue(kind, host_pk, cluster_pk, params, dbms_server, created_by=view.request.user)
+    location = reverse('job-detail', kwargs={'pk': job.id}, request=view.request)
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
 class HostViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.IsAuthenticated, )
 
@@ -51,13 +136,13 @@ class HostAdminViewSet(RAgentInterfaceViewMixin,
 
     def get_queryset(self):
         self.authenticate_agent()
-        return self.get_ragent_interface().get_agent_admins()
+        return take_snapshots(self.get_ragent_interface().get_agent_admins())
 
     def get_object(self):
         self.authenticate_agent()
         admin_name = self.kwargs['pk']
         try:
-            return self.get_ragent_interface().get_agent_admin(admin_name)
+            return take_snapshot(self.get_ragent_interface().get_agent_admin(admin_name))
         except StopIteration:
             raise exceptions.NotFound(f'RegUser with name [{admin_name}] does not exists')
 
@@ -65,6 +150,8 @@ class HostAdminViewSet(RAgentInterfaceViewMixin,
 class ClusterViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, viewsets.GenericViewSet):
     default_serializer_class = DetailClusterSerializer
 
+    snapshot_key_fields = ('cluster_name', )
+
     actions_map = {
         'list': ShortClusterSerializer,
         'retrieve': DetailClusterSerializer,
@@ -99,15 +186,24 @@ class ClusterViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, vie
         self.get_ragent_interface().unreg_cluster(instance, login, pwd)
 
 
+class UnreadableInfobase(NamedTuple):
+    name: str
+    error: str
+
+
 class InfobaseViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, viewsets.GenericViewSet):
     default_serializer_class = DetailInfobaseSerializer
 
+    snapshot_key_fields = ('name', )
+
     actions_map = {
         'list': ShortInfobaseSerializer,
         'create': CreateInfobaseSerializer,
         'update': UpdateInfobaseSerializer,
         'partial_update': UpdateInfobaseSerializer,
         'retrieve': default_serializer_class,
+        'lock': InfobaseLockSerializer,
+        'unlock': InfobaseUnlockSerializer,
     }
 
     destroy_mode_map = {
@@ -116,10 +212,43 @@ class InfobaseViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, vi
         'clear': 2,
     }
 
+    def is_detail_list(self) -> bool:
+        return self.action == 'list' and is_flag_set(self.request, 'detail')
+
+    def get_serializer_class(self):
+        if self.is_detail_list():
+            return self.default_serializer_class
+        return super().get_serializer_class()
+
     def get_queryset(self):
         self.authenticate_cluster_admin()
+        if self.is_detail_list():
+            self.authenticate_all_infobase_admins()
+            return self.get_cluster_interface().get_infobases()
         return self.get_cluster_interface().get_infobases_short()
 
+    def get_list_snapshots(self) -> list:
+        """
+        С параметром ?detail=true возвращаются полные описания информационных баз, полученные одним
+        списком после аутентификации всеми учетными данными администраторов баз кластера.
+        Для баз, свойства которых прочитать не удалось, возвращаются имя и ошибка
+        """
+        if not self.is_detail_list():
+            return super().get_list_snapshots()
+        fields = self.get_snapshot_fields()
+        snapshots = []
+        for infobase in self.get_queryset():
+            try:
+                snapshots.append(self.get_snapshot(infobase, fields))
+            except Exception as e:
+                snapshots.append(UnreadableInfobase(infobase.name, str(e)))
+        return snapshots
+
+    def represent_snapshot(self, represent, snapshot):
+        if isinstance(snapshot, UnreadableInfobase):
+            return snapshot._asdict()
+        return super().represent_snapshot(represent, snapshot)
+
     def get_object(self):
         ib_name = self.kwargs['pk']
         self.authenticate_cluster_admin()
@@ -129,6 +258,18 @@ class InfobaseViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, vi
         except StopIteration:
             raise exceptions.NotFound(f'Infobase with name [{ib_name}] does not exists')
 
+    def create(self, request, **kwargs):
+        """
+        С параметром ?async=1 информационная база создается в фоновом задании
+        """
+        if not is_async_request(request):
+            return super().create(request, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data)
+        dbms_server = params['db_server_name'] if params.get('create_db') else ''
+        return enqueue_cluster_job(self, 'create_infobase', params, dbms_server)
+
     def perform_create(self, serializer):
         self.authenticate_cluster_admin()
         return serializer.save(cluster_interface=self.get_cluster_interface())
@@ -137,10 +278,372 @@ class InfobaseViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, vi
         return serializer.save(cluster_interface=self.get_cluster_interface())
 
     def destroy(self, request, host_pk=None, cluster_pk=None, pk=None, **kwargs):
+        """
+        С параметром ?async=1 информационная база удаляется в фоновом задании
+        """
         instance = self.get_object()
-        mode = self.destroy_mode_map[request.query_params.get('mode', 'persist')]
+        mode_name = request.query_params.get('mode', 'persist')
+        mode = self.destroy_mode_map[mode_name]
+        if is_async_request(request):
+            dbms_server = instance.db_server_name if mode_name != 'persist' else ''
+            return enqueue_cluster_job(self, 'drop_infobase', {'name': instance.name, 'mode': mode}, dbms_server)
         self.perform_destroy(instance, mode)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance, mode):
-        self.get_cluster_interface().working_process_connection.drop_infobase(instance, mode)
+        self.get_cluster_interface().drop_infobase(instance, mode)
+
+    @action(detail=False, methods=['post'])
+    def lock(self, request, **kwargs):
+        """
+        Блокирует сеансы и фоновые задания нескольких информационных баз в фоновом задании
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return enqueue_cluster_job(self, 'lock_infobases', dict(serializer.validated_data))
+
+    @action(detail=False, methods=['post'])
+    def unlock(self, request, **kwargs):
+        """
+        Снимает блокировку нескольких информационных баз в фоновом задании
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return enqueue_cluster_job(self, 'unlock_infobases', dict(serializer.validated_data))
+
+
+class TopSessionsQuerySerializer(serializers.Serializer):
+    metric = serializers.ChoiceField(choices=RANKING_METRICS)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=1000,
+        default=20,
+    )
+
+
+class BlockingQuerySerializer(serializers.Serializer):
+    max_age = serializers.FloatField(
+        min_value=0,
+        required=False,
+    )
+
+
+class SessionViewSet(ClusterInterfaceViewMixin, MultiSerializerViewSetMixin, viewsets.GenericViewSet):
+    default_serializer_class = SessionSerializer
+
+    snapshot_key_fields = ('infobase', 'session_id')
+
+    actions_map = {
+        'list': SessionSerializer,
+        'terminate': SessionTerminationSerializer,
+    }
+
+    def get_queryset(self):
+        self.authenticate_cluster_admin()
+        return self.get_cluster_interface().get_sessions()
+
+    @action(detail=False, methods=['post'])
+    def terminate(self, request, **kwargs):
+        """
+        Завершает все сеансы кластера, удовлетворяющие условиям отбора.
+        С параметром ?async=1 сеансы завершаются в фоновом задании
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if is_async_request(request):
+            return enqueue_cluster_job(self, 'terminate_sessions', dict(serializer.validated_data))
+        self.authenticate_cluster_admin()
+        host_target, cluster_target = get_cluster_target(self.kwargs['host_pk'], self.kwargs['cluster_pk'])
+        report = terminate_matching_sessions(
+            self.get_cluster_interface(), host_target, cluster_target, **serializer.validated_data
+        )
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def top(self, request, **kwargs):
+        """
+        Сеансы кластера с наибольшим значением показателя (?metric=, ?limit=) по убыванию
+        """
+        query = TopSessionsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        metric, limit = query.validated_data['metric'], query.validated_data['limit']
+        self.authenticate_cluster_admin()
+        snapshots = top_sessions(self.get_cluster_interface().get_sessions(), metric, limit)
+        return Response([top_session_data(snapshot, metric) for snapshot in snapshots], status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def blocking(self, request, **kwargs):
+        """
+        Цепочки блокировок сеансов кластера: корневые блокирующие сеансы, глубина цепочек и взаимные блокировки.
+        Если задан ?max_age= и снимок фонового опроса не старше max_age секунд, анализируется он,
+        без обращений к агенту сервера
+        """
+        query = BlockingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        max_age = query.validated_data.get('max_age')
+        if max_age is not None:
+            # Снимок отдается только для зарегистрированного кластера, как и данные агента
+            check_cluster_registered(self.kwargs['host_pk'], self.kwargs['cluster_pk'])
+            cluster_poller.ensure_started()
+            sample = cluster_poller.latest(self.kwargs['host_pk'], self.kwargs['cluster_pk'])
+            if sample is not None and sample.age <= max_age:
+                return Response({
+                    'source': 'sample',
+                    'taken_at': sample.taken_at,
+                    **analyze_blocking(sample.sessions),
+                }, status=status.HTTP_200_OK)
+        self.authenticate_cluster_admin()
+        taken_at = timezone.now()
+        snapshots = take_blocking_snapshots(self.get_cluster_interface().get_sessions())
+        return Response({
+            'source': 'agent',
+            'taken_at': taken_at,
+            **analyze_blocking(snapshots),
+        }, status=status.HTTP_200_OK)
+
+
+class JobViewSet(ListModelMixin, RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Фоновые задания. Список можно отфильтровать по ?status=, ?kind= и ?host=
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        # Без V8_JOB_AUTOSTART задания, оставшиеся в очереди после перезапуска, выполняются после первого обращения
+        job_runner.ensure_started()
+        queryset = Job.objects.all()
+        for param, lookup in (('status', 'status'), ('kind', 'kind'), ('host', 'host_id')):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, **kwargs):
+        """
+        Отменяет ожидающее задание, либо запрашивает отмену выполняющегося
+        """
+        job = job_runner.cancel(self.get_object())
+        return Response(self.get_serializer(job).data, status=status.HTTP_200_OK)
+
+
+class FleetQuerySerializer(serializers.Serializer):
+    timeout = serializers.FloatField(
+        min_value=0,
+        required=False,
+    )
+
+
+class FleetSessionView(APIView):
+    """
+    Сеансы всех кластеров всех зарегистрированных серверов.
+    Серверы опрашиваются параллельно, сеансы передаются клиенту по мере получения,
+    серверы, не ответившие за отведенное время (?timeout=, в секундах), перечисляются в errors
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get(self, request, **kwargs):
+        query = FleetQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        timeout = query.validated_data.get('timeout', settings.V8_FLEET_HOST_TIMEOUT)
+        events = iter_fleet_sessions(get_host_targets(), timeout)
+        return StreamingHttpResponse(stream_json(events), content_type='application/json')
+
+
+class FleetTopSessionsQuerySerializer(FleetQuerySerializer, TopSessionsQuerySerializer):
+    host = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+    )
+    cluster = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+    )
+
+
+class FleetTopSessionView(APIView):
+    """
+    Сеансы с наибольшим значением показателя среди кластеров всех зарегистрированных серверов,
+    либо только указанных серверов (?host=) и кластеров (?cluster=).
+    Серверы, не ответившие за отведенное время (?timeout=, в секундах), перечисляются в errors
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get(self, request, **kwargs):
+        query = FleetTopSessionsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        targets = filter_targets(get_host_targets(), params.get('host'), params.get('cluster'))
+        results, errors = fleet_top_sessions(targets, params['metric'], params['limit'],
+                                             params.get('timeout', settings.V8_FLEET_HOST_TIMEOUT))
+        return Response({'metric': params['metric'], 'results': results, 'errors': errors},
+                        status=status.HTTP_200_OK)
+
+
+class SampleNotReady(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Cluster has not been sampled yet, try again later.'
+    default_code = 'sample_not_ready'
+
+
+class SeriesQuerySerializer(serializers.Serializer):
+    by = serializers.ChoiceField(choices=tuple(DIMENSIONS))
+    name = serializers.CharField(required=False)
+    metric = serializers.ChoiceField(choices=METRICS, default='cpu_time_last_5min')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    percentiles = serializers.CharField(default='50,95,99')
+
+    def validate_percentiles(self, value):
+        try:
+            ps = [float(p) for p in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError('Comma separated numbers expected')
+        if any(not 0 < p <= 100 for p in ps):
+            raise serializers.ValidationError('Percentiles must be in (0, 100]')
+        return ps
+
+    def validate(self, attrs):
+        attrs['end'] = attrs.get('end') or timezone.now()
+        attrs['start'] = attrs.get('start') or attrs['end'] - datetime.timedelta(hours=1)
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be later than end')
+        return attrs
+
+
+class MonitoringViewSet(viewsets.ViewSet):
+    """
+    Показатели кластера из последнего снимка фонового опроса, без обращения к агенту сервера.
+    Поле age - возраст снимка в секундах
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get_sample(self):
+        host_pk, cluster_pk = self.kwargs['host_pk'], self.kwargs['cluster_pk']
+        check_cluster_registered(host_pk, cluster_pk)
+        sample = cluster_poller.wait_latest(host_pk, cluster_pk, timeout=settings.V8_FLEET_HOST_TIMEOUT)
+        if sample is None:
+            raise SampleNotReady()
+        return sample
+
+    def sample_response(self, sample, serializer_class, instances):
+        return Response({
+            'taken_at': sample.taken_at,
+            'age': round(sample.age, 3),
+            'results': serializer_class(instances, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def sessions(self, request, **kwargs):
+        sample = self.get_sample()
+        return self.sample_response(sample, SessionSerializer, sample.sessions)
+
+    @action(detail=False, methods=['get'], url_path='working-processes')
+    def working_processes(self, request, **kwargs):
+        sample = self.get_sample()
+        return self.sample_response(sample, WorkingProcessSerializer, sample.working_processes)
+
+    @action(detail=False, methods=['get'])
+    def history(self, request, **kwargs):
+        self.get_sample()
+        samples = cluster_poller.history_of(self.kwargs['host_pk'], self.kwargs['cluster_pk'])
+        return Response([
+            {
+                'taken_at': sample.taken_at,
+                'age': round(sample.age, 3),
+                'sessions': len(sample.sessions),
+                'working_processes': len(sample.working_processes),
+            }
+            for sample in reversed(samples)
+        ], status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def series(self, request, **kwargs):
+        """
+        История показателя сеансов по информационной базе или пользователю (?by=infobase|user&name=).
+        Без name возвращаются перцентили показателя по всем информационным базам или пользователям кластера
+        """
+        host_pk, cluster_pk = self.kwargs['host_pk'], self.kwargs['cluster_pk']
+        check_cluster_registered(host_pk, cluster_pk)
+        cluster_poller.ensure_started()
+        query = SeriesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        start, end = params['start'].timestamp(), params['end'].timestamp()
+
+        def percentiles_of(name):
+            key = series_key(host_pk, cluster_pk, params['by'], name)
+            values = session_metrics.percentiles(key, params['metric'], start, end, params['percentiles'])
+            return {f'p{p:g}': value for p, value in values.items()}
+
+        if 'name' not in params:
+            names = session_metrics_recorder.names(host_pk, cluster_pk, params['by'])
+            return Response({
+                'metric': params['metric'],
+                'results': [{'name': name, 'percentiles': percentiles_of(name)} for name in names],
+            }, status=status.HTTP_200_OK)
+        name = params['name'].lower() if params['by'] == 'infobase' else params['name']
+        step, points = session_metrics.range(series_key(host_pk, cluster_pk, params['by'], name),
+                                             params['metric'], start, end)
+        return Response({
+            'metric': params['metric'],
+            'step': step,
+            'points': [
+                {'time': datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc), 'value': value}
+                for t, value in points
+            ],
+            'percentiles': percentiles_of(name),
+        }, status=status.HTTP_200_OK)
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Доступ сборщика Prometheus по статическому токену V8_METRICS_TOKEN в заголовке Authorization: Bearer <token>
+    """
+
+    def authenticate(self, request):
+        token = settings.V8_METRICS_TOKEN
+        if not token:
+            return None
+        parts = get_authorization_header(request).split()
+        if len(parts) != 2 or parts[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(parts[1], token.encode()):
+            return None
+        return AnonymousUser(), 'metrics'
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="metrics"'
+
+
+class HasMetricsAccess(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        return request.auth == 'metrics' or bool(request.user and request.user.is_authenticated)
+
+
+class MetricsView(APIView):
+    """
+    Показатели рабочих процессов и лицензий всех зарегистрированных кластеров в текстовом формате Prometheus
+    """
+    authentication_classes = (MetricsTokenAuthentication, JWTAuthentication)
+    permission_classes = (HasMetricsAccess, )
+
+    def get(self, request, **kwargs):
+        return HttpResponse(metrics_collector.get(), content_type=METRICS_CONTENT_TYPE)
+
+
+class BatchView(APIView):
+    """
+    Выполняет несколько запросов к API за один вызов. Запросы выполняются по очереди
+    с общими соединениями с серверами 1С и возвращаются в том же порядке
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def post(self, request, **kwargs):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = execute_batch(request, serializer.validated_data['operations'], excluded_views=(BatchView, ))
+        return Response({'results': results}, status=status.HTTP_200_OK)
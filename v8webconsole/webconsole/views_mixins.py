@@ -1,8 +1,22 @@
-from typing import Optional
+from concurrent.futures import TimeoutError
+from contextlib import nullcontext
+from typing import Dict, Iterable, Iterator, List, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
 from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.fields import Field
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
 from rest_framework.settings import api_settings
-from v8webconsole.clusterconfig.models import Host
+from v8webconsole.clusterconfig.credentials import (
+    ResolvedCluster,
+    ResolvedHost,
+    resolve_cluster,
+    resolve_host,
+)
 from v8webconsole.core.cluster import (
     ServerAgentControlInterface,
     ClusterControlInterface,
@@ -10,20 +24,114 @@ from v8webconsole.core.cluster import (
 from v8webconsole.clusterconfig.models import (
     Cluster,
 )
+from v8webconsole.core.pool import PooledConnection
+from v8webconsole.core.snapshots import take_snapshot
+from .batch import (
+    HostConnections,
+    current_connection_scope,
+)
+from .filters import (
+    SnapshotFilterBackend,
+    SnapshotOrderingFilter,
+)
+from .middleware import database_timing
+from .pagination import SnapshotCursorPagination
+from .representation import Representation, compile_representation
+from .resources import (
+    agent_connection_pool,
+    com_executor,
+    host_apartment_key,
+    inventory_cache,
+    working_process_connection_pool,
+)
+from .streaming import StreamingJSONResponse
+
+
+def to_plain_data(data):
+    """
+    Копирует результат сериализации в обычные списки и словари, отбрасывая ссылки на сериализаторы
+    и, следовательно, на COM-объекты, которые нельзя передавать за пределы их апартамента
+    """
+    if isinstance(data, dict):
+        return {key: to_plain_data(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_plain_data(value) for value in data]
+    return data
 
 
 class MultiSerializerViewSetMixin:
     """
     Примесь, которая позволяет переопределяя словарь actions_map управлять, какой сериализатор
-    будет возвращен методом get_serializer
+    будет возвращен методом get_serializer.
+    Для чтения сериализаторам передаются снимки объектов, а не обертки COM-объектов.
+    При чтении (list, retrieve) в снимок попадают только свойства, которые выдает сериализатор,
+    а параметр ?fields=name,descr ограничивает их перечисленными полями.
+    Список снимков отбирается, сортируется и делится на страницы по полям сериализатора (см. filters.py, pagination.py)
     """
     actions_map = {}
 
     default_serializer_class = None
 
+    read_actions = ('list', 'retrieve')
+
+    filter_backends = (SnapshotFilterBackend, SnapshotOrderingFilter)
+
+    pagination_class = SnapshotCursorPagination
+
+    # Поля, однозначно определяющие объект в списке. По ним курсор находит место продолжения списка
+    snapshot_key_fields = ()
+
+    def get_serializer_class(self):
+        return self.actions_map.setdefault(self.action, self.default_serializer_class)
+
     def get_serializer(self, *args, **kwargs):
         kwargs['context'] = self.get_serializer_context()
-        return self.actions_map.setdefault(self.action, self.default_serializer_class)(*args, **kwargs)
+        serializer = self.get_serializer_class()(*args, **kwargs)
+        if self.action in self.read_actions:
+            fields = getattr(serializer, 'child', serializer).fields
+            for name in [name for name in fields if name not in self.get_read_fields()]:
+                fields.pop(name)
+        return serializer
+
+    def get_read_fields(self) -> List[str]:
+        """
+        Выдаваемые при чтении поля сериализатора, при наличии ?fields= - только перечисленные
+        """
+        if not hasattr(self, '_read_fields'):
+            fields = [name for name, field in self.get_serializer_class()().fields.items() if not field.write_only]
+            requested = self.request.query_params.get('fields')
+            if requested:
+                requested = {name.strip() for name in requested.split(',') if name.strip()}
+                unknown = sorted(requested.difference(fields))
+                if unknown:
+                    raise ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}'})
+                fields = [name for name in fields if name in requested]
+            self._read_fields = fields
+        return self._read_fields
+
+    def get_filterable_fields(self) -> Dict[str, Field]:
+        """
+        Поля сериализатора, по которым можно отбирать и сортировать список: простые значения атрибутов снимка
+        """
+        return {name: field for name, field in self.get_serializer_class()().fields.items()
+                if not field.write_only and not isinstance(field, BaseSerializer)
+                and field.source != '*' and '.' not in field.source}
+
+    def get_snapshot_fields(self) -> Optional[List[str]]:
+        """
+        Свойства, которые нужно прочитать в снимок для чтения, в том числе для отбора, сортировки и пагинации списка
+        """
+        names = list(self.get_read_fields())
+        if self.action == 'list':
+            components = [backend() for backend in self.filter_backends] + [self.paginator]
+            for component in components:
+                if hasattr(component, 'get_required_fields'):
+                    names.extend(component.get_required_fields(self.request, self))
+        serializer_fields = self.get_serializer_class()().fields
+        sources = [serializer_fields[name].source for name in dict.fromkeys(names)]
+        if '*' in sources:
+            return None
+        return [source.split('.')[0] for source in sources]
 
     def get_default_serializer_class(self):
         return self.default_serializer_class
@@ -31,31 +139,66 @@ class MultiSerializerViewSetMixin:
     def get_default_serializer(self, *args, **kwargs):
         return self.get_default_serializer_class()(*args, **kwargs)
 
+    def get_snapshot(self, instance, fields: Optional[Iterable[str]] = None):
+        return take_snapshot(instance, fields)
+
     def get_success_headers(self, data):
         try:
             return {'Location': str(data[api_settings.URL_FIELD_NAME])}
         except (TypeError, KeyError):
             return {}
 
+    def get_list_snapshots(self) -> list:
+        fields = self.get_snapshot_fields()
+        return [self.get_snapshot(instance, fields) for instance in self.get_queryset()]
+
+    def represent_snapshot(self, represent: Representation, snapshot):
+        return represent(snapshot)
+
+    def serialize_list(self, snapshots: list) -> Iterator:
+        """
+        Данные снимков списка. Снимки сериализуются по мере перебора результата
+        """
+        represent = compile_representation(self.get_serializer(many=True).child)
+        return (self.represent_snapshot(represent, snapshot) for snapshot in snapshots)
+
+    def should_stream_list(self, snapshots: list) -> bool:
+        """
+        Большие списки в формате JSON отправляются потоком, остальные ответы формируются целиком
+        """
+        return len(snapshots) >= settings.V8_STREAMING_LIST_THRESHOLD \
+            and isinstance(self.request.accepted_renderer, JSONRenderer)
+
+    def validate_list_query(self):
+        """
+        Проверяет параметры отбора, сортировки и пагинации до получения списка у агента сервера
+        """
+        components = [backend() for backend in self.filter_backends] + [self.paginator]
+        for component in components:
+            if hasattr(component, 'validate_query'):
+                component.validate_query(self.request, self)
+
     def list(self, request, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        page = self.paginate_queryset(queryset)
+        self.validate_list_query()
+        snapshots = self.filter_queryset(self.get_list_snapshots())
+        page = self.paginate_queryset(snapshots)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            return self.get_paginated_response(list(self.serialize_list(page)))
+        if self.should_stream_list(snapshots):
+            return StreamingJSONResponse(self.serialize_list(snapshots), status=status.HTTP_200_OK)
+        return Response(list(self.serialize_list(snapshots)), status=status.HTTP_200_OK)
 
     def retrieve(self, request, **kwargs):
-        obj = self.get_object()
-        serializer = self.get_serializer(obj)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = self.get_snapshot_fields()
+        snapshot = self.get_snapshot(self.get_object(), fields)
+        represent = compile_representation(self.get_serializer(snapshot))
+        return Response(represent(snapshot), status=status.HTTP_200_OK)
 
     def create(self, request, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = self.perform_create(serializer)
-        detail_serializer = self.get_default_serializer(instance)
+        detail_serializer = self.get_default_serializer(self.get_snapshot(instance))
         headers = self.get_success_headers(serializer.data)
         return Response(detail_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -72,7 +215,7 @@ class MultiSerializerViewSetMixin:
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         instance = self.perform_update(serializer)
-        detail_serializer = self.get_default_serializer(instance)
+        detail_serializer = self.get_default_serializer(self.get_snapshot(instance))
         return Response(detail_serializer.data, status=status.HTTP_200_OK)
 
     def perform_update(self, serializer):
@@ -80,46 +223,146 @@ class MultiSerializerViewSetMixin:
 
 
 class RAgentInterfaceViewMixin:
+    """
+    Примесь, предоставляющая интерфейс управления агентом сервера.
+    Соединение с агентом берется из пула на время обработки запроса и возвращается в него в finalize_response.
+    Запрос целиком обрабатывается в COM-апартаменте, закрепленном за сервером, в ответ передаются только обычные данные
+    """
     _ragent_interface: Optional[ServerAgentControlInterface]
+    _ragent_lease: Optional[PooledConnection]
 
     def get_ragent_interface(self) -> ServerAgentControlInterface:
         if not hasattr(self, '_ragent_interface'):
             host_id = self.kwargs['host_pk']
-            self.__host = Host.objects.get(id=host_id)
-            self._ragent_interface = ServerAgentControlInterface(host=self.__host.address, port=self.__host.port)
+            self.__host = self.get_resolved_host()
+            self._ragent_lease_broken = False
+            # Внутри области соединений (например, пакетного запроса) соединение с агентом общее для всех запросов
+            self._ragent_scope = current_connection_scope.get()
+            connections = self._ragent_scope.get_connections(host_id) if self._ragent_scope is not None else None
+            if connections is None:
+                lease = agent_connection_pool.acquire((self.__host.address, self.__host.port))
+                connections = HostConnections(lease, ServerAgentControlInterface(
+                    host=self.__host.address,
+                    port=self.__host.port,
+                    v8comconnector=lease.connector,
+                    agent_connection=lease.connection,
+                    inventory_cache=inventory_cache,
+                    working_process_pool=working_process_connection_pool,
+                ))
+                if self._ragent_scope is not None:
+                    self._ragent_scope.add_connections(host_id, connections)
+            self._ragent_connections = connections
+            self._ragent_lease = connections.lease
+            self._ragent_interface = connections.ragent_interface
         return self._ragent_interface
 
+    def dispatch(self, request, *args, **kwargs):
+        future = com_executor.submit(host_apartment_key(kwargs.get('host_pk')), self.dispatch_in_apartment,
+                                     request, *args, **kwargs)
+        try:
+            return future.result(settings.V8_COM_CALL_TIMEOUT or None)
+        except TimeoutError:
+            # Ответ формируется без участия представления: оно может продолжать выполняться в апартаменте
+            if future.cancel():
+                return JsonResponse({'errors': [{
+                    'code': 'apartment_busy',
+                    'detail': 'All COM apartments serving this server are busy, try again later',
+                }]}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return JsonResponse({'errors': [{
+                'code': 'agent_timeout',
+                'detail': 'The server agent did not respond in time',
+            }]}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def dispatch_in_apartment(self, request, *args, **kwargs):
+        in_worker = com_executor.in_worker()
+        if in_worker:
+            close_old_connections()
+        try:
+            # В потоке запроса (V8_COM_WORKERS=0) запросы к базе уже учитывает ServerTimingMiddleware
+            with database_timing() if in_worker else nullcontext():
+                response = super().dispatch(request, *args, **kwargs)
+            if isinstance(response, Response):
+                response.data = to_plain_data(response.data)
+            return response
+        finally:
+            if in_worker:
+                close_old_connections()
+
+    def release_ragent_interface(self):
+        lease = getattr(self, '_ragent_lease', None)
+        if lease is not None:
+            self._ragent_lease = None
+            # Ссылки на COM-объекты не должны пережить обработку запроса в апартаменте
+            cluster_interface = self.__dict__.pop('_cluster_interface', None)
+            self.__dict__.pop('_ragent_interface', None)
+            self.__dict__.pop('_ragent_connections', None)
+            scope = self.__dict__.pop('_ragent_scope', None)
+            if scope is not None:
+                # Соединения области освобождаются вместе с ней, неисправные - сразу
+                if self._ragent_lease_broken:
+                    scope.release(self.kwargs['host_pk'], discard=True)
+                return
+            if cluster_interface is not None:
+                cluster_interface.close(discard=self._ragent_lease_broken)
+            agent_connection_pool.release(lease, discard=self._ragent_lease_broken)
+
+    def handle_exception(self, exc):
+        if not isinstance(exc, APIException):
+            # Непредвиденная ошибка могла быть вызвана разрывом соединения с агентом,
+            # такое соединение не следует возвращать в пул
+            self._ragent_lease_broken = True
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self.release_ragent_interface()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_resolved_host(self) -> ResolvedHost:
+        return resolve_host(self.kwargs['host_pk'])
+
+    def get_server_time_zone(self) -> str:
+        return self.get_resolved_host().time_zone
+
+    def get_agent_admin_credentials(self):
+        return self.get_resolved_host().agent_admin
+
     def authenticate_agent(self):
         ragent_interface = self.get_ragent_interface()
-        credentials = self.__host.host_credentials.all()
-        if len(credentials):
-            creds = credentials[0]
-            login, pwd = creds.login, creds.pwd
-        else:
-            login, pwd = '', ''
-        ragent_interface.authenticate_agent(login, pwd)
+        if not ragent_interface.agent_authenticated:
+            login, pwd = self.get_agent_admin_credentials()
+            ragent_interface.authenticate_agent(login, pwd)
 
 
 class ClusterInterfaceViewMixin(RAgentInterfaceViewMixin):
     _cluster_interface: Optional[ClusterControlInterface]
 
+    def get_resolved_cluster(self) -> ResolvedCluster:
+        return resolve_cluster(self.kwargs['host_pk'], self.kwargs['cluster_pk'])
+
+    def get_resolved_host(self) -> ResolvedHost:
+        # Сервер зарегистрированного кластера читается вместе с цепочкой его учетных данных
+        if 'cluster_pk' in self.kwargs:
+            try:
+                return self.get_resolved_cluster().host
+            except Cluster.DoesNotExist:
+                pass
+        return super().get_resolved_host()
+
     def get_cluster_model(self) -> Cluster:
-        return Cluster.objects.get(name__iexact=self.kwargs['cluster_pk'])
+        return Cluster.objects.get(host_id=self.kwargs['host_pk'], name__iexact=self.kwargs['cluster_pk'])
 
     def get_cluster_interface(self) -> ClusterControlInterface:
         if not hasattr(self, '_cluster_interface'):
-            self._cluster_interface = self.get_ragent_interface().get_cluster_interface(self.kwargs['cluster_pk'])
+            self.get_ragent_interface()
+            if self._ragent_scope is not None:
+                # Интерфейс кластера области сохраняет выполненные аутентификации между запросами
+                self._cluster_interface = self._ragent_connections.get_cluster_interface(self.kwargs['cluster_pk'])
+            else:
+                self._cluster_interface = self._ragent_interface.get_cluster_interface(self.kwargs['cluster_pk'])
         return self._cluster_interface
 
     def get_cluster_admin_credentials(self):
-        cluster = self.get_cluster_model()
-        credentials = cluster.cluster_credentials.all()
-        if len(credentials):
-            creds = credentials[0]
-            login, pwd = creds.login, creds.pwd
-        else:
-            login, pwd = '', ''
-        return login, pwd
+        return self.get_resolved_cluster().cluster_admin
 
     def authenticate_cluster_admin(self):
         cluster_interface = self.get_cluster_interface()
@@ -131,20 +374,20 @@ class ClusterInterfaceViewMixin(RAgentInterfaceViewMixin):
             )
 
     def authenticate_infobase_default_admin(self):
-        cluster = self.get_cluster_model()
-        credentials = cluster.infobase_default_credentials.all()
-        for c in credentials:
-            self.add_infobase_auth(c.login, c.pwd)
+        self.add_infobase_auths(self.get_resolved_cluster().infobase_default_admins)
 
     def authenticate_infobase_admin(self, infobase_name):
-        cluster = self.get_cluster_model()
-        credentials = cluster.infobase_credentials.filter(name__iexact=infobase_name)
-        if len(credentials):
-            creds = credentials[0]
-            login, pwd = creds.login, creds.pwd
-            self.add_infobase_auth(login, pwd)
-        else:
-            self.authenticate_infobase_default_admin()
-
-    def add_infobase_auth(self, login, password):
-        self.get_cluster_interface().working_process_connection.add_authentication(login, password)
+        self.add_infobase_auths(self.get_resolved_cluster().get_infobase_credentials(infobase_name))
+
+    def authenticate_all_infobase_admins(self):
+        """
+        Аутентифицирует соединение с рабочим процессом всеми учетными данными администраторов
+        информационных баз кластера, чтобы прочитать свойства всех баз одним списком
+        """
+        cluster = self.get_resolved_cluster()
+        self.add_infobase_auths(dict.fromkeys([*cluster.infobase_admins.values(), *cluster.infobase_default_admins]))
+
+    def add_infobase_auths(self, credentials):
+        # Интерфейс кластера не выполняет повторно аутентификацию, уже выполненную в соединении с рабочим процессом.
+        # Учетные данные передаются одним набором, чтобы из пула было выбрано соединение со всеми ними
+        self.get_cluster_interface().add_infobase_auths(credentials)
@@ -12,5 +12,9 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'v8webconsole.settings')
+# Web server processes run background jobs themselves unless configured otherwise
+os.environ.setdefault('V8_JOB_AUTOSTART', 'True')
+# and sample clusters from the start instead of waiting for the first monitoring request
+os.environ.setdefault('V8_MONITORING_AUTOSTART', 'True')
 
 application = get_wsgi_application()